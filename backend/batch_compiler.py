@@ -0,0 +1,237 @@
+"""
+Компилятор batch запросов Битрикс24.
+
+Операции описываются методом и параметрами (вложенные словари и списки), а значение,
+которое станет известно только после другой операции, задается ссылкой Ref: например,
+контакт с COMPANY_ID=Ref("company_0") создается после компании company_0. Компилятор
+упорядочивает операции по зависимостям, раскладывает их по вызовам batch не больше
+50 команд и кодирует параметры как PHP http_build_query. Ссылка внутри одного вызова
+превращается в $result[company_0] и подставляется самим Битрикс24, ссылка на операцию
+из предыдущего вызова - в уже полученное значение. Ошибки команд возвращаются по ключам
+исходных операций.
+"""
+
+import re
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+from bitrix_api import bx_call
+
+logger = logging.getLogger(__name__)
+
+MAX_COMMANDS = 50  # batch принимает не больше 50 команд
+KEY_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+DEPENDENCY_FAILED = "DEPENDENCY_FAILED"
+
+# Отправляет команды одного вызова batch и возвращает ответ ({"result": {"result": ..., "result_error": ...}})
+# или None, если вызов не прошел
+BatchSender = Callable[[Dict[str, str]], Optional[dict]]
+
+
+class Ref:
+    """Ссылка на результат операции: Ref("company_0") -> $result[company_0], Ref("list", 0, "ID") -> $result[list][0][ID]"""
+
+    __slots__ = ("key", "path")
+
+    def __init__(self, key: str, *path):
+        self.key = key
+        self.path = path
+
+    def expression(self) -> str:
+        return f"$result[{self.key}]" + "".join(f"[{part}]" for part in self.path)
+
+    def resolve(self, results: dict):
+        value = results[self.key]
+        for part in self.path:
+            value = value[part]
+        return value
+
+    def __repr__(self):
+        return f"Ref({self.expression()})"
+
+
+class Operation:
+    """Один вызов метода REST API внутри batch"""
+
+    __slots__ = ("key", "method", "params", "depends_on")
+
+    def __init__(self, key: str, method: str, params: Optional[dict] = None):
+        if not KEY_PATTERN.fullmatch(key):
+            raise ValueError(f"Ключ операции может содержать только латинские буквы, цифры и '_': {key!r}")
+        self.key = key
+        self.method = method
+        self.params = params or {}
+        self.depends_on = {ref.key for ref in _refs(self.params)}
+
+    def __repr__(self):
+        return f"Operation({self.key}, {self.method})"
+
+
+def _refs(value) -> Iterable[Ref]:
+    if isinstance(value, Ref):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _refs(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _refs(item)
+
+
+def _resolve(value, results: dict):
+    """Заменяет ссылки на операции из предыдущих вызовов полученными значениями"""
+    if isinstance(value, Ref):
+        return value.resolve(results) if value.key in results else value
+    if isinstance(value, dict):
+        return {key: _resolve(item, results) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_resolve(item, results) for item in value]
+    return value
+
+
+def encode_params(params: dict) -> str:
+    """
+    Кодирует параметры как PHP http_build_query: fields[PHONE][0][VALUE]=...
+    None пропускается, bool передается как Y/N, ссылки Ref - без кодирования, чтобы batch их подставил.
+    """
+    pairs = []
+
+    def add(name: str, value):
+        if value is None:
+            return
+        if isinstance(value, dict):
+            for key, item in value.items():
+                add(f"{name}[{quote(str(key), safe='')}]", item)
+        elif isinstance(value, (list, tuple)):
+            for index, item in enumerate(value):
+                add(f"{name}[{index}]", item)
+        elif isinstance(value, Ref):
+            pairs.append(f"{name}={value.expression()}")
+        elif isinstance(value, bool):
+            pairs.append(f"{name}={'Y' if value else 'N'}")
+        else:
+            pairs.append(f"{name}={quote(str(value), safe='')}")
+
+    for key, value in params.items():
+        add(quote(str(key), safe=""), value)
+    return "&".join(pairs)
+
+
+def _command(operation: Operation, params: dict) -> str:
+    query = encode_params(params)
+    return f"{operation.method}?{query}" if query else operation.method
+
+
+def order_operations(operations: List[Operation], known: Iterable[str] = ()) -> List[Operation]:
+    """
+    Упорядочивает операции так, чтобы каждая шла после своих зависимостей, в остальном
+    сохраняя исходный порядок: компания и ее контакты, перечисленные подряд, попадут в один вызов.
+    known - ключи операций, результаты которых уже получены.
+    """
+    by_key: Dict[str, Operation] = {}
+    for operation in operations:
+        if operation.key in by_key:
+            raise ValueError(f"Повторяющийся ключ операции: {operation.key}")
+        by_key[operation.key] = operation
+    known = set(known)
+
+    ordered = []
+    state: Dict[str, int] = {}  # 1 - в обработке, 2 - добавлена
+
+    def visit(operation: Operation, chain: Tuple[str, ...]):
+        if state.get(operation.key) == 2:
+            return
+        if state.get(operation.key) == 1:
+            raise ValueError(f"Циклическая зависимость: {' -> '.join(chain + (operation.key,))}")
+        state[operation.key] = 1
+        for key in sorted(operation.depends_on):
+            if key in by_key:
+                visit(by_key[key], chain + (operation.key,))
+            elif key not in known:
+                raise ValueError(f"Операция {operation.key} ссылается на неизвестную операцию {key}")
+        state[operation.key] = 2
+        ordered.append(operation)
+
+    for operation in operations:
+        visit(operation, ())
+    return ordered
+
+
+def compile_batches(operations: List[Operation], max_commands: int = MAX_COMMANDS,
+                    known: Iterable[str] = ()) -> List[List[Operation]]:
+    """Раскладывает операции по вызовам batch в порядке зависимостей"""
+    ordered = order_operations(operations, known)
+    return [ordered[start:start + max_commands] for start in range(0, len(ordered), max_commands)]
+
+
+def compile_commands(operations: List[Operation]) -> Dict[str, str]:
+    """Команды одного вызова batch (не больше MAX_COMMANDS операций)"""
+    if len(operations) > MAX_COMMANDS:
+        raise ValueError(f"В один batch помещается не больше {MAX_COMMANDS} команд")
+    return {operation.key: _command(operation, operation.params) for operation in order_operations(operations)}
+
+
+def send_batch(commands: Dict[str, str]) -> Optional[dict]:
+    return bx_call("batch", {"halt": 0, "cmd": commands})
+
+
+def execute_operations(operations: List[Operation], send: BatchSender = send_batch,
+                       max_commands: int = MAX_COMMANDS) -> Tuple[dict, dict]:
+    """
+    Выполняет операции вызовами batch и возвращает (результаты, ошибки) по ключам операций.
+    Операции, зависящие от неуспешной, в следующих вызовах не отправляются; если такая
+    операция была в том же вызове, Битрикс24 выполнил ее с пустым значением ссылки -
+    она тоже считается ошибкой DEPENDENCY_FAILED, а ее результат сохраняется в ошибке.
+    """
+    results: dict = {}
+    errors: dict = {}
+    for batch in compile_batches(operations, max_commands):
+        commands = {}
+        for operation in batch:
+            failed = sorted(key for key in operation.depends_on if key in errors)
+            if failed:
+                errors[operation.key] = {"error": DEPENDENCY_FAILED, "error_description": f"Не выполнена операция {failed[0]}"}
+                continue
+            try:
+                commands[operation.key] = _command(operation, _resolve(operation.params, results))
+            except (KeyError, IndexError, TypeError) as e:
+                errors[operation.key] = {"error": DEPENDENCY_FAILED, "error_description": f"Нет значения ссылки: {e}"}
+        if not commands:
+            continue
+
+        response = send(commands)
+        if response is None:
+            for key in commands:
+                errors[key] = {"error": "BATCH_FAILED", "error_description": "Вызов batch не выполнен"}
+            continue
+
+        batch_result = response.get("result", {})
+        command_results = batch_result.get("result") or {}
+        command_errors = batch_result.get("result_error") or {}
+        if isinstance(command_results, list):  # пустой результат Битрикс24 возвращает списком
+            command_results = {}
+        if isinstance(command_errors, list):
+            command_errors = {}
+
+        for operation in batch:
+            key = operation.key
+            if key not in commands:
+                continue
+            if key in command_errors:
+                errors[key] = command_errors[key]
+            elif key in command_results:
+                # Ссылка на неуспешную операцию того же вызова была подставлена пустой
+                failed = sorted(dep for dep in operation.depends_on if dep in errors and dep in commands)
+                if failed:
+                    errors[key] = {"error": DEPENDENCY_FAILED, "error_description": f"Не выполнена операция {failed[0]}",
+                                   "result": command_results[key]}
+                else:
+                    results[key] = command_results[key]
+            else:
+                errors[key] = {"error": "NO_RESULT", "error_description": "Команда не вернула результат"}
+
+    if errors:
+        logger.warning("batch: %d из %d операций с ошибками, например %s: %s",
+                       len(errors), len(operations), next(iter(errors)), next(iter(errors.values())))
+    return results, errors
@@ -0,0 +1,126 @@
+import time
+import asyncio
+import inspect
+import logging
+from itertools import islice
+from typing import Awaitable, Callable, Iterable, List, Optional, Sequence
+
+from batch_tuner import BatchTuner, batch_tuning
+from log_config import SAMPLED
+from session_status import status_board
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Выполняет один батч и возвращает успешные результаты (список или словарь) либо None, если вызов не прошел
+BatchExecutor = Callable[[Sequence], Optional[Sequence]]
+
+
+class BatchResult(list):
+    """Успешные результаты батча и число элементов, пропущенных без отправки (например, дубли)"""
+
+    def __init__(self, items=(), skipped: int = 0):
+        super().__init__(items)
+        self.skipped = skipped
+
+
+async def run_batches(items: Iterable, operation: str, execute: BatchExecutor,
+                      before_batch: Optional[Callable[[], Awaitable[None]]] = None,
+                      on_result: Optional[Callable[[Sequence, Sequence], Optional[Awaitable[None]]]] = None,
+                      label: str = "", session_id: str = "", pause: float = 0.2,
+                      tuner: Optional[BatchTuner] = None, collect: bool = True,
+                      on_failure: Optional[Callable[[Sequence], None]] = None, idempotent: bool = False) -> list:
+    """
+    Обрабатывает элементы батчами, размер которых подбирает BatchTuner операции.
+    items может быть последовательностью или потоком (генератором): элементы берутся
+    по мере надобности, в памяти держится только текущий батч.
+    Поток читается и execute выполняется в asyncio.to_thread: ни генератор, ни execute
+    не должны обращаться к объектам event loop;
+    элементы, которые execute пропустил без отправки, передаются в BatchResult.skipped и не уменьшают батч.
+    before_batch вызывается перед каждым батчем (проверка сессии, ожидание паузы),
+    on_result - с батчем и его успешными результатами (может быть async, например для записи
+    в SQLite через asyncio.to_thread). Если батч целиком не прошел, тюнер уменьшил размер
+    и операция idempotent (привязка, чтение), батч повторяется меньшего размера, иначе он
+    пропускается и вызывается on_failure с его элементами. Создание записей (batchImport) не
+    повторяется: после таймаута или 5xx портал мог уже создать записи, и повтор создал бы дубли.
+    Возвращает список результатов батчей (пустой при collect=False).
+    """
+    own_tuner = tuner is None
+    if own_tuner:
+        tuner = batch_tuning.tuner(operation)
+
+    total = len(items) if hasattr(items, "__len__") else None  # У потока размер неизвестен
+    iterator = iter(items)
+    pending = []  # Элементы, взятые из потока, но еще не обработанные
+    results = []
+    position = 0
+    while True:
+        size = tuner.size
+        if len(pending) < size:
+            if total is None:
+                # Поток может читать файл и обращаться к порталу (слияние дублей) - берем элементы в потоке
+                pending.extend(await asyncio.to_thread(list, islice(iterator, size - len(pending))))
+            else:
+                pending.extend(islice(iterator, size - len(pending)))
+        if not pending:
+            break
+
+        if before_batch is not None:
+            await before_batch()
+
+        batch = pending[:size]
+        if label:
+            logger.info("%s %d-%d: Сессия %s...", label, position + 1, position + len(batch), session_id[:8],
+                        extra=SAMPLED)
+
+        started = time.perf_counter()
+        # Вызов Битрикс24 и синтез данных блокируют - выполняем в потоке, event loop обслуживает остальные сессии
+        result = await asyncio.to_thread(execute, batch)
+        elapsed = time.perf_counter() - started
+        succeeded = len(result) if result else 0
+        # Пропущенные элементы не отправлялись и не считаются ошибками портала
+        sent = len(batch) - getattr(result, "skipped", 0)
+        failed = sent > 0 and not succeeded
+        if sent > 0:
+            tuner.record(sent, elapsed, sent - succeeded)
+
+        if failed and idempotent and tuner.size < len(batch):
+            # Вызов не прошел целиком - повторяем эти же элементы батчем меньшего размера
+            logger.warning("%s: батч из %d элементов не прошел, повтор с размером %d",
+                           operation, len(batch), tuner.size)
+        else:
+            del pending[:len(batch)]
+            position += len(batch)
+            if succeeded:
+                if collect:
+                    results.append(result)
+                if on_result is not None:
+                    handled = on_result(batch, result)
+                    if inspect.isawaitable(handled):
+                        await handled
+            elif failed and on_failure is not None:
+                on_failure(batch)
+            if session_id:
+                # Ход батчей для подписчиков SSE/long-poll статуса сессии
+                status_board.set_progress(session_id, label or operation, position, total)
+
+        if pause:
+            with tracer.span("rate_limit_wait"):
+                await asyncio.sleep(pause)  # Пауза между батчами для избежания лимитов
+
+    if own_tuner:
+        batch_tuning.save(tuner)
+    return results
+
+
+def flatten(results: List[Sequence]) -> list:
+    """Объединяет списки результатов батчей в один список"""
+    return [item for result in results for item in result]
+
+
+def merge(results: List[dict]) -> dict:
+    """Объединяет словари результатов батчей в один словарь"""
+    merged = {}
+    for result in results:
+        merged.update(result)
+    return merged
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict
+from urllib.parse import urlparse
+
+from config import (
+    WEBHOOK_URL, BATCH_AUTOTUNE, BATCH_INITIAL_SIZE, BATCH_MIN_SIZE, BATCH_MAX_SIZE, BATCH_INCREASE_STEP,
+    BATCH_MAX_ERROR_RATE, BATCH_MAX_CALL_SECONDS, BATCH_TUNER_STATE_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+# Насколько может вырасти время на один элемент, прежде чем увеличение батча перестанет считаться выгодным
+LATENCY_TOLERANCE = 1.15
+EWMA_ALPHA = 0.3
+
+
+class BatchTuner:
+    """
+    Подбор размера батча для одной операции (AIMD).
+    Пока вызовы проходят без ошибок, укладываются в BATCH_MAX_CALL_SECONDS и время на один
+    элемент не растет, размер увеличивается на шаг. Если время на элемент растет - размер
+    уменьшается на шаг, при ошибках или слишком долгом вызове - вдвое.
+    """
+
+    def __init__(self, operation: str, initial: int = BATCH_INITIAL_SIZE, min_size: int = BATCH_MIN_SIZE,
+                 max_size: int = BATCH_MAX_SIZE, step: int = BATCH_INCREASE_STEP,
+                 max_error_rate: float = BATCH_MAX_ERROR_RATE, max_call_seconds: float = BATCH_MAX_CALL_SECONDS,
+                 enabled: bool = BATCH_AUTOTUNE):
+        self.operation = operation
+        self.min_size = min_size
+        self.max_size = max_size
+        self.step = step
+        self.max_error_rate = max_error_rate
+        self.max_call_seconds = max_call_seconds
+        self.enabled = enabled
+        self.size = max(min_size, min(max_size, initial))
+        self.item_latency: Dict[int, float] = {}  # размер батча -> EWMA времени на элемент, с
+        self.calls = 0
+        self.items = 0
+        self.failures = 0
+        self.elapsed = 0.0
+
+    def record(self, size: int, elapsed: float, failures: int):
+        """Учитывает результат вызова и выбирает размер следующего батча"""
+        self.calls += 1
+        self.items += size
+        self.failures += failures
+        self.elapsed += elapsed
+        if not self.enabled or size <= 0:
+            return
+
+        error_rate = failures / size
+        if error_rate > self.max_error_rate or elapsed > self.max_call_seconds:
+            self.size = max(self.min_size, self.size // 2)
+            return
+
+        per_item = elapsed / size
+        previous = self.item_latency.get(size)
+        self.item_latency[size] = per_item if previous is None else previous + EWMA_ALPHA * (per_item - previous)
+
+        # Неполный последний батч не говорит о том, как ведет себя текущий размер
+        if size < self.size:
+            return
+
+        best = min(self.item_latency.values())
+        if self.item_latency[size] <= best * LATENCY_TOLERANCE:
+            self.size = min(self.max_size, self.size + self.step)
+        else:
+            self.size = max(self.min_size, self.size - self.step)
+
+    def get_stats(self) -> dict:
+        return {
+            "size": self.size,
+            "calls": self.calls,
+            "items": self.items,
+            "failures": self.failures,
+            "avg_call_ms": round(self.elapsed / self.calls * 1000, 2) if self.calls else None,
+            "item_latency_ms": {size: round(value * 1000, 2) for size, value in sorted(self.item_latency.items())}
+        }
+
+
+class BatchTuningStore:
+    """Размеры батчей, на которых остановился подбор, по порталам и операциям (JSON файл)"""
+
+    def __init__(self, path: str = BATCH_TUNER_STATE_PATH, portal: str = urlparse(WEBHOOK_URL).netloc):
+        self.path = path
+        self.portal = portal
+        self.lock = threading.Lock()
+        self.state: Dict[str, Dict[str, dict]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Не удалось прочитать %s: %s", path, e)
+
+    def tuner(self, operation: str) -> BatchTuner:
+        """Создает тюнер операции, начиная с размера, сохраненного для портала в прошлый раз"""
+        saved = self.get_saved(operation)
+        return BatchTuner(operation, initial=saved.get("size", BATCH_INITIAL_SIZE))
+
+    def save(self, tuner: BatchTuner):
+        """Запоминает размер, на котором остановился подбор"""
+        if not tuner.enabled or tuner.calls == 0:
+            return
+        with self.lock:
+            self.state.setdefault(self.portal, {})[tuner.operation] = {
+                "size": tuner.size,
+                "calls": tuner.calls,
+                "avg_call_seconds": round(tuner.elapsed / tuner.calls, 4),
+                "updated_at": time.time()
+            }
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self.state, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning("Не удалось сохранить размеры батчей в %s: %s", self.path, e)
+
+    def get_saved(self, operation: str) -> dict:
+        """Сохраненные для портала размер и среднее время вызова операции (пустой словарь, если нет)"""
+        with self.lock:
+            return dict(self.state.get(self.portal, {}).get(operation, {}))
+
+    def get_state(self) -> dict:
+        with self.lock:
+            return json.loads(json.dumps(self.state))
+
+
+# Глобальное хранилище подобранных размеров
+batch_tuning = BatchTuningStore()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк памяти потоковой генерации.
+
+Каждый размер запускается в отдельном процессе: весь конвейер streaming_generation
+(синтез Faker, batchImport, привязка, загрузка и отправка результата частями) работает
+против имитации портала в памяти процесса, которая выдает ID и строки crm.*.get,
+ничего не сохраняя. Печатается пиковый RSS процесса и его прирост относительно
+состояния после импорта модулей.
+Запуск: python bench_generation_memory.py [количество записей ...]   (по умолчанию 10000 100000 1000000)
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import resource
+import subprocess
+from itertools import count
+from urllib.parse import parse_qs
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss в КБ (Linux)
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+        self.text = ""
+        self.elapsed = type("Elapsed", (), {"total_seconds": staticmethod(lambda: 0.0)})
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+def fake_portal():
+    """requests.post, отвечающий как Битрикс24 без хранения созданных записей"""
+    ids = count(1)
+
+    def post(url, json=None, timeout=None):
+        if url.endswith("crm.item.batchImport.json"):
+            return FakeResponse({"result": {"items": [{"item": {"id": next(ids)}} for _ in json["data"]]}})
+        results = {}
+        for key, command in json["cmd"].items():
+            method, query = command.split("?", 1)
+            params = parse_qs(query)
+            entity_id = params.get("id", ["0"])[0]
+            if method == "crm.contact.update":
+                results[key] = True
+            elif method == "crm.company.get":
+                results[key] = {"ID": entity_id, "TITLE": f"Компания {entity_id}",
+                                "PHONE": [{"VALUE": "+7 900 000-00-00"}], "EMAIL": [{"VALUE": "info@example.ru"}]}
+            elif method == "crm.contact.get":
+                results[key] = {"ID": entity_id, "NAME": "Иван", "LAST_NAME": "Иванов", "POST": "Менеджер",
+                                "PHONE": [{"VALUE": "+7 901 000-00-00"}], "EMAIL": [{"VALUE": "ivan@example.ru"}],
+                                "COMPANY_ID": "1"}
+        return FakeResponse({"result": {"result": results, "result_error": {}}})
+
+    return post
+
+
+def child(records: int):
+    """Один прогон в отдельном процессе; печатает JSON с результатами"""
+    import requests
+    requests.post = fake_portal()
+
+    from streaming_generation import run_streaming_generation
+
+    baseline = peak_rss_mb()
+    sent = {"messages": 0, "bytes": 0}
+
+    async def send(message):
+        sent["messages"] += 1
+        sent["bytes"] += len(message)
+
+    started = time.perf_counter()
+    stats = asyncio.run(run_streaming_generation(records // 2, records // 2, send, pause=0))
+    print(json.dumps({
+        "records": records,
+        "seconds": round(time.perf_counter() - started, 1),
+        "baseline_mb": round(baseline, 1),
+        "peak_mb": round(peak_rss_mb(), 1),
+        "messages": sent["messages"],
+        "result_mb": round(sent["bytes"] / 1024 / 1024, 1),
+        **stats
+    }))
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        child(int(sys.argv[2]))
+        return 0
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   WEBHOOK_URL="https://bench.example/rest/1/token/",
+                   LOG_LEVEL="WARNING",
+                   MIRROR_ENABLED="False",
+                   DEDUP_MODE="off",
+                   BATCH_AUTOTUNE="False",
+                   BATCH_INITIAL_SIZE="50",
+                   BATCH_TUNER_STATE_PATH=os.path.join(tmp, "batch_tuning.json"),
+                   TRACE_EXPORT_PATH="")
+        print(f"{'записей':>10} {'время, с':>9} {'RSS после импорта':>18} {'пик RSS':>9} {'прирост':>9} {'частей':>7}")
+        for records in sizes:
+            output = subprocess.run([sys.executable, __file__, "--child", str(records)], env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{records:>10} {result['seconds']:>9} {result['baseline_mb']:>15.1f} МБ "
+                  f"{result['peak_mb']:>6.1f} МБ {result['peak_mb'] - result['baseline_mb']:>6.1f} МБ "
+                  f"{result['messages']:>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта бэкенда.
+
+Измеряет в отдельных процессах время импорта main (медиана нескольких запусков),
+самые тяжелые модули по данным python -X importtime и время от запуска uvicorn
+до первого принятого TCP соединения. С --budget-ms завершается с кодом 1, если
+медиана импорта превысила бюджет - так регрессии видны в CI.
+Запуск: python bench_import_time.py [--runs 5] [--budget-ms 1500] [--no-serve]
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# Модули, которые не должны загружаться при импорте main (загружаются при первом использовании)
+DEFERRED_MODULES = ("faker", "requests", "uvicorn")
+
+
+def bench_env() -> dict:
+    return dict(os.environ, LOG_LEVEL="WARNING", WARMUP_ON_STARTUP="False", MIRROR_ENABLED="False",
+                DEDUP_MODE="off", TRACE_EXPORT_PATH="")
+
+
+def import_seconds() -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=bench_env(),
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def import_profile():
+    """Модули по убыванию собственного и суммарного времени импорта, и загруженные отложенные модули"""
+    code = f"import main, sys; print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=BACKEND_DIR, env=bench_env(),
+                            capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us), len(name) - len(name.lstrip())))
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    return modules, loaded
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_seconds(timeout: float = 30.0) -> float:
+    """Время от запуска uvicorn до первого принятого соединения"""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=bench_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                    return time.perf_counter() - started
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError("uvicorn завершился при запуске")
+                time.sleep(0.01)
+        raise RuntimeError("Сервер не начал принимать соединения")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время импорта main и запуска сервера")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, help="Допустимая медиана импорта main, мс")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--no-serve", action="store_true", help="Не измерять запуск uvicorn")
+    args = parser.parse_args()
+
+    times = [import_seconds() for _ in range(args.runs)]
+    median_ms = statistics.median(times) * 1000
+    print(f"import main: медиана {median_ms:.0f} мс (мин {min(times) * 1000:.0f}, макс {max(times) * 1000:.0f}), "
+          f"запусков {args.runs}")
+
+    modules, loaded = import_profile()
+    # Отступ 3 - модули, импортируемые непосредственно из main (и из site)
+    direct = sorted((m for m in modules if m[3] == 3), key=lambda m: m[2], reverse=True)
+    print(f"\nМодули, импортируемые main, по суммарному времени (топ {args.top}):")
+    for name, self_us, cumulative_us, _ in direct[:args.top]:
+        print(f"  {name:<30} {cumulative_us / 1000:>8.1f} мс  (собственное {self_us / 1000:.1f} мс)")
+    if loaded:
+        print(f"\n⚠️  При импорте main загружены отложенные модули: {', '.join(loaded)}")
+    else:
+        print(f"\nОтложенные модули не загружаются при импорте: {', '.join(DEFERRED_MODULES)}")
+
+    if not args.no_serve:
+        print(f"\nuvicorn: первое соединение через {serve_seconds() * 1000:.0f} мс")
+
+    if args.budget_ms is not None and median_ms > args.budget_ms:
+        print(f"\n❌ Импорт main дольше бюджета {args.budget_ms:.0f} мс")
+        return 1
+    return 1 if loaded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сборки и сериализации результатов генерации.
+
+Сравнивает прежний путь (Pydantic Company/Contact для каждой строки,
+model_dump() и json.dumps) с result_builder (словари и orjson).
+Запуск: python bench_serialization.py [количество компаний]
+"""
+
+import json
+import sys
+import time
+
+from models import Company
+from result_builder import build_company_records, dumps, orjson
+
+
+def make_rows(count):
+    """Генерирует строки в формате ответов crm.company.get / crm.contact.get"""
+    companies_data = {}
+    contacts_data = {}
+    for i in range(count):
+        company_id = str(i + 1)
+        companies_data[f"company_{i}"] = {
+            "ID": company_id,
+            "TITLE": f"ООО Компания {i}",
+            "PHONE": [{"VALUE": f"+7 900 {i:07d}", "VALUE_TYPE": "WORK"}],
+            "EMAIL": [{"VALUE": f"info{i}@example.ru", "VALUE_TYPE": "WORK"}]
+        }
+        contacts_data[f"contact_{i}"] = {
+            "ID": str(count + i + 1),
+            "NAME": "Иван",
+            "LAST_NAME": f"Иванов {i}",
+            "PHONE": [{"VALUE": f"+7 901 {i:07d}", "VALUE_TYPE": "WORK"}],
+            "EMAIL": [{"VALUE": f"ivan{i}@example.ru", "VALUE_TYPE": "WORK"}],
+            "POST": "Менеджер",
+            "COMPANY_ID": company_id
+        }
+    return companies_data, contacts_data
+
+
+def legacy_path(companies_data, contacts_data):
+    """Прежний путь: Pydantic модели, model_dump() и json.dumps.
+    Контакты группируются заранее, чтобы измерять только сериализацию, а не квадратичный поиск"""
+    contacts_by_company = {}
+    for contact in contacts_data.values():
+        contacts_by_company.setdefault(contact.get("COMPANY_ID"), []).append({
+            "id": contact.get("ID"),
+            "name": contact.get("NAME", ""),
+            "last_name": contact.get("LAST_NAME", ""),
+            "phone": contact.get("PHONE", [{}])[0].get("VALUE") if contact.get("PHONE") else None,
+            "email": contact.get("EMAIL", [{}])[0].get("VALUE") if contact.get("EMAIL") else None,
+            "post": contact.get("POST"),
+            "company_id": contact.get("COMPANY_ID")
+        })
+
+    companies = []
+    for company in companies_data.values():
+        companies.append(Company(
+            id=company["ID"],
+            title=company["TITLE"],
+            phone=company.get("PHONE", [{}])[0].get("VALUE") if company.get("PHONE") else None,
+            email=company.get("EMAIL", [{}])[0].get("VALUE") if company.get("EMAIL") else None,
+            contacts=contacts_by_company.get(company["ID"], [])
+        ))
+
+    return json.dumps({"type": "complete", "companies": [company.model_dump() for company in companies]})
+
+
+def fast_path(companies_data, contacts_data):
+    """Новый путь: result_builder"""
+    return dumps({"type": "complete", "companies": build_company_records(companies_data, contacts_data)})
+
+
+def measure(func, *args, repeat=3):
+    """Возвращает лучшее время выполнения из нескольких запусков"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    companies_data, contacts_data = make_rows(count)
+
+    print(f"📦 {count} компаний и {count} контактов, orjson: {'да' if orjson else 'нет'}")
+
+    legacy_time, legacy_result = measure(legacy_path, companies_data, contacts_data)
+    fast_time, fast_result = measure(fast_path, companies_data, contacts_data)
+
+    assert json.loads(legacy_result) == json.loads(fast_result), "Результаты отличаются"
+
+    print(f"Pydantic + json.dumps:  {legacy_time:.3f} с, {len(legacy_result.encode()) / 1024 / 1024:.1f} МБ")
+    print(f"result_builder:         {fast_time:.3f} с, {len(fast_result.encode()) / 1024 / 1024:.1f} МБ")
+    print(f"Ускорение: x{legacy_time / fast_time:.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
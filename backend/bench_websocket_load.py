@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест WebSocket: тысячи одновременных сессий в одном процессе сервера.
+
+Запускает имитацию Битрикс24 (отдельный процесс на http.server, отвечает на batchImport
+и batch без хранения записей) и сервер (python main.py), направленный на нее. Затем
+открывает N клиентов /ws по протоколу фронтенда (session_id:..., ping/pong), держит их
+в простое, запускает K одновременных /create-test-data и ждет сообщения complete.
+Печатает скорость установки соединений, перцентили задержки ping -> pong в простое и во
+время генерации, длительность генераций, CPU и RSS процесса сервера (из /proc) на соединение.
+Запуск: python bench_websocket_load.py [--clients 1000] [--generations 20] [--hold 15]
+        python bench_websocket_load.py --server-url http://host:8000 --server-pid PID   (готовый сервер)
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+from collections import deque
+from itertools import count
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import websockets
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+WEBHOOK_PATH = "/rest/1/bench/"
+
+
+# --- Имитация Битрикс24 ---
+
+def portal_handler(latency: float):
+    ids = count(1)
+
+    class PortalHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            method = self.path[len(WEBHOOK_PATH):].rsplit(".json", 1)[0]
+            time.sleep(latency)  # Время обработки на портале
+            if method == "crm.item.batchImport":
+                result = {"items": [{"item": {"id": next(ids)}} for _ in body.get("data", [])]}
+            elif method == "batch":
+                result = {"result": {key: self.batch_command(command) for key, command in body.get("cmd", {}).items()},
+                          "result_error": {}}
+            else:
+                result = True
+            data = json.dumps({"result": result, "time": {"processing": latency}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        @staticmethod
+        def batch_command(command: str):
+            method, _, query = command.partition("?")
+            entity_id = parse_qs(query).get("id", ["0"])[0]
+            if method == "crm.company.get":
+                return {"ID": entity_id, "TITLE": f"Компания {entity_id}",
+                        "PHONE": [{"VALUE": "+7 900 000-00-00"}], "EMAIL": [{"VALUE": "info@example.ru"}]}
+            if method == "crm.contact.get":
+                return {"ID": entity_id, "NAME": "Иван", "LAST_NAME": "Иванов", "POST": "Менеджер",
+                        "PHONE": [{"VALUE": "+7 901 000-00-00"}], "EMAIL": [{"VALUE": "ivan@example.ru"}],
+                        "COMPANY_ID": "1"}
+            return True
+
+    return PortalHandler
+
+
+def run_portal(port: int, latency: float):
+    server = ThreadingHTTPServer(("127.0.0.1", port), portal_handler(latency))
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+# --- Процессы и /proc ---
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def raise_fd_limit(needed: int):
+    """Поднимает мягкий лимит открытых файлов (наследуется сервером и имитацией портала)"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    if soft != resource.RLIM_INFINITY and soft < target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    if target < needed:
+        print(f"⚠️  Лимит открытых файлов {target} меньше нужного {needed}: часть соединений не откроется")
+
+
+def process_sample(pid: int):
+    """(CPU секунд user+system, RSS в байтах) процесса из /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/status") as f:
+        rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    return cpu, rss_kb * 1024
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 60.0):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"Процесс завершился при запуске с кодом {process.returncode}")
+            time.sleep(0.05)
+    raise RuntimeError(f"Порт {port} не открылся за {timeout:.0f} с")
+
+
+def start_stand(args, tmp: str):
+    """Запускает имитацию портала и сервер; возвращает (URL сервера, PID сервера, процессы)"""
+    portal_port = free_port()
+    portal = subprocess.Popen([sys.executable, __file__, "--portal", str(portal_port),
+                               "--portal-latency-ms", str(args.portal_latency_ms)])
+    wait_for_port(portal_port, portal)
+
+    port = free_port()
+    env = dict(os.environ,
+               BITRIX24_WEBHOOK_URL=f"http://127.0.0.1:{portal_port}{WEBHOOK_PATH}",
+               HOST="127.0.0.1", PORT=str(port), WORKERS="1", LOG_LEVEL="WARNING", DEBUG="False",
+               NUM_CONTACTS=str(args.records), NUM_COMPANIES=str(args.records),
+               MAX_SESSIONS=str(args.clients + 100),
+               MIRROR_ENABLED="False", DEDUP_MODE="off", RECONCILE_LINKS="False", TRACE_EXPORT_PATH="",
+               BATCH_TUNER_STATE_PATH=os.path.join(tmp, "batch_tuning.json"),
+               IMPORT_STATE_DIR=os.path.join(tmp, "imports"), EXPORT_DIR=os.path.join(tmp, "exports"))
+    log = open(os.path.join(tmp, "server.log"), "w")
+    server = subprocess.Popen([sys.executable, "main.py"], cwd=BACKEND_DIR, env=env, stdout=log, stderr=log)
+    try:
+        wait_for_port(port, server)
+    except RuntimeError:
+        log.flush()
+        with open(log.name) as f:
+            print(f.read()[-2000:])
+        raise
+    return f"http://127.0.0.1:{port}", server.pid, [server, portal]
+
+
+# --- Клиенты ---
+
+class LoadClient:
+    """Один клиент /ws: сессия, ping/pong и ожидание результата генерации"""
+
+    def __init__(self, ws_url: str):
+        self.ws_url = ws_url
+        self.session_id = str(uuid.uuid4())
+        self.websocket = None
+        self.pings = deque()  # Время отправки ping, на которые еще нет pong
+        self.latencies = {}  # Фаза -> задержки ping -> pong, с
+        self.phase = "setup"
+        self.pong = None
+        self.done = None
+        self.result = None
+
+    async def connect(self) -> float:
+        """Открывает соединение, регистрирует сессию и ждет первый pong; возвращает время установки"""
+        started = time.perf_counter()
+        self.websocket = await websockets.connect(self.ws_url, ping_interval=None, max_size=None, open_timeout=30)
+        self.pong = asyncio.get_running_loop().create_future()
+        self.done = asyncio.get_running_loop().create_future()
+        asyncio.create_task(self.read())
+        await self.websocket.send(f"session_id:{self.session_id}")
+        await self.ping()
+        if not await asyncio.wait_for(asyncio.shield(self.pong), 30):
+            raise ConnectionError(f"Соединение закрыто: {self.result}")
+        return time.perf_counter() - started
+
+    async def ping(self):
+        self.pings.append(time.perf_counter())
+        await self.websocket.send("ping")
+
+    async def read(self):
+        try:
+            async for message in self.websocket:
+                if message == "pong":
+                    if self.pings:
+                        self.latencies.setdefault(self.phase, []).append(time.perf_counter() - self.pings.popleft())
+                    if not self.pong.done():
+                        self.pong.set_result(True)
+                    continue
+                try:
+                    payload = json.loads(message)
+                except ValueError:
+                    continue
+                if isinstance(payload, dict) and payload.get("type") in ("complete", "error") and not self.done.done():
+                    self.done.set_result(payload["type"])
+        except websockets.ConnectionClosed as e:
+            self.result = e
+        finally:
+            for future in (self.pong, self.done):
+                if not future.done():
+                    future.set_result(None)
+
+    async def ping_loop(self, interval: float, stop: asyncio.Event):
+        await asyncio.sleep(random.uniform(0, interval))  # Клиенты не должны пинговать одновременно
+        while not stop.is_set():
+            try:
+                await self.ping()
+            except websockets.ConnectionClosed:
+                return
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+def percentiles(values) -> str:
+    if not values:
+        return "нет измерений"
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+    return (f"p50 {rank(50):.1f} мс, p90 {rank(90):.1f} мс, p99 {rank(99):.1f} мс, "
+            f"max {ordered[-1] * 1000:.1f} мс ({len(ordered)} измерений)")
+
+
+def phase_latencies(clients, phase):
+    return [latency for client in clients for latency in client.latencies.get(phase, [])]
+
+
+async def run_load(args, base_url: str, server_pid):
+    ws_url = base_url.replace("http", "ws", 1) + "/ws"
+    sample = (lambda: process_sample(server_pid)) if server_pid else (lambda: (0.0, 0))
+    _, rss_before = sample()
+
+    # 1. Установка соединений с ограничением одновременных рукопожатий
+    clients = [LoadClient(ws_url) for _ in range(args.clients)]
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+    setup_times, failures = [], {}
+
+    async def connect(client):
+        async with semaphore:
+            try:
+                setup_times.append(await client.connect())
+            except Exception as e:
+                failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+                client.websocket = None
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in clients))
+    connect_seconds = time.perf_counter() - started
+    connected = [client for client in clients if client.websocket is not None]
+    print(f"Подключения: {len(connected)}/{args.clients} за {connect_seconds:.1f} с "
+          f"({len(connected) / connect_seconds:.0f} в секунду), ошибок {sum(failures.values())} {failures or ''}")
+    print(f"  установка (рукопожатие + session_id + первый pong): {percentiles(setup_times)}")
+
+    # 2. Простой: только ping, как у открытых вкладок
+    stop = asyncio.Event()
+    for client in connected:
+        client.phase = "idle"
+    ping_tasks = [asyncio.create_task(client.ping_loop(args.ping_interval, stop)) for client in connected]
+    cpu_start, _ = sample()
+    await asyncio.sleep(args.hold)
+    cpu_idle, rss_idle = sample()
+    print(f"\nПростой {args.hold:.0f} с, ping каждые {args.ping_interval:.0f} с: {percentiles(phase_latencies(connected, 'idle'))}")
+
+    # 3. Одновременные генерации; остальные клиенты продолжают ping
+    for client in connected:
+        client.phase = "generation"
+    generators = connected[:args.generations]
+    http_errors = {}
+    durations = []
+
+    def post(client):
+        response = requests.post(f"{base_url}/create-test-data", json={"session_id": client.session_id},
+                                 timeout=args.generation_timeout)
+        return response.status_code
+
+    async def generate(client, executor):
+        started = time.perf_counter()
+        try:
+            status = await asyncio.get_running_loop().run_in_executor(executor, post, client)
+            if status != 200:
+                http_errors[status] = http_errors.get(status, 0) + 1
+                return
+            result = await asyncio.wait_for(asyncio.shield(client.done), args.generation_timeout)
+            if result != "complete":
+                http_errors[result or "closed"] = http_errors.get(result or "closed", 0) + 1
+                return
+            durations.append(time.perf_counter() - started)
+        except Exception as e:
+            http_errors[type(e).__name__] = http_errors.get(type(e).__name__, 0) + 1
+
+    generation_started = time.perf_counter()
+    if generators:
+        with ThreadPoolExecutor(max_workers=len(generators)) as executor:
+            await asyncio.gather(*(generate(client, executor) for client in generators))
+    generation_seconds = time.perf_counter() - generation_started
+    cpu_generation, rss_generation = sample()
+    if generators:
+        print(f"\nГенерации: {len(durations)}/{len(generators)} по {args.records}+{args.records} записей "
+              f"за {generation_seconds:.1f} с, ошибок {sum(http_errors.values())} {http_errors or ''}")
+        print(f"  до сообщения complete: {percentiles(durations)}")
+        print(f"  ping -> pong во время генерации: {percentiles(phase_latencies(connected, 'generation'))}")
+
+    stop.set()
+    await asyncio.gather(*ping_tasks)
+    await asyncio.gather(*(client.websocket.close() for client in connected), return_exceptions=True)
+
+    if server_pid and connected:
+        per_connection_kb = (rss_idle - rss_before) / len(connected) / 1024
+        idle_cpu = (cpu_idle - cpu_start) / args.hold
+        print(f"\nСервер (PID {server_pid}):")
+        print(f"  RSS: {rss_before / 2**20:.1f} МБ до подключений, {rss_idle / 2**20:.1f} МБ с {len(connected)} "
+              f"соединениями ({per_connection_kb:.1f} КБ на соединение), {rss_generation / 2**20:.1f} МБ после генераций")
+        print(f"  CPU в простое: {idle_cpu * 100:.1f}% ядра, {idle_cpu * 1e6 / len(connected):.0f} мкс/с на соединение")
+        if generators:
+            print(f"  CPU во время генераций: {(cpu_generation - cpu_idle) / generation_seconds * 100:.1f}% ядра")
+    return 0 if not failures and not http_errors else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест WebSocket сессий и генераций")
+    parser.add_argument("--clients", type=int, default=1000, help="Одновременных клиентов /ws")
+    parser.add_argument("--generations", type=int, default=20, help="Одновременных /create-test-data")
+    parser.add_argument("--records", type=int, default=20, help="Контактов и компаний в одной генерации")
+    parser.add_argument("--hold", type=float, default=15, help="Секунд простоя с ping перед генерациями")
+    parser.add_argument("--ping-interval", type=float, default=5, help="Секунд между ping клиента (фронтенд: 30)")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="Одновременных рукопожатий")
+    parser.add_argument("--generation-timeout", type=float, default=300)
+    parser.add_argument("--portal-latency-ms", type=float, default=50, help="Время ответа имитации портала")
+    parser.add_argument("--server-url", help="Готовый сервер вместо запуска main.py (генерации идут в его портал)")
+    parser.add_argument("--server-pid", type=int, help="PID готового сервера для CPU и RSS")
+    parser.add_argument("--portal", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.portal:
+        run_portal(args.portal, args.portal_latency_ms / 1000)
+        return 0
+
+    raise_fd_limit(args.clients * 2 + 1024)
+    if args.server_url:
+        return asyncio.run(run_load(args, args.server_url.rstrip("/"), args.server_pid))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_url, server_pid, processes = start_stand(args, tmp)
+        try:
+            return asyncio.run(run_load(args, base_url, server_pid))
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,44 +1,108 @@
-import requests
+import logging
 from config import WEBHOOK_URL
+from tracing import tracer, record_bitrix_timing
+from log_config import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+# requests (вместе с urllib3 и certifi) импортируется при первом вызове API, а не при импорте
+# приложения: воркеру, который пока только раздает статику и WebSocket, он не нужен
 
 def bx_call(method, params=None):
     """Выполняет вызов к Bitrix24 API"""
     url = f"{WEBHOOK_URL}{method}.json"
-    try:
-        resp = requests.post(url, json=params or {}, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
+    with tracer.span("bx_call", **{"bitrix.method": method}) as span:
+        try:
+            import requests
+            resp = requests.post(url, json=params or {}, timeout=30)
+            span.set_attribute("http.status_code", resp.status_code)
+            resp.raise_for_status()
+            data = resp.json()
+            record_bitrix_timing(span, data, resp.elapsed.total_seconds() * 1000)
 
-        if "error" in data:
-            print(f"API Error in {method}: {data['error']}")
-            return None
+            if "error" in data:
+                logger.error("API Error in %s: %s", method, data['error'])
+                span.record_error(data['error'])
+                return None
 
-        return data
-    except Exception as e:
-        print(f"Error calling {method}: {e}")
-        return None
+            return data
+        except Exception as e:
+            logger.error("Error calling %s: %s", method, e)
+            span.record_error(e)
+            return None
 
 def bx_batch_import(entity_type, data):
     """Выполняет batch import для CRM сущностей"""
     url = f"{WEBHOOK_URL}crm.item.batchImport.json"
-    try:
-        payload = {
-            "entityTypeId": entity_type,
-            "data": data
-        }
-        resp = requests.post(url, json=payload, timeout=60)
-        
-        if resp.status_code != 200:
-            print(f"HTTP Error {resp.status_code}")
-            return None
+    with tracer.span("bx_batch_import", **{"bitrix.entity_type": entity_type, "batch.size": len(data)}) as span:
+        try:
+            import requests
+            payload = {
+                "entityTypeId": entity_type,
+                "data": data
+            }
+            resp = requests.post(url, json=payload, timeout=60)
+            span.set_attribute("http.status_code", resp.status_code)
             
-        response_data = resp.json()
+            if resp.status_code != 200:
+                logger.error("HTTP Error %s", resp.status_code)
+                span.record_error(f"HTTP {resp.status_code}")
+                return None
+                
+            response_data = resp.json()
+            record_bitrix_timing(span, response_data, resp.elapsed.total_seconds() * 1000)
+
+            if "error" in response_data:
+                logger.error("Batch Import Error: %s", response_data['error'])
+                span.record_error(response_data['error'])
+                return None
 
-        if "error" in response_data:
-            print(f"Batch Import Error: {response_data['error']}")
+            result = response_data.get("result", {})
+            items = result.get("items", []) if isinstance(result, dict) else []
+            span.set_attribute("batch.failures", len(data) - sum(1 for item in items if "item" in item))
+            return result
+        except Exception as e:
+            logger.error("Error calling batch import: %s", e)
+            span.record_error(e)
             return None
 
-        return response_data.get("result", {})
-    except Exception as e:
-        print(f"Error calling batch import: {e}")
-        return None
+def execute_batch_request(commands, entity_type):
+    """Выполняет batch запрос и возвращает результаты"""
+    with tracer.span("execute_batch_request", **{"bitrix.entity": entity_type, "batch.size": len(commands)}) as span:
+        try:
+            import requests
+            url = f"{WEBHOOK_URL}batch.json"
+            payload = {"halt": 0, "cmd": commands}
+            
+            resp = requests.post(url, json=payload, timeout=60)
+            span.set_attribute("http.status_code", resp.status_code)
+            
+            if resp.status_code != 200:
+                logger.error("Batch request HTTP Error %s: %s", resp.status_code, resp.text)
+                span.record_error(f"HTTP {resp.status_code}")
+                return {}
+                
+            response_data = resp.json()
+            record_bitrix_timing(span, response_data, resp.elapsed.total_seconds() * 1000)
+            
+            if "error" in response_data:
+                logger.error("Batch request Error: %s", response_data['error'])
+                span.record_error(response_data['error'])
+                return {}
+            
+            results = response_data.get("result", {}).get("result", {})
+            
+            # Обрабатываем результаты - value уже содержит данные напрямую
+            processed_data = {}
+            for key, value in results.items():
+                if value:
+                    processed_data[key] = value
+            
+            span.set_attribute("batch.failures", len(commands) - len(processed_data))
+            logger.info("Получено %d %s из batch", len(processed_data), entity_type, extra=SAMPLED)
+            return processed_data
+            
+        except Exception as e:
+            logger.error("Ошибка выполнения batch запроса для %s: %s", entity_type, e)
+            span.record_error(e)
+            return {}
@@ -1,9 +1,80 @@
 import json
-import requests
+import logging
+import hashlib
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
-from typing import Dict, Any
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+from typing import Dict, Any, List
 import urllib.parse
+from webhook_queue import webhook_queue
+from static_files import etag_matches
+from log_config import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+LANDING_PAGE_HTML = """
+            <html>
+                <head>
+                    <title>Bitrix24 Контакты</title>
+                    <meta charset="utf-8">
+                    <style>
+                        body { font-family: Arial, sans-serif; margin: 0; padding: 20px; background: #f5f5f5; }
+                        .container { max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+                        .header { text-align: center; margin-bottom: 30px; }
+                        .header h1 { color: #2fc6f6; margin: 0; }
+                        .header p { color: #666; margin: 10px 0 0 0; }
+                        .btn { 
+                            background: #2fc6f6; color: white; border: none; padding: 12px 24px; 
+                            border-radius: 4px; cursor: pointer; font-size: 16px; 
+                            transition: background-color 0.3s;
+                        }
+                        .btn:hover { background: #1ea8d4; }
+                        .btn:disabled { background: #ccc; cursor: not-allowed; }
+                        .status { padding: 10px; border-radius: 4px; margin: 10px 0; }
+                        .status.success { background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }
+                        .status.error { background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }
+                        .status.loading { background: #d1ecf1; color: #0c5460; border: 1px solid #bee5eb; }
+                        .loading-spinner { display: inline-block; width: 16px; height: 16px; border: 2px solid #f3f3f3; border-top: 2px solid #2fc6f6; border-radius: 50%; animation: spin 1s linear infinite; margin-right: 8px; }
+                        @keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
+                    </style>
+                </head>
+                <body>
+                    <div class="container">
+                        <div class="header">
+                            <h1>🏢 Bitrix24 Контакты</h1>
+                            <p>Управление компаниями и контактами</p>
+                        </div>
+                        
+                        <div style="text-align: center; margin: 40px 0;">
+                            <button class="btn" onclick="openApp()">
+                                Открыть приложение
+                            </button>
+                        </div>
+                        
+                        <div style="text-align: center; color: #666;">
+                            <p>Приложение интегрировано с Битрикс24</p>
+                            <p>Используйте кнопки в интерфейсе CRM для быстрого доступа</p>
+                        </div>
+                    </div>
+                    
+                    <script>
+                        function openApp() {
+                            window.open('https://amusingly-awaited-starling.cloudpub.ru', '_blank');
+                        }
+                    </script>
+                </body>
+            </html>
+            """
+
+
+class CachedPage:
+    """Отрисованная HTML страница: байты и ETag"""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, html: str):
+        self.body = html.encode("utf-8")
+        self.etag = f'"{hashlib.blake2b(self.body, digest_size=16).hexdigest()}"'
+
 
 class Bitrix24AppHandler:
     def __init__(self):
@@ -17,6 +88,28 @@ class Bitrix24AppHandler:
             'CRM_CONTACT_DETAIL_MENU': 'CRM_CONTACT_DETAIL_MENU',
             'CRM_COMPANY_DETAIL_MENU': 'CRM_COMPANY_DETAIL_MENU'
         }
+        # Страницы зависят только от размещения - отрисовываем их один раз при запуске
+        self.landing_page = CachedPage(LANDING_PAGE_HTML)
+        self.placement_pages: Dict[str, CachedPage] = {
+            placement: CachedPage(self.create_placement_handler(placement)) for placement in self.placements
+        }
+
+    def get_placement_page(self, placement: str) -> CachedPage:
+        """Возвращает отрисованную страницу размещения. Неизвестные размещения не кешируются"""
+        page = self.placement_pages.get(placement)
+        if page is None:
+            page = CachedPage(self.create_placement_handler(placement))
+        return page
+
+    def get_landing_page(self) -> CachedPage:
+        return self.landing_page
+
+    def page_response(self, request: Request, page: CachedPage) -> Response:
+        """Отдает страницу с ETag; на условный запрос с актуальным ETag отвечает 304"""
+        headers = {"etag": page.etag, "cache-control": "no-cache"}
+        if etag_matches(request, page.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=page.body, media_type="text/html; charset=utf-8", headers=headers)
     
     def create_button_html(self, placement: str, title: str = "Bitrix24 Контакты") -> str:
         """Создает HTML для кнопки в интерфейсе Битрикс24"""
@@ -113,63 +206,10 @@ def create_app_routes(app: FastAPI):
                 placement = params['PLACEMENT']
                 if placement in app_handler.placements:
                     # Возвращаем HTML для размещения кнопки
-                    html_content = app_handler.create_placement_handler(placement)
-                    return HTMLResponse(html_content)
+                    return app_handler.page_response(request, app_handler.get_placement_page(placement))
             
             # Если это не запрос на размещение, возвращаем основное приложение
-            return HTMLResponse("""
-            <html>
-                <head>
-                    <title>Bitrix24 Контакты</title>
-                    <meta charset="utf-8">
-                    <style>
-                        body { font-family: Arial, sans-serif; margin: 0; padding: 20px; background: #f5f5f5; }
-                        .container { max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-                        .header { text-align: center; margin-bottom: 30px; }
-                        .header h1 { color: #2fc6f6; margin: 0; }
-                        .header p { color: #666; margin: 10px 0 0 0; }
-                        .btn { 
-                            background: #2fc6f6; color: white; border: none; padding: 12px 24px; 
-                            border-radius: 4px; cursor: pointer; font-size: 16px; 
-                            transition: background-color 0.3s;
-                        }
-                        .btn:hover { background: #1ea8d4; }
-                        .btn:disabled { background: #ccc; cursor: not-allowed; }
-                        .status { padding: 10px; border-radius: 4px; margin: 10px 0; }
-                        .status.success { background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }
-                        .status.error { background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }
-                        .status.loading { background: #d1ecf1; color: #0c5460; border: 1px solid #bee5eb; }
-                        .loading-spinner { display: inline-block; width: 16px; height: 16px; border: 2px solid #f3f3f3; border-top: 2px solid #2fc6f6; border-radius: 50%; animation: spin 1s linear infinite; margin-right: 8px; }
-                        @keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <div class="header">
-                            <h1>🏢 Bitrix24 Контакты</h1>
-                            <p>Управление компаниями и контактами</p>
-                        </div>
-                        
-                        <div style="text-align: center; margin: 40px 0;">
-                            <button class="btn" onclick="openApp()">
-                                Открыть приложение
-                            </button>
-                        </div>
-                        
-                        <div style="text-align: center; color: #666;">
-                            <p>Приложение интегрировано с Битрикс24</p>
-                            <p>Используйте кнопки в интерфейсе CRM для быстрого доступа</p>
-                        </div>
-                    </div>
-                    
-                    <script>
-                        function openApp() {
-                            window.open('https://amusingly-awaited-starling.cloudpub.ru', '_blank');
-                        }
-                    </script>
-                </body>
-            </html>
-            """)
+            return app_handler.page_response(request, app_handler.get_landing_page())
             
         except Exception as e:
             return HTMLResponse(f"""
@@ -198,47 +238,56 @@ def create_app_routes(app: FastAPI):
                     params = dict(request.query_params)
             
             placement = params.get('PLACEMENT', '')
-            print(f"Button handler called with placement: {placement}")
+            logger.info("Button handler called with placement: %s", placement)
             
             # Возвращаем HTML для кнопки
-            html_content = app_handler.create_placement_handler(placement)
-            return HTMLResponse(html_content)
+            return app_handler.page_response(request, app_handler.get_placement_page(placement))
             
         except Exception as e:
-            print(f"Button handler error: {e}")
+            logger.exception("Button handler error: %s", e)
             return HTMLResponse(f"Ошибка: {str(e)}", status_code=500)
     
+    @app.on_event("startup")
+    async def start_webhook_queue():
+        """Запускает воркеров очереди webhook событий"""
+        await webhook_queue.start()
+
+    @app.on_event("shutdown")
+    async def stop_webhook_queue():
+        """Останавливает воркеров очереди webhook событий"""
+        await webhook_queue.stop()
+
     @app.post("/api/bitrix24/webhook")
     async def webhook_handler(request: Request):
-        """Обработчик webhook от Битрикс24"""
+        """Обработчик webhook от Битрикс24: событие сохраняется в очередь и сразу подтверждается"""
         try:
             data = await request.json()
-            
-            # Обрабатываем различные типы событий
-            event_type = data.get('event', '')
-            
-            if event_type == 'ONCRMLEADADD':
-                # Новый лид добавлен
-                lead_id = data.get('data', {}).get('FIELDS', {}).get('ID')
-                print(f"Новый лид добавлен: {lead_id}")
-                
-            elif event_type == 'ONCRMDEALADD':
-                # Новая сделка добавлена
-                deal_id = data.get('data', {}).get('FIELDS', {}).get('ID')
-                print(f"Новая сделка добавлена: {deal_id}")
-                
-            elif event_type == 'ONCRMCONTACTADD':
-                # Новый контакт добавлен
-                contact_id = data.get('data', {}).get('FIELDS', {}).get('ID')
-                print(f"Новый контакт добавлен: {contact_id}")
-                
-            elif event_type == 'ONCRMCOMPANYADD':
-                # Новая компания добавлена
-                company_id = data.get('data', {}).get('FIELDS', {}).get('ID')
-                print(f"Новая компания добавлена: {company_id}")
-            
-            return JSONResponse({"status": "success"})
+            status = webhook_queue.submit(data)
+            return JSONResponse({"status": "success", "queue": status})
             
         except Exception as e:
-            print(f"Ошибка обработки webhook: {e}")
+            logger.exception("Ошибка обработки webhook: %s", e)
             return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+    @app.get("/api/bitrix24/webhook/stats")
+    async def webhook_stats():
+        """Статистика очереди webhook событий: пропускная способность и задержка"""
+        return webhook_queue.get_stats()
+
+
+async def log_crm_events(events: List[dict]):
+    """Обработчик по умолчанию: логирует пачку CRM событий"""
+    titles = {
+        'ONCRMLEADADD': 'Новый лид добавлен',
+        'ONCRMDEALADD': 'Новая сделка добавлена',
+        'ONCRMCONTACTADD': 'Новый контакт добавлен',
+        'ONCRMCOMPANYADD': 'Новая компания добавлена'
+    }
+    for data in events:
+        event_type = data.get('event', '')
+        entity_id = data.get('data', {}).get('FIELDS', {}).get('ID')
+        logger.info("%s: %s", titles.get(event_type, event_type), entity_id, extra=SAMPLED)
+
+
+for _event_type in ('ONCRMLEADADD', 'ONCRMDEALADD', 'ONCRMCONTACTADD', 'ONCRMCOMPANYADD'):
+    webhook_queue.register_handler(_event_type, log_crm_events)
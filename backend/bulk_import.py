@@ -0,0 +1,369 @@
+"""
+Массовый импорт контактов и компаний из CSV/JSONL в Битрикс24.
+
+Файл читается построчно, строки превращаются в поля crm.item.batchImport и отправляются
+тем же циклом run_batches, что и тестовые данные (автоподбор размера батча, паузы,
+прогресс). Соответствие внешних ключей компаний новым ID хранится в SQLite файле задания,
+поэтому контакты, импортированные следующим шагом с тем же job_id, привязываются к
+только что созданным компаниям.
+
+Запуск из командной строки:
+    python bulk_import.py companies companies.csv --job export-2024
+    python bulk_import.py contacts contacts.jsonl --job export-2024
+"""
+
+import os
+import re
+import csv
+import json
+import uuid
+import asyncio
+import logging
+import sqlite3
+import argparse
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Request
+
+from batch_compiler import MAX_COMMANDS, Operation, execute_operations
+from batch_runner import run_batches
+from bitrix_api import bx_batch_import
+from config import IMPORT_STATE_DIR
+from dedup_index import dedup_index
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+ENTITY_TYPES = {"companies": 4, "contacts": 3}
+FORMATS = ("csv", "jsonl")
+MULTIFIELDS = ("PHONE", "EMAIL")
+REQUIRED_FIELDS = {"companies": ("TITLE",), "contacts": ("NAME", "LAST_NAME")}
+JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+# Поле Битрикс24 (или служебное REF/COMPANY_REF) -> колонки файла, которые ищутся по умолчанию
+DEFAULT_MAPPINGS = {
+    "companies": {
+        "REF": ["external_id", "id", "ID", "ref"],
+        "TITLE": ["TITLE", "title", "name", "company"],
+        "PHONE": ["PHONE", "phone", "phones"],
+        "EMAIL": ["EMAIL", "email", "emails"]
+    },
+    "contacts": {
+        "REF": ["external_id", "id", "ID", "ref"],
+        "NAME": ["NAME", "name", "first_name"],
+        "LAST_NAME": ["LAST_NAME", "last_name", "surname"],
+        "POST": ["POST", "post", "position", "job"],
+        "PHONE": ["PHONE", "phone", "phones"],
+        "EMAIL": ["EMAIL", "email", "emails"],
+        "COMPANY_REF": ["company_ref", "company_external_id", "company_id"],
+        "COMPANY_ID": ["COMPANY_ID", "bitrix_company_id"]
+    }
+}
+
+
+def resolve_mapping(entity: str, columns: List[str], mapping: Optional[Dict[str, str]] = None,
+                    strict: bool = True) -> Dict[str, str]:
+    """Сопоставляет поля колонкам файла: явное соответствие важнее значений по умолчанию"""
+    resolved = {}
+    for field, candidates in DEFAULT_MAPPINGS[entity].items():
+        for column in candidates:
+            if column in columns:
+                resolved[field] = column
+                break
+    for field, column in (mapping or {}).items():
+        if column not in columns:
+            if not strict:
+                continue
+            raise ValueError(f"Колонка {column} для поля {field} отсутствует в файле")
+        resolved[field] = column
+    return resolved
+
+
+def read_rows(path: str, fmt: str, delimiter: Optional[str] = None) -> Iterator[dict]:
+    """Читает строки файла по одной"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if fmt == "jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        if delimiter is None:
+            sample = f.read(64 * 1024)
+            f.seek(0)
+            try:
+                delimiter = csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+            except csv.Error:
+                delimiter = ","
+        yield from csv.DictReader(f, delimiter=delimiter)
+
+
+def _multifield(value) -> list:
+    if isinstance(value, list):
+        values = value
+    else:
+        values = str(value).split(";")
+    return [{"VALUE": v.strip(), "VALUE_TYPE": "WORK"} for v in map(str, values) if v.strip()]
+
+
+class ImportRefs:
+    """Соответствие внешних ключей компаний их ID в Битрикс24 для одного задания импорта"""
+
+    def __init__(self, job_id: str, state_dir: str = IMPORT_STATE_DIR):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, f"{job_id}.sqlite3")
+        # Строки читаются в потоке run_batches, а ID записываются из on_result - обращения идут по очереди
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS company_refs (ref TEXT PRIMARY KEY, id INTEGER NOT NULL)")
+        self.db.commit()
+
+    def get(self, ref: str) -> Optional[int]:
+        row = self.db.execute("SELECT id FROM company_refs WHERE ref = ?", (ref,)).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, pairs: List[Tuple[str, int]]):
+        self.db.executemany("INSERT OR REPLACE INTO company_refs (ref, id) VALUES (?, ?)", pairs)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class BulkImporter:
+    """Импорт одного файла: строки -> поля batchImport -> run_batches"""
+
+    def __init__(self, entity: str, job_id: str, mapping: Optional[Dict[str, str]] = None):
+        if entity not in ENTITY_TYPES:
+            raise ValueError(f"Неизвестная сущность: {entity}")
+        self.entity = entity
+        self.job_id = job_id
+        self.mapping = mapping
+        self.refs = ImportRefs(job_id)
+        self.stats = {
+            "job_id": job_id,
+            "entity": entity,
+            "rows": 0,
+            "created": 0,
+            "skipped": 0,
+            "duplicates": 0,
+            "merged": 0,
+            "unresolved_company_refs": 0
+        }
+        # Ключи контактов, отправленных в этом импорте, но еще не созданных
+        self.in_flight = set()
+
+    def map_rows(self, rows: Iterator[dict]) -> Iterator[Tuple[Optional[str], dict]]:
+        """Превращает строки файла в пары (внешний ключ, поля batchImport)"""
+        # В JSONL у строк может быть разный набор ключей: соответствие считается для каждого набора
+        mappings = {}
+        for row in rows:
+            self.stats["rows"] += 1
+            columns = tuple(row)
+            resolved = mappings.get(columns)
+            if resolved is None:
+                resolved = resolve_mapping(self.entity, columns, self.mapping, strict=not mappings)
+                if not mappings:
+                    logger.info("Импорт %s: соответствие полей %s", self.entity, resolved)
+                if len(mappings) < 1000:
+                    mappings[columns] = resolved
+
+            item = {}
+            for field, column in resolved.items():
+                value = row.get(column)
+                if value in (None, "") or field in ("REF", "COMPANY_REF"):
+                    continue
+                item[field] = _multifield(value) if field in MULTIFIELDS else value
+
+            company_ref = row.get(resolved["COMPANY_REF"]) if "COMPANY_REF" in resolved else None
+            if company_ref not in (None, ""):
+                company_id = self.refs.get(str(company_ref))
+                if company_id is not None:
+                    item["COMPANY_ID"] = company_id
+                elif "COMPANY_ID" not in item:
+                    self.stats["unresolved_company_refs"] += 1
+
+            if not any(item.get(field) for field in REQUIRED_FIELDS[self.entity]):
+                self.stats["skipped"] += 1
+                continue
+
+            ref = row.get(resolved["REF"]) if "REF" in resolved else None
+            yield (str(ref) if ref not in (None, "") else None), item
+
+    def dedupe(self, items: Iterator[Tuple[Optional[str], dict]]) -> Iterator[Tuple[Optional[str], dict]]:
+        """
+        Пропускает контакты, совпадающие по телефону или email с существующими (DEDUP_MODE=merge - дописывает в них).
+        Слияние вызывает портал синхронно: run_batches берет элементы потока в asyncio.to_thread.
+        """
+        merges = []
+        for ref, item in items:
+            keys = dedup_index.key_hashes(item)
+            existing = dedup_index.find_hashes(keys)
+            if existing is None and not any(key in self.in_flight for key in keys):
+                self.in_flight.update(keys)
+                yield ref, item
+                continue
+            self.stats["duplicates"] += 1
+            # Дубль строки этого же импорта еще не имеет ID - его можно только пропустить
+            if existing is not None and dedup_index.mode == "merge":
+                merges.append((existing, item))
+                if len(merges) == MAX_COMMANDS:
+                    self.merge(merges)
+                    merges = []
+        if merges:
+            self.merge(merges)
+
+    def merge(self, merges: List[Tuple[int, dict]]):
+        """Добавляет найденным контактам телефоны и email строк, которых еще нет в индексе; остальные поля не меняются"""
+        operations = []
+        added = {}
+        for contact_id, item in merges:
+            fields = {}
+            for field in MULTIFIELDS:
+                values = [value for value in item.get(field, [])
+                          if dedup_index.find({field: [value]}) is None]
+                if values:
+                    fields[field] = values
+            if fields:
+                key = f"merge_{len(operations)}"
+                operations.append(Operation(key, "crm.contact.update", {"id": contact_id, "fields": fields}))
+                added[key] = (contact_id, fields)
+        if not operations:
+            return
+        results, _ = execute_operations(operations)
+        for key, value in results.items():
+            if value is True:
+                self.stats["merged"] += 1
+                dedup_index.add(*added[key])
+
+    def execute(self, batch: List[Tuple[Optional[str], dict]]) -> Optional[List[Tuple[Optional[str], int]]]:
+        """Отправляет батч и возвращает пары (внешний ключ, новый ID) для созданных записей"""
+        result = bx_batch_import(ENTITY_TYPES[self.entity], [item for _, item in batch])
+        if not result or "items" not in result:
+            return None  # Ключи строк освобождает release_keys, если батч не будет повторен
+        # Элементы ответа идут в том же порядке, что и отправленные
+        created = [
+            (ref, int(item["item"]["id"]), fields) for (ref, fields), item in zip(batch, result["items"])
+            if "item" in item and "id" in item["item"]
+        ]
+        if self.entity == "contacts" and dedup_index.enabled:
+            for _, new_id, fields in created:
+                dedup_index.add(new_id, fields)
+            # Созданные строки теперь в индексе, не созданные при частичном успехе не повторяются
+            if created:
+                self.release_keys(batch)
+        return [(ref, new_id) for ref, new_id, _ in created]
+
+    def release_keys(self, batch: List[Tuple[Optional[str], dict]]):
+        """Освобождает ключи дублей строк, покинувших импорт"""
+        for _, fields in batch:
+            self.in_flight.difference_update(dedup_index.key_hashes(fields))
+
+    async def on_result(self, batch, created):
+        self.stats["created"] += len(created)
+        if self.entity == "companies":
+            await asyncio.to_thread(self.refs.put_many, [(ref, new_id) for ref, new_id in created if ref is not None])
+
+    async def run(self, path: str, fmt: str, delimiter: Optional[str] = None, before_batch=None,
+                  session_id: str = "") -> dict:
+        with tracer.span("bulk_import", entity=self.entity, **{"import.job_id": self.job_id}):
+            try:
+                items = self.map_rows(read_rows(path, fmt, delimiter))
+                if self.entity == "contacts" and dedup_index.enabled:
+                    items = self.dedupe(items)
+                await run_batches(
+                    items,
+                    f"{'company' if self.entity == 'companies' else 'contact'}_import",
+                    self.execute, before_batch=before_batch, on_result=self.on_result,
+                    on_failure=self.release_keys if self.entity == "contacts" and dedup_index.enabled else None,
+                    label=f"Импорт {self.entity}", session_id=session_id, collect=False
+                )
+            finally:
+                self.refs.close()
+        self.stats["failed"] = (self.stats["rows"] - self.stats["skipped"] - self.stats["duplicates"]
+                                - self.stats["created"])
+        logger.info("Импорт %s завершен: %s", self.entity, self.stats)
+        return self.stats
+
+
+def _check_job_id(job_id: str) -> str:
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        raise ValueError("job_id может содержать только латинские буквы, цифры, '.', '_' и '-'")
+    return job_id
+
+
+def create_import_routes(app: FastAPI, manager):
+    """Создает маршрут массового импорта"""
+
+    @app.post("/import/{entity}")
+    async def import_entities(request: Request, entity: str, format: str = "csv", job_id: Optional[str] = None,
+                              session_id: Optional[str] = None, mapping: Optional[str] = None,
+                              delimiter: Optional[str] = None):
+        """
+        Импорт companies/contacts из тела запроса (CSV или JSONL).
+        Компании импортируются первыми; контакты с тем же job_id получают COMPANY_ID по колонке company_ref.
+        """
+        if entity not in ENTITY_TYPES:
+            raise HTTPException(status_code=404, detail="Поддерживается импорт companies и contacts")
+        if format not in FORMATS:
+            raise HTTPException(status_code=400, detail="Формат должен быть csv или jsonl")
+        try:
+            job_id = _check_job_id(job_id or uuid.uuid4().hex[:12])
+            field_mapping = json.loads(mapping) if mapping else None
+            if field_mapping is not None and not isinstance(field_mapping, dict):
+                raise ValueError("mapping должен быть JSON объектом {поле: колонка}")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if session_id and not await manager.ensure_session(session_id):
+            raise HTTPException(status_code=404, detail="Session not found")
+
+        async def check_session():
+            if session_id and manager.should_stop_generation_for_session(session_id):
+                raise HTTPException(status_code=408, detail="Сессия неактивна")
+
+        # Тело запроса сохраняется во временный файл по частям, в памяти оно целиком не держится
+        with tempfile.NamedTemporaryFile(prefix="bitrix-import-", suffix=f".{format}", delete=False) as spool:
+            async for chunk in request.stream():
+                spool.write(chunk)
+            spool_path = spool.name
+
+        importer = BulkImporter(entity, job_id, field_mapping)
+        if session_id:
+            await manager.send_message_to_session(session_id, json.dumps({
+                "type": "progress", "message": f"Импорт {entity} запущен (задание {job_id})"
+            }, ensure_ascii=False))
+        try:
+            stats = await importer.run(spool_path, format, delimiter, check_session, session_id or "")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            os.unlink(spool_path)
+
+        if session_id:
+            await manager.send_message_to_session(session_id, json.dumps({
+                "type": "progress",
+                "message": f"Импорт {entity} завершен: создано {stats['created']} из {stats['rows']}"
+            }, ensure_ascii=False))
+        return stats
+
+
+def main():
+    from log_config import setup_logging
+
+    parser = argparse.ArgumentParser(description="Импорт контактов и компаний из CSV/JSONL в Битрикс24")
+    parser.add_argument("entity", choices=sorted(ENTITY_TYPES))
+    parser.add_argument("path")
+    parser.add_argument("--job", required=True, help="ID задания: общий для компаний и их контактов")
+    parser.add_argument("--format", choices=FORMATS, help="По умолчанию - по расширению файла")
+    parser.add_argument("--mapping", help='JSON соответствие полей колонкам: {"TITLE": "Название"}')
+    parser.add_argument("--delimiter", help="Разделитель CSV (по умолчанию определяется автоматически)")
+    args = parser.parse_args()
+
+    setup_logging()
+    fmt = args.format or ("jsonl" if args.path.endswith((".jsonl", ".ndjson")) else "csv")
+    importer = BulkImporter(args.entity, _check_job_id(args.job), json.loads(args.mapping) if args.mapping else None)
+    stats = asyncio.run(importer.run(args.path, fmt, args.delimiter))
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
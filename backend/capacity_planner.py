@@ -0,0 +1,209 @@
+"""
+Планирование запусков генерации (dry_run).
+
+Строит прогноз для того пути, которым пойдет настоящий запуск - обычного или потокового,
+со сборкой результата из Битрикс24 или локально, со сверкой привязок или без нее - но ничего
+не отправляет в Битрикс24. Синтез данных и формирование команд batch выполняются на выборке
+из PLAN_SAMPLE_SIZE записей и пересчитываются на весь запуск, поэтому время планирования не
+зависит от количества записей. По размерам батчей и времени вызовов, сохраненным автоподбором
+для портала (или заданным в настройках), оценивает количество REST вызовов, длительность,
+расход лимитов и память.
+"""
+
+import json
+import math
+import time
+import threading
+import tracemalloc
+from typing import Optional
+
+from batch_tuner import batch_tuning
+from config import (PLAN_DEFAULT_CALL_MS, PLAN_SAMPLE_SIZE, BITRIX_RATE_LIMIT, BITRIX_RATE_BURST,
+                    BITRIX_OPERATING_LIMIT, STREAMING_THRESHOLD, READBACK_MODE, READBACK_VERIFY_SAMPLE,
+                    RECONCILE_LINKS, STREAM_RESULT_CHUNK)
+from data_generator import build_contacts_payload, build_companies_payload, build_link_commands
+from local_results import MAX_VERIFY_SAMPLE
+from reconciliation import PAGE_SIZE as RECONCILE_PAGE_SIZE, BATCH_PAUSE as RECONCILE_PAUSE
+from result_builder import build_company_records
+
+BATCH_COMMANDS = 50  # Команд в одном вызове batch
+RESULT_SAMPLE_SIZE = 200
+OPERATING_WINDOW_SECONDS = 600  # Лимит времени выполнения метода считается за 10 минут
+
+# tracemalloc глобален для процесса, поэтому одновременно выполняется только одна оценка памяти
+_memory_lock = threading.Lock()
+
+
+def _estimate_result_bytes(num_companies: int, num_contacts: int) -> int:
+    """Оценивает память под num_companies компаний результата по небольшой выборке"""
+    sample_companies = min(num_companies, RESULT_SAMPLE_SIZE)
+    if not sample_companies:
+        return 0
+    sample_contacts = min(num_contacts, RESULT_SAMPLE_SIZE)
+    companies = {
+        f"company_{i}": {"ID": str(i), **row} for i, row in enumerate(build_companies_payload(sample_companies), 1)
+    }
+    contacts = {
+        f"contact_{i}": {"ID": str(i), "COMPANY_ID": str(i), **row}
+        for i, row in enumerate(build_contacts_payload(sample_contacts), 1)
+    }
+    with _memory_lock:
+        own_tracing = not tracemalloc.is_tracing()
+        if own_tracing:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            records = build_company_records(companies, contacts)
+            used = tracemalloc.get_traced_memory()[0] - before
+            del records
+        finally:
+            if own_tracing:
+                tracemalloc.stop()
+    return int(used / sample_companies * num_companies)
+
+
+def _sample_payload(build, count: int):
+    """Синтезирует выборку; возвращает (секунд на запись, байт запроса на запись)"""
+    sample = min(count, PLAN_SAMPLE_SIZE)
+    if not sample:
+        return 0.0, 0
+    started = time.perf_counter()
+    payload = build(sample)
+    seconds = time.perf_counter() - started
+    request_bytes = len(json.dumps({"entityTypeId": 0, "data": payload}, ensure_ascii=False).encode())
+    return seconds / sample, request_bytes / sample
+
+
+def _sample_link_bytes(pairs: int) -> float:
+    """Байт команд привязки на пару по одному batch; ID той же разрядности, что у настоящего запуска"""
+    sample = min(pairs, BATCH_COMMANDS)
+    if not sample:
+        return 0.0
+    commands = build_link_commands([(pairs + i, pairs + sample + i) for i in range(sample)])
+    return sum(len(key) + len(command) for key, command in commands.items()) / sample
+
+
+def plan_generation(num_contacts: int, num_companies: int, call_ms: float = None, stream: Optional[bool] = None,
+                    readback: Optional[str] = None, reconcile: Optional[bool] = None) -> dict:
+    """
+    Прогноз запуска без обращений к Битрикс24. stream, readback и reconcile выбираются так же,
+    как в /create-test-data: значения запроса, иначе STREAMING_THRESHOLD, READBACK_MODE и RECONCILE_LINKS.
+    """
+    started = time.perf_counter()
+    if stream is None:
+        stream = STREAMING_THRESHOLD > 0 and num_contacts + num_companies >= STREAMING_THRESHOLD
+    # Потоковый запуск всегда загружает результат из Битрикс24 и не сверяет привязки
+    readback = "full" if stream else readback or READBACK_MODE
+    reconcile = False if stream else RECONCILE_LINKS if reconcile is None else reconcile
+    pairs = min(num_contacts, num_companies)
+    operations = {}
+
+    def call_timing(operation: str):
+        saved = batch_tuning.get_saved(operation)
+        if call_ms is not None:
+            return call_ms / 1000, "request"
+        if "avg_call_seconds" in saved:
+            return saved["avg_call_seconds"], "measured"
+        return PLAN_DEFAULT_CALL_MS / 1000, "default"
+
+    def batch_size(operation: str) -> int:
+        return batch_tuning.get_saved(operation).get("size", batch_tuning.tuner(operation).size)
+
+    def add(name: str, method: str, items: int, size: int, pause: float, calls_per_batch: int = 1,
+            timing_operation: str = None, request_bytes: Optional[int] = None):
+        # Вызовы выполняются последовательно, пауза - между батчами, как в run_batches
+        call_seconds, source = call_timing(timing_operation or name)
+        batches = math.ceil(items / size) if items else 0
+        calls = batches * calls_per_batch
+        operations[name] = {
+            "method": method,
+            "items": items,
+            "calls": calls,
+            "batch_size": size,
+            "request_bytes": request_bytes,
+            "call_ms": round(call_seconds * 1000, 1),
+            "latency_source": source,
+            "seconds": round(calls * call_seconds + batches * pause, 1),
+            "_call_seconds": call_seconds,
+            "_pause": pause
+        }
+
+    # Синтез выборки без tracemalloc, чтобы замер времени не был завышен
+    synthesis_seconds = 0.0
+    for operation, count, build in (("contact_import", num_contacts, build_contacts_payload),
+                                    ("company_import", num_companies, build_companies_payload)):
+        per_item_seconds, per_item_bytes = _sample_payload(build, count)
+        synthesis_seconds += per_item_seconds * count
+        add(operation, "crm.item.batchImport", count, batch_size(operation), 0.2,
+            request_bytes=int(per_item_bytes * count))
+
+    add("contact_link", "crm.contact.update", pairs, batch_size("contact_link"), 0.2,
+        request_bytes=int(_sample_link_bytes(pairs) * pairs))
+
+    if reconcile:
+        # crm.contact.list по RECONCILE_PAGE_SIZE контактов на команду, до 50 команд в вызове batch;
+        # повторная отправка расхождений не планируется - их количество заранее неизвестно
+        add("reconcile_list", "crm.contact.list", pairs, RECONCILE_PAGE_SIZE * BATCH_COMMANDS, RECONCILE_PAUSE,
+            timing_operation="contact_get")
+
+    if stream:
+        # Батч компаний загружается одним вызовом, контакты этих компаний - вторым
+        add("company_get", "crm.company.get", num_companies, batch_size("company_get"), 0.1, calls_per_batch=2)
+    elif readback == "local":
+        # Из Битрикс24 читается только проверочная выборка компаний и контактов
+        sample = min(READBACK_VERIFY_SAMPLE, MAX_VERIFY_SAMPLE)
+        verify_items = min(sample, num_companies) + min(sample, num_contacts)
+        add("readback_verify", "crm.company.get", verify_items, BATCH_COMMANDS, 0.0, timing_operation="company_get")
+    else:
+        add("company_get", "crm.company.get", num_companies, batch_size("company_get"), 0.1)
+        add("contact_get", "crm.contact.get", num_contacts, batch_size("contact_get"), 0.1)
+
+    # Синтез идет перед отправкой каждого батча, поэтому входит в длительность
+    duration = synthesis_seconds
+    peak_rate = 0.0
+    operating = {}
+    for plan in operations.values():
+        call_seconds, pause = plan.pop("_call_seconds"), plan.pop("_pause")
+        duration += plan["seconds"]
+        if plan["calls"]:
+            peak_rate = max(peak_rate, 1 / (call_seconds + pause))
+        operating[plan["method"]] = operating.get(plan["method"], 0.0) + plan["calls"] * call_seconds
+
+    total_calls = sum(plan["calls"] for plan in operations.values())
+    # Лимит запросов - "дырявое ведро": запас BITRIX_RATE_BURST, дальше не быстрее BITRIX_RATE_LIMIT в секунду
+    min_seconds_by_rate = max(0.0, (total_calls - BITRIX_RATE_BURST) / BITRIX_RATE_LIMIT)
+    # Время выполнения метода ограничено BITRIX_OPERATING_LIMIT секундами за 10 минут
+    operating_windows = max((math.ceil(seconds / BITRIX_OPERATING_LIMIT) for seconds in operating.values()), default=0)
+    min_seconds_by_operating = max(0, operating_windows - 1) * OPERATING_WINDOW_SECONDS
+
+    # Потоковый запуск держит в памяти только одну часть результата
+    result_companies = min(num_companies, STREAM_RESULT_CHUNK) if stream else num_companies
+    result_bytes = _estimate_result_bytes(result_companies, min(num_contacts, result_companies))
+
+    return {
+        "dry_run": True,
+        "contacts": num_contacts,
+        "companies": num_companies,
+        "links": pairs,
+        "stream": stream,
+        "readback": readback,
+        "reconcile": reconcile,
+        "operations": operations,
+        "total_calls": total_calls,
+        "synthesis_seconds": round(synthesis_seconds, 2),
+        "estimated_seconds": round(max(duration, min_seconds_by_rate, min_seconds_by_operating), 1),
+        "rate_limit": {
+            "limit_per_second": BITRIX_RATE_LIMIT,
+            "burst": BITRIX_RATE_BURST,
+            "peak_request_rate": round(peak_rate, 2),
+            "throttled": peak_rate > BITRIX_RATE_LIMIT and total_calls > BITRIX_RATE_BURST,
+            "min_seconds": round(min_seconds_by_rate, 1),
+            "operating_seconds": {method: round(seconds, 1) for method, seconds in operating.items()},
+            "operating_limit_per_10_min": BITRIX_OPERATING_LIMIT,
+            "operating_windows": operating_windows
+        },
+        "memory": {
+            "result_estimate_bytes": result_bytes
+        },
+        "planning_seconds": round(time.perf_counter() - started, 2)
+    }
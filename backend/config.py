@@ -12,8 +12,117 @@ WEBHOOK_URL = os.getenv("BITRIX24_WEBHOOK_URL", "https://b24-lkgkv0.bitrix24.ru/
 NUM_CONTACTS = int(os.getenv("NUM_CONTACTS", 100))
 NUM_COMPANIES = int(os.getenv("NUM_COMPANIES", 100))
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
+# Сжатие WebSocket сообщений (permessage-deflate), браузеры согласуют его автоматически
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "True").lower() == "true"
 
 # OAuth настройки для серверного приложения
 BITRIX24_CLIENT_ID = os.getenv("BITRIX24_CLIENT_ID", "local.68f61a51897255.41591672")
 BITRIX24_CLIENT_SECRET = os.getenv("BITRIX24_CLIENT_SECRET", "l0xHY0JBM6Gy5dpCDeTW8IMO1l7mK7ZNGqruUL1Nnz3pbv2GMr")
 BITRIX24_REDIRECT_URI = os.getenv("BITRIX24_REDIRECT_URI", "https://amusingly-awaited-starling.cloudpub.ru/bitrix/oauth/callback")
+
+# Очередь входящих webhook событий Битрикс24
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 2))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 50))
+WEBHOOK_BATCH_TIMEOUT = float(os.getenv("WEBHOOK_BATCH_TIMEOUT", 0.5))
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", 10000))
+WEBHOOK_JOURNAL_PATH = os.getenv("WEBHOOK_JOURNAL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "webhook_events.jsonl"))
+WEBHOOK_JOURNAL_FSYNC = os.getenv("WEBHOOK_JOURNAL_FSYNC", "False").lower() == "true"
+# Повторы пачек с ошибкой обработчика: число попыток и первая задержка (удваивается), затем - в файл недоставленных
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 5))
+WEBHOOK_RETRY_DELAY = float(os.getenv("WEBHOOK_RETRY_DELAY", 1.0))
+WEBHOOK_DEAD_LETTER_PATH = os.getenv("WEBHOOK_DEAD_LETTER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "webhook_dead_letter.jsonl"))
+
+# Локальное зеркало контактов и компаний (SQLite)
+MIRROR_ENABLED = os.getenv("MIRROR_ENABLED", "False").lower() == "true"
+MIRROR_DB_PATH = os.getenv("MIRROR_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "crm_mirror.sqlite3"))
+
+# Файлы сборки фронтенда меньше этого размера (байт) хранятся в памяти вместе со сжатыми вариантами
+STATIC_MEMORY_FILE_LIMIT = int(os.getenv("STATIC_MEMORY_FILE_LIMIT", 1024 * 1024))
+
+# Несколько воркеров: общий реестр сессий и доставка сообщений между процессами
+WORKERS = int(os.getenv("WORKERS", 1))
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # memory или redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SESSION_TTL = int(os.getenv("SESSION_TTL", 3600))
+
+# Сессии без активности дольше SESSION_IDLE_TIMEOUT секунд закрываются (клиент шлет ping каждые 30 с)
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", 120))
+SESSION_REAPER_INTERVAL = int(os.getenv("SESSION_REAPER_INTERVAL", 10))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 1000))
+
+# Монитор задержек event loop: отчет об остановках доступен на /debug/loop-stalls
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "True").lower() == "true"
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", 0.1))
+LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS", 200))
+LOOP_STALL_SAMPLE_INTERVAL_MS = float(os.getenv("LOOP_STALL_SAMPLE_INTERVAL_MS", 10))
+LOOP_STALL_PROFILE = os.getenv("LOOP_STALL_PROFILE", "True").lower() == "true"
+LOOP_STALL_HISTORY = int(os.getenv("LOOP_STALL_HISTORY", 50))
+
+# Трассировка запусков генерации: файл для выгрузки трейсов (пусто - выключено), формат json или otlp
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_EXPORT_FORMAT = os.getenv("TRACE_EXPORT_FORMAT", "json")
+
+# Логирование: общий уровень, уровни модулей (bitrix_api=DEBUG,main=WARNING), формат text или json,
+# выборка частых сообщений о батчах (пишется каждое N-е) и размер очереди записи
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_BATCH_SAMPLE_EVERY = int(os.getenv("LOG_BATCH_SAMPLE_EVERY", 10))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+# Подбор размера батча: границы, шаг увеличения, допустимая доля ошибок и время одного вызова,
+# файл с размерами, на которых подбор остановился для каждого портала
+BATCH_AUTOTUNE = os.getenv("BATCH_AUTOTUNE", "True").lower() == "true"
+BATCH_INITIAL_SIZE = int(os.getenv("BATCH_INITIAL_SIZE", 20))
+BATCH_MIN_SIZE = int(os.getenv("BATCH_MIN_SIZE", 5))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 50))  # batch принимает не больше 50 команд
+BATCH_INCREASE_STEP = int(os.getenv("BATCH_INCREASE_STEP", 5))
+BATCH_MAX_ERROR_RATE = float(os.getenv("BATCH_MAX_ERROR_RATE", 0.1))
+BATCH_MAX_CALL_SECONDS = float(os.getenv("BATCH_MAX_CALL_SECONDS", 10))
+BATCH_TUNER_STATE_PATH = os.getenv("BATCH_TUNER_STATE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch_tuning.json"))
+
+# Планирование запусков (dry_run): время вызова, если для портала еще нет замеров,
+# и лимиты REST API Битрикс24 (запросов в секунду, запас запросов, секунд выполнения метода за 10 минут)
+PLAN_DEFAULT_CALL_MS = float(os.getenv("PLAN_DEFAULT_CALL_MS", 800))
+BITRIX_RATE_LIMIT = float(os.getenv("BITRIX_RATE_LIMIT", 2))
+BITRIX_RATE_BURST = int(os.getenv("BITRIX_RATE_BURST", 50))
+BITRIX_OPERATING_LIMIT = float(os.getenv("BITRIX_OPERATING_LIMIT", 480))
+# Прогноз строится по выборке из PLAN_SAMPLE_SIZE записей каждого типа; PLAN_MAX_RECORDS - предел количеств в запросе
+PLAN_SAMPLE_SIZE = int(os.getenv("PLAN_SAMPLE_SIZE", 1000))
+PLAN_MAX_RECORDS = int(os.getenv("PLAN_MAX_RECORDS", 10000000))
+
+# Массовый импорт CSV/JSONL: каталог с соответствиями внешних ключей компаний новым ID
+IMPORT_STATE_DIR = os.getenv("IMPORT_STATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "imports"))
+
+# Выгрузка портала: каталог заданий, сколько страниц по 50 записей упаковывать в один batch вызов
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports"))
+EXPORT_PAGES_PER_BATCH = int(os.getenv("EXPORT_PAGES_PER_BATCH", 50))
+
+# Результат генерации: full - повторно загрузить все созданные записи, local - собрать из отправленных
+# данных и выданных ID, проверив выборку из READBACK_VERIFY_SAMPLE компаний и контактов
+READBACK_MODE = os.getenv("READBACK_MODE", "full")
+READBACK_VERIFY_SAMPLE = int(os.getenv("READBACK_VERIFY_SAMPLE", 20))
+
+# Сверка привязок контактов с порталом после запуска и исправление расхождений
+RECONCILE_LINKS = os.getenv("RECONCILE_LINKS", "False").lower() == "true"
+
+# Поиск дублей контактов по телефону (E.164) и email перед batchImport: off, skip - пропускать,
+# merge - дописывать новые телефоны и email в найденный контакт (только массовый импорт, генерация дубли пропускает)
+DEDUP_MODE = os.getenv("DEDUP_MODE", "off")
+DEDUP_DEFAULT_COUNTRY = os.getenv("DEDUP_DEFAULT_COUNTRY", "7")  # Код страны для номеров без него
+
+# Потоковый режим генерации: ID в колонках array('q'), результат отправляется частями.
+# Включается, когда контактов и компаний вместе не меньше STREAMING_THRESHOLD (0 - только по запросу)
+STREAMING_THRESHOLD = int(os.getenv("STREAMING_THRESHOLD", 50000))
+STREAM_RESULT_CHUNK = int(os.getenv("STREAM_RESULT_CHUNK", 1000))  # Компаний в одном сообщении результата
+
+# Фоновая загрузка отложенных зависимостей (Faker, requests) после старта сервера
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "True").lower() == "true"
+
+# Статус сессии без WebSocket: SSE /generation-status/{session_id}/stream и long-poll .../poll.
+# Сколько последних изменений статуса сессии хранится для повтора по Last-Event-ID (сообщения
+# хранятся до доставки), как часто SSE шлет комментарий keepalive и сколько секунд long-poll ждет изменения
+STATUS_EVENT_BUFFER = int(os.getenv("STATUS_EVENT_BUFFER", 50))
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", 15))
+LONG_POLL_TIMEOUT = float(os.getenv("LONG_POLL_TIMEOUT", 25))
@@ -0,0 +1,320 @@
+"""
+Полная выгрузка контактов и компаний портала.
+
+Страницы листаются по ID (order[ID]=ASC, filter[>ID]=последний ID, start=-1 - без подсчета
+total), поэтому каждая страница стоит одинаково независимо от глубины. В один batch вызов
+упаковывается до EXPORT_PAGES_PER_BATCH страниц: фильтр следующей страницы ссылается на
+последний ID предыдущей через $result[...]. Строки сразу дописываются в JSONL или Parquet,
+после каждого вызова сохраняется последний выгруженный ID - прерванную выгрузку можно продолжить.
+
+Запуск из командной строки:
+    python crm_export.py --job full-2024 --format jsonl
+    python crm_export.py --job full-2024 --resume
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import threading
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException
+
+from batch_tuner import BatchTuner
+from bitrix_api import bx_call
+from config import EXPORT_DIR, EXPORT_PAGES_PER_BATCH
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 50  # Bitrix24 всегда отдает списки страницами по 50
+ENTITIES = {"companies": "crm.company.list", "contacts": "crm.contact.list"}
+# Все стандартные и пользовательские поля; множественные поля в "*" не входят
+EXPORT_SELECT = ["*", "UF_*", "PHONE", "EMAIL"]
+FORMATS = ("jsonl", "parquet")
+JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+BATCH_PAUSE = 0.2
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow - необязательная зависимость, без нее доступна только выгрузка в JSONL
+    pyarrow = None
+
+
+def build_page_commands(method: str, last_id: int, pages: int) -> Dict[str, str]:
+    """Команды batch для нескольких страниц подряд: каждая следующая начинается после последнего ID предыдущей"""
+    select = "&".join(f"select[{i}]={field}" for i, field in enumerate(EXPORT_SELECT))
+    commands = {}
+    for page in range(pages):
+        after = last_id if page == 0 else f"$result[page_{page - 1}][{PAGE_SIZE - 1}][ID]"
+        commands[f"page_{page}"] = f"{method}?order[ID]=ASC&filter[>ID]={after}&{select}&start=-1"
+    return commands
+
+
+def collect_pages(results: dict, errors: dict, pages: int, last_id: int):
+    """
+    Собирает строки страниц по порядку и решает, закончилась ли выгрузка.
+    Если страница неполная, ссылка $result следующей страницы пустая и Битрикс24 выполнил бы
+    ее с пустым фильтром - с начала таблицы. Поэтому страницы после неполной отбрасываются,
+    а строки с ID не больше уже выгруженного не принимаются.
+    """
+    rows = []
+    for page in range(pages):
+        key = f"page_{page}"
+        if key in errors:
+            raise RuntimeError(f"Ошибка страницы выгрузки: {errors[key]}")
+        page_rows = results.get(key) or []
+        if page_rows and int(page_rows[0]["ID"]) <= last_id:
+            raise RuntimeError(f"Выгрузка вернулась к ID {page_rows[0]['ID']} (последний {last_id})")
+        rows.extend(page_rows)
+        if page_rows:
+            last_id = int(page_rows[-1]["ID"])
+        if len(page_rows) < PAGE_SIZE:
+            return rows, last_id, True
+    return rows, last_id, False
+
+
+class JsonlWriter:
+    """Дописывает строки в JSONL; при продолжении обрезает файл до последнего сохраненного состояния"""
+
+    def __init__(self, path: str, offset: Optional[int]):
+        self.path = path
+        self.file = open(path, "r+b" if offset is not None and os.path.exists(path) else "wb")
+        if offset is not None:
+            self.file.truncate(offset)
+            self.file.seek(offset)
+
+    def write(self, rows: List[dict]):
+        self.file.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8"))
+
+    def commit(self) -> dict:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"offset": self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """
+    Пишет каждый batch вызов отдельным файлом части (<сущность>-00001.parquet, ...): незакрытый
+    Parquet файл нельзя прочитать, а так после сбоя все сохраненные в состоянии части целы.
+    Каталог частей читается как один набор данных (pyarrow.dataset, pandas.read_parquet).
+    Значения хранятся строками, множественные поля - JSON.
+    """
+
+    def __init__(self, path: str, part: int):
+        if pyarrow is None:
+            raise RuntimeError("Для выгрузки в Parquet установите пакет pyarrow: pip install pyarrow")
+        self.prefix = path[:-len(".parquet")]
+        self.part = part
+
+    def write(self, rows: List[dict]):
+        if not rows:
+            return
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+
+        def value(v):
+            return None if v is None else v if isinstance(v, str) else json.dumps(v, ensure_ascii=False)
+
+        table = pyarrow.table({column: pyarrow.array([value(row.get(column)) for row in rows], pyarrow.string())
+                               for column in columns})
+        self.part += 1
+        pq.write_table(table, f"{self.prefix}-{self.part:05d}.parquet")
+
+    def commit(self) -> dict:
+        return {"part": self.part}
+
+    def close(self):
+        pass
+
+
+def job_directory(job_id: str) -> str:
+    """Каталог задания внутри EXPORT_DIR; ValueError для недопустимого job_id"""
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        raise ValueError("job_id может содержать только латинские буквы, цифры, '_' и '-'")
+    root = os.path.realpath(EXPORT_DIR)
+    directory = os.path.realpath(os.path.join(root, job_id))
+    # Каталог задания может оказаться символической ссылкой наружу - файлы в нем удаляются при повторной выгрузке
+    if os.path.dirname(directory) != root:
+        raise ValueError("Каталог задания должен находиться в EXPORT_DIR")
+    return directory
+
+
+class CrmExport:
+    """Задание выгрузки: каталог EXPORT_DIR/<job_id> с файлами сущностей и state.json"""
+
+    def __init__(self, job_id: str, fmt: str = "jsonl", entities: Optional[List[str]] = None,
+                 pages_per_batch: int = EXPORT_PAGES_PER_BATCH):
+        directory = job_directory(job_id)
+        if fmt not in FORMATS:
+            raise ValueError("Формат должен быть jsonl или parquet")
+        self.job_id = job_id
+        self.format = fmt
+        self.entities = entities or list(ENTITIES)
+        for entity in self.entities:
+            if entity not in ENTITIES:
+                raise ValueError(f"Неизвестная сущность: {entity}")
+        self.directory = directory
+        self.state_path = os.path.join(self.directory, "state.json")
+        # Размер batch в страницах подбирается так же, как размер батча при импорте
+        self.tuner = BatchTuner("export_pages", initial=pages_per_batch, min_size=1, max_size=pages_per_batch)
+        self.state = {"format": fmt, "entities": {}}
+        self.running = False
+        self.error = None
+
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+            if self.state.get("format") != self.format:
+                raise ValueError(f"Задание {self.job_id} выгружается в формате {self.state.get('format')}")
+
+    def save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _open_writer(self, entity: str, state: dict):
+        path = os.path.join(self.directory, f"{entity}.{self.format}")
+        if self.format == "parquet":
+            return ParquetWriter(path, state.get("part", 0))
+        return JsonlWriter(path, state.get("offset"))
+
+    def _export_entity(self, entity: str):
+        method = ENTITIES[entity]
+        state = self.state["entities"].setdefault(entity, {"last_id": 0, "rows": 0, "done": False})
+        if state["done"]:
+            return
+        writer = self._open_writer(entity, state)
+        try:
+            with tracer.span("export_entity", entity=entity, **{"export.resume_from": state["last_id"]}):
+                while True:
+                    pages = self.tuner.size
+                    started = time.perf_counter()
+                    data = bx_call("batch", {"halt": 0, "cmd": build_page_commands(method, state["last_id"], pages)})
+                    elapsed = time.perf_counter() - started
+                    if data is None:
+                        self.tuner.record(pages, elapsed, pages)
+                        if pages == self.tuner.size:
+                            raise RuntimeError(f"Ошибка batch запроса {method}")
+                        continue  # Повторяем с меньшим количеством страниц
+
+                    result = data.get("result", {})
+                    rows, last_id, done = collect_pages(
+                        result.get("result") or {}, result.get("result_error") or {}, pages, state["last_id"]
+                    )
+                    self.tuner.record(pages, elapsed, 0)
+
+                    writer.write(rows)
+                    state.update(writer.commit())
+                    state["last_id"] = last_id
+                    state["rows"] += len(rows)
+                    state["done"] = done
+                    self.save_state()
+                    logger.info("Выгрузка %s: %d записей, последний ID %d", entity, state["rows"], last_id)
+                    if done:
+                        break
+                    time.sleep(BATCH_PAUSE)
+        finally:
+            writer.close()
+
+    def run(self, resume: bool = False) -> dict:
+        """Выполняет выгрузку (блокирующая, вызывать в потоке)"""
+        os.makedirs(self.directory, exist_ok=True)
+        if resume:
+            self.load_state()
+        else:
+            # Новая выгрузка в существующий каталог: убираем файлы прошлой
+            for name in os.listdir(self.directory):
+                if name.startswith(tuple(self.entities)) or name == "state.json":
+                    os.remove(os.path.join(self.directory, name))
+        self.running = True
+        self.error = None
+        try:
+            with tracer.span("crm_export", **{"export.job_id": self.job_id, "export.format": self.format}):
+                for entity in self.entities:
+                    self._export_entity(entity)
+            logger.info("Выгрузка %s завершена: %s", self.job_id, self.get_status())
+        except Exception as e:
+            self.error = str(e)
+            logger.error("Выгрузка %s прервана: %s", self.job_id, e)
+            raise
+        finally:
+            self.running = False
+        return self.get_status()
+
+    def get_status(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "format": self.format,
+            "directory": self.directory,
+            "running": self.running,
+            "error": self.error,
+            "pages_per_batch": self.tuner.size,
+            "entities": json.loads(json.dumps(self.state["entities"]))
+        }
+
+
+def create_export_routes(app: FastAPI):
+    """Создает маршруты выгрузки портала"""
+    jobs: Dict[str, CrmExport] = {}
+    lock = threading.Lock()
+
+    @app.post("/api/export")
+    async def start_export(format: str = "jsonl", job_id: Optional[str] = None, resume: bool = False,
+                           entities: Optional[str] = None):
+        """Запускает выгрузку в фоне; resume=true продолжает задание с последнего сохраненного ID"""
+        try:
+            export = CrmExport(job_id or uuid.uuid4().hex[:12], format, entities.split(",") if entities else None)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        with lock:
+            current = jobs.get(export.job_id)
+            if current is not None and current.running:
+                raise HTTPException(status_code=409, detail="Выгрузка уже выполняется")
+            jobs[export.job_id] = export
+
+        async def run():
+            try:
+                await asyncio.to_thread(export.run, resume)
+            except Exception:
+                pass  # Ошибка сохранена в статусе задания
+
+        asyncio.create_task(run())
+        return {"job_id": export.job_id, "status": "started"}
+
+    @app.get("/api/export/{job_id}")
+    async def export_status(job_id: str):
+        """Состояние выгрузки"""
+        export = jobs.get(job_id)
+        if export is None:
+            raise HTTPException(status_code=404, detail="Задание не найдено")
+        return export.get_status()
+
+
+def main():
+    from log_config import setup_logging
+
+    parser = argparse.ArgumentParser(description="Полная выгрузка контактов и компаний портала Битрикс24")
+    parser.add_argument("--job", required=True, help="ID задания (каталог в EXPORT_DIR)")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--entities", default=",".join(ENTITIES), help="companies,contacts")
+    parser.add_argument("--resume", action="store_true", help="Продолжить с последнего сохраненного ID")
+    args = parser.parse_args()
+
+    setup_logging()
+    status = CrmExport(args.job, args.format, args.entities.split(",")).run(args.resume)
+    print(json.dumps(status, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
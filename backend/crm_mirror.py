@@ -0,0 +1,357 @@
+import json
+import logging
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List
+from fastapi import FastAPI, HTTPException
+
+from bitrix_api import bx_call, execute_batch_request
+from config import MIRROR_ENABLED, MIRROR_DB_PATH
+from result_builder import build_company_records
+from webhook_queue import webhook_queue
+
+logger = logging.getLogger(__name__)
+
+CONTACT_SELECT = ["ID", "NAME", "LAST_NAME", "PHONE", "EMAIL", "POST", "COMPANY_ID"]
+COMPANY_SELECT = ["ID", "TITLE", "PHONE", "EMAIL"]
+PAGE_SIZE = 50  # Bitrix24 всегда отдает списки страницами по 50
+BATCH_SIZE = 50  # Максимум команд в одном batch запросе
+
+
+def _select_query(select):
+    return "&".join(f"select[{i}]={field}" for i, field in enumerate(select))
+
+
+class CrmMirror:
+    """
+    Локальная SQLite копия контактов и компаний Битрикс24.
+    Заполняется полной синхронизацией через *.list и поддерживается в актуальном
+    состоянии webhook событиями ONCRMCONTACT*/ONCRMCOMPANY*. Строки хранятся
+    в том же виде, в каком их возвращает crm.*.get.
+    """
+
+    def __init__(self, db_path: str = MIRROR_DB_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS contacts (
+                id INTEGER PRIMARY KEY,
+                company_id INTEGER,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS contacts_company_id ON contacts(company_id);
+            CREATE TABLE IF NOT EXISTS companies (
+                id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.db.commit()
+        self.syncing = False
+
+    # Запись
+
+    def upsert_contacts(self, rows: Iterable[dict]):
+        """Сохраняет строки контактов (формат crm.contact.get)"""
+        now = time.time()
+        values = [
+            (int(row["ID"]), int(row["COMPANY_ID"]) if row.get("COMPANY_ID") else None,
+             json.dumps(row, ensure_ascii=False), now)
+            for row in rows
+        ]
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO contacts (id, company_id, data, updated_at) VALUES (?, ?, ?, ?)", values
+            )
+            self.db.commit()
+
+    def upsert_companies(self, rows: Iterable[dict]):
+        """Сохраняет строки компаний (формат crm.company.get)"""
+        now = time.time()
+        values = [(int(row["ID"]), json.dumps(row, ensure_ascii=False), now) for row in rows]
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO companies (id, data, updated_at) VALUES (?, ?, ?)", values
+            )
+            self.db.commit()
+
+    def delete_contacts(self, ids: Iterable[int]):
+        with self.lock:
+            self.db.executemany("DELETE FROM contacts WHERE id = ?", [(int(i),) for i in ids])
+            self.db.commit()
+
+    def delete_companies(self, ids: Iterable[int]):
+        with self.lock:
+            self.db.executemany("DELETE FROM companies WHERE id = ?", [(int(i),) for i in ids])
+            self.db.commit()
+
+    def set_contacts_company(self, pairs: Iterable[tuple]):
+        """Применяет локально успешно отправленные привязки (contact_id, company_id) одной транзакцией"""
+        companies = {int(contact_id): int(company_id) for contact_id, company_id in pairs}
+        if not companies:
+            return
+        now = time.time()
+        ids = list(companies)
+        with self.lock:
+            values = []
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for contact_id, data in self.db.execute(
+                    f"SELECT id, data FROM contacts WHERE id IN ({placeholders})", chunk
+                ):
+                    row = json.loads(data)
+                    row["COMPANY_ID"] = str(companies[contact_id])
+                    values.append((companies[contact_id], json.dumps(row, ensure_ascii=False), now, contact_id))
+            self.db.executemany("UPDATE contacts SET company_id = ?, data = ?, updated_at = ? WHERE id = ?", values)
+            self.db.commit()
+
+    # Чтение
+
+    def _get_rows(self, table: str, ids: List[int]) -> Dict[int, dict]:
+        result = {}
+        with self.lock:
+            # SQLite ограничивает количество параметров запроса, читаем порциями
+            for start in range(0, len(ids), 500):
+                chunk = [int(i) for i in ids[start:start + 500]]
+                placeholders = ",".join("?" * len(chunk))
+                for row_id, data in self.db.execute(
+                    f"SELECT id, data FROM {table} WHERE id IN ({placeholders})", chunk
+                ):
+                    result[row_id] = json.loads(data)
+        return result
+
+    def get_contacts(self, ids: List[int]) -> Dict[int, dict]:
+        """Возвращает найденные локально контакты {id: строка}"""
+        return self._get_rows("contacts", ids)
+
+    def get_companies(self, ids: List[int]) -> Dict[int, dict]:
+        """Возвращает найденные локально компании {id: строка}"""
+        return self._get_rows("companies", ids)
+
+    def iter_contacts(self, chunk: int = 5000) -> Iterator[dict]:
+        """Перебирает все контакты зеркала порциями по ID, не загружая таблицу в память целиком"""
+        last_id = 0
+        while True:
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT id, data FROM contacts WHERE id > ? ORDER BY id LIMIT ?", (last_id, chunk)
+                ).fetchall()
+            if not rows:
+                return
+            for row_id, data in rows:
+                yield json.loads(data)
+            last_id = rows[-1][0]
+
+    def list_companies_with_contacts(self, limit: int = 100, offset: int = 0):
+        """Возвращает страницу компаний и их контакты (строки Bitrix24)"""
+        with self.lock:
+            companies = {
+                row_id: json.loads(data) for row_id, data in self.db.execute(
+                    "SELECT id, data FROM companies ORDER BY id LIMIT ? OFFSET ?", (limit, offset)
+                )
+            }
+            contacts = {}
+            if companies:
+                placeholders = ",".join("?" * len(companies))
+                for row_id, data in self.db.execute(
+                    f"SELECT id, data FROM contacts WHERE company_id IN ({placeholders})", list(companies)
+                ):
+                    contacts[row_id] = json.loads(data)
+        return companies, contacts
+
+    def get_status(self) -> dict:
+        with self.lock:
+            contacts = self.db.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
+            companies = self.db.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+            meta = dict(self.db.execute("SELECT key, value FROM meta").fetchall())
+        return {
+            "contacts": contacts,
+            "companies": companies,
+            "syncing": self.syncing,
+            "last_full_sync": float(meta["last_full_sync"]) if "last_full_sync" in meta else None
+        }
+
+    def get_meta(self, key: str):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value):
+        """Записывает значение meta; None удаляет ключ"""
+        with self.lock:
+            if value is None:
+                self.db.execute("DELETE FROM meta WHERE key = ?", (key,))
+            else:
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+            self.db.commit()
+
+    def needs_full_sync(self) -> bool:
+        """Полная синхронизация еще ни разу не завершилась (в том числе прервалась на середине)"""
+        return self.get_meta("last_full_sync") is None
+
+    # Синхронизация с Битрикс24
+
+    def _sync_entity(self, method: str, select: List[str], upsert) -> int:
+        """
+        Выгружает все записи сущности, листая по ID без подсчета total (start=-1).
+        Последний сохраненный ID записывается в meta, прерванная выгрузка продолжается с него.
+        """
+        cursor_key = f"sync_cursor:{method}"
+        last_id = int(self.get_meta(cursor_key) or 0)
+        total = 0
+        while True:
+            data = bx_call(method, {
+                "order": {"ID": "ASC"},
+                "filter": {">ID": last_id},
+                "select": select,
+                "start": -1
+            })
+            if data is None:
+                raise RuntimeError(f"Ошибка выгрузки {method}")
+            rows = data.get("result", [])
+            if not rows:
+                break
+            upsert(rows)
+            total += len(rows)
+            last_id = int(rows[-1]["ID"])
+            self.set_meta(cursor_key, last_id)
+            if len(rows) < PAGE_SIZE:
+                break
+        return total
+
+    def full_sync(self) -> dict:
+        """Полная синхронизация контактов и компаний (блокирующая, вызывать в потоке)"""
+        self.syncing = True
+        try:
+            started = time.time()
+            companies = self._sync_entity("crm.company.list", COMPANY_SELECT, self.upsert_companies)
+            contacts = self._sync_entity("crm.contact.list", CONTACT_SELECT, self.upsert_contacts)
+            with self.lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_full_sync', ?)", (str(time.time()),)
+                )
+                self.db.execute("DELETE FROM meta WHERE key LIKE 'sync_cursor:%'")
+                self.db.commit()
+            logger.info("Зеркало CRM синхронизировано: %d компаний, %d контактов за %.1f с",
+                        companies, contacts, time.time() - started)
+            return {"companies": companies, "contacts": contacts}
+        finally:
+            self.syncing = False
+
+    def _fetch_by_ids(self, method: str, prefix: str, select: List[str], ids: List[int]) -> List[dict]:
+        rows = []
+        select_query = _select_query(select)
+        for start in range(0, len(ids), BATCH_SIZE):
+            commands = {
+                f"{prefix}_{start + i}": f"{method}?id={int(entity_id)}&{select_query}"
+                for i, entity_id in enumerate(ids[start:start + BATCH_SIZE])
+            }
+            rows.extend(execute_batch_request(commands, prefix).values())
+        return rows
+
+    def fetch_contacts(self, ids: List[int]) -> List[dict]:
+        """Загружает контакты из Битрикс24 и сохраняет их в зеркало"""
+        rows = self._fetch_by_ids("crm.contact.get", "contact", CONTACT_SELECT, ids)
+        self.upsert_contacts(rows)
+        return rows
+
+    def fetch_companies(self, ids: List[int]) -> List[dict]:
+        """Загружает компании из Битрикс24 и сохраняет их в зеркало"""
+        rows = self._fetch_by_ids("crm.company.get", "company", COMPANY_SELECT, ids)
+        self.upsert_companies(rows)
+        return rows
+
+
+def _event_ids(events: List[dict]) -> List[int]:
+    ids = []
+    for data in events:
+        entity_id = data.get('data', {}).get('FIELDS', {}).get('ID')
+        if entity_id:
+            ids.append(int(entity_id))
+    return list(dict.fromkeys(ids))
+
+
+# Глобальный экземпляр зеркала (None, если зеркало выключено)
+crm_mirror = CrmMirror() if MIRROR_ENABLED else None
+
+
+async def apply_contact_events(events: List[dict]):
+    """Обновляет контакты в зеркале по событиям ONCRMCONTACTADD/ONCRMCONTACTUPDATE"""
+    await asyncio.to_thread(crm_mirror.fetch_contacts, _event_ids(events))
+
+
+async def apply_company_events(events: List[dict]):
+    """Обновляет компании в зеркале по событиям ONCRMCOMPANYADD/ONCRMCOMPANYUPDATE"""
+    await asyncio.to_thread(crm_mirror.fetch_companies, _event_ids(events))
+
+
+async def apply_contact_delete_events(events: List[dict]):
+    await asyncio.to_thread(crm_mirror.delete_contacts, _event_ids(events))
+
+
+async def apply_company_delete_events(events: List[dict]):
+    await asyncio.to_thread(crm_mirror.delete_companies, _event_ids(events))
+
+
+def create_mirror_routes(app: FastAPI):
+    """Создает маршруты зеркала CRM и подписывает его на webhook события"""
+    if crm_mirror is None:
+        return
+
+    for event_type in ('ONCRMCONTACTADD', 'ONCRMCONTACTUPDATE'):
+        webhook_queue.register_handler(event_type, apply_contact_events)
+    for event_type in ('ONCRMCOMPANYADD', 'ONCRMCOMPANYUPDATE'):
+        webhook_queue.register_handler(event_type, apply_company_events)
+    webhook_queue.register_handler('ONCRMCONTACTDELETE', apply_contact_delete_events)
+    webhook_queue.register_handler('ONCRMCOMPANYDELETE', apply_company_delete_events)
+
+    async def run_full_sync():
+        try:
+            await asyncio.to_thread(crm_mirror.full_sync)
+        except Exception as e:
+            logger.exception("Ошибка синхронизации зеркала CRM: %s", e)
+        finally:
+            crm_mirror.syncing = False
+
+    def start_full_sync() -> bool:
+        """Занимает синхронизацию в event loop до запуска задачи, чтобы два запроса не запустили ее дважды"""
+        if crm_mirror.syncing:
+            return False
+        crm_mirror.syncing = True
+        asyncio.create_task(run_full_sync())
+        return True
+
+    @app.on_event("startup")
+    async def initial_mirror_sync():
+        """Первичная выгрузка портала, если она еще не завершалась (или прервалась)"""
+        if await asyncio.to_thread(crm_mirror.needs_full_sync):
+            start_full_sync()
+
+    @app.get("/api/mirror/status")
+    async def mirror_status():
+        """Состояние локального зеркала CRM"""
+        return await asyncio.to_thread(crm_mirror.get_status)
+
+    @app.post("/api/mirror/sync")
+    async def mirror_sync():
+        """Запускает полную синхронизацию зеркала в фоне"""
+        if not start_full_sync():
+            raise HTTPException(status_code=409, detail="Синхронизация уже выполняется")
+        return {"status": "started"}
+
+    @app.get("/api/mirror/companies")
+    async def mirror_companies(limit: int = 100, offset: int = 0):
+        """Компании с контактами из локального зеркала"""
+        companies, contacts = await asyncio.to_thread(crm_mirror.list_companies_with_contacts, min(limit, 1000), offset)
+        return build_company_records(companies, contacts)
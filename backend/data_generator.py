@@ -1,44 +1,99 @@
 import random
-import requests
-from faker import Faker
+import logging
+import threading
+from batch_compiler import Operation, compile_commands, execute_operations
+from batch_runner import BatchResult
 from bitrix_api import bx_batch_import, bx_call
-from config import WEBHOOK_URL
+from dedup_index import dedup_index
+from log_config import SAMPLED
+from tracing import tracer
 
-fake = Faker("ru_RU")
+logger = logging.getLogger(__name__)
 
-def create_companies_batch_import(count):
-    """Создает компании через batch import (до 20 за раз)"""
-    data = []
-    for i in range(count):
-        item = {
-            "TITLE": fake.company(),
-            "PHONE": [{"VALUE": fake.phone_number(), "VALUE_TYPE": "WORK"}],
-            "EMAIL": [{"VALUE": fake.company_email(), "VALUE_TYPE": "WORK"}]
-        }
-        data.append(item)
-    
-    result = bx_batch_import(4, data)  # 4 = Company entity type
+_fake = None
+_fake_lock = threading.Lock()
+
+def get_fake():
+    """Faker с локалью ru_RU создается при первом синтезе (или в фоновом прогреве при старте)"""
+    global _fake
+    if _fake is None:
+        with _fake_lock:
+            if _fake is None:
+                from faker import Faker  # Импорт Faker и загрузка локали - самая долгая часть импорта модуля
+                _fake = Faker("ru_RU")
+    return _fake
+
+def build_companies_payload(count):
+    """Генерирует данные компаний для crm.item.batchImport"""
+    with tracer.span("synthesize", entity="company", count=count):
+        fake = get_fake()
+        data = []
+        for i in range(count):
+            item = {
+                "TITLE": fake.company(),
+                "PHONE": [{"VALUE": fake.phone_number(), "VALUE_TYPE": "WORK"}],
+                "EMAIL": [{"VALUE": fake.company_email(), "VALUE_TYPE": "WORK"}]
+            }
+            data.append(item)
+        return data
+
+def build_contacts_payload(count):
+    """Генерирует данные контактов для crm.item.batchImport"""
+    with tracer.span("synthesize", entity="contact", count=count):
+        fake = get_fake()
+        data = []
+        for i in range(count):
+            item = {
+                "NAME": fake.first_name(),
+                "LAST_NAME": fake.last_name(),
+                "PHONE": [{"VALUE": fake.phone_number(), "VALUE_TYPE": "WORK"}],
+                "EMAIL": [{"VALUE": fake.company_email(), "VALUE_TYPE": "WORK"}],
+                "POST": fake.job()
+            }
+            data.append(item)
+        return data
+
+def import_records(entity_type, data):
+    """Отправляет batch import и возвращает пары (ID, отправленные поля) созданных записей"""
+    result = bx_batch_import(entity_type, data)
     if result and "items" in result:
-        return [item["item"]["id"] for item in result["items"] if "item" in item and "id" in item["item"]]
+        # Элементы ответа идут в том же порядке, что и отправленные
+        return [
+            (item["item"]["id"], fields) for fields, item in zip(data, result["items"])
+            if "item" in item and "id" in item["item"]
+        ]
     return []
 
+def create_companies_records(count):
+    """Создает компании и возвращает пары (ID, поля компании)"""
+    return import_records(4, build_companies_payload(count))  # 4 = Company entity type
+
+def create_contacts_records(count):
+    """
+    Создает контакты и возвращает пары (ID, поля контакта). Дубли не отправляются и
+    учитываются в BatchResult.skipped, чтобы не считаться ошибками портала.
+    """
+    data = build_contacts_payload(count)
+    if not dedup_index.enabled:
+        return import_records(3, data)  # 3 = Contact entity type
+    # Контакты, совпадающие по телефону или email с уже существующими, не создаются
+    unique = dedup_index.unique(data)
+    skipped = len(data) - len(unique)
+    if skipped:
+        logger.info("Пропущено дублей контактов: %d", skipped, extra=SAMPLED)
+    if not unique:
+        return BatchResult(skipped=skipped)
+    records = import_records(3, unique)
+    dedup_index.add_many(records)
+    return BatchResult(records, skipped=skipped)
+
+def create_companies_batch_import(count):
+    """Создает компании через batch import (размер пачки задает вызывающий код)"""
+    return [company_id for company_id, _ in create_companies_records(count)]
+
 def create_contacts_batch_import(count):
-    """Создает контакты через batch import (до 20 за раз)"""
-    data = []
-    for i in range(count):
-        item = {
-            "NAME": fake.first_name(),
-            "LAST_NAME": fake.last_name(),
-            "PHONE": [{"VALUE": fake.phone_number(), "VALUE_TYPE": "WORK"}],
-            "EMAIL": [{"VALUE": fake.company_email(), "VALUE_TYPE": "WORK"}],
-            "POST": fake.job()
-        }
-        data.append(item)
-    
-    result = bx_batch_import(3, data)  # 3 = Contact entity type
-    if result and "items" in result:
-        return [item["item"]["id"] for item in result["items"] if "item" in item and "id" in item["item"]]
-    return []
+    """Создает контакты через batch import (размер пачки задает вызывающий код)"""
+    return [contact_id for contact_id, _ in create_contacts_records(count)]
 
 def create_one_to_one_links(contact_ids, company_ids):
     """
@@ -58,34 +113,30 @@ def create_one_to_one_links(contact_ids, company_ids):
     
     return links
 
+def build_link_operations(contact_company_pairs):
+    """Операции crm.contact.update для пар (контакт, компания), ключи update_{индекс}"""
+    return [
+        Operation(f"update_{i}", "crm.contact.update", {
+            "id": int(contact_id),
+            "fields": {"COMPANY_ID": int(company_id)},
+            "params": {"REGISTER_SONET_EVENT": "N"}
+        })
+        for i, (contact_id, company_id) in enumerate(contact_company_pairs)
+    ]
+
+def build_link_commands(contact_company_pairs):
+    """Команды batch запроса crm.contact.update для пар (контакт, компания), ключи update_{индекс}"""
+    return compile_commands(build_link_operations(contact_company_pairs))
+
 def update_contacts_company_batch(contact_company_pairs):
     """
     Привязывает контакты к компаниям (1 контакт → 1 компания) через batch API.
     Использует crm.contact.update, обновляя поле COMPANY_ID.
+    Возвращает ключи успешных операций.
     """
-    commands = {}
-    for i, (contact_id, company_id) in enumerate(contact_company_pairs):
-        commands[f"update_{i}"] = f"crm.contact.update?id={int(contact_id)}&fields[COMPANY_ID]={int(company_id)}&params[REGISTER_SONET_EVENT]=N"
-
-    url = f"{WEBHOOK_URL}batch.json"
-    try:
-        payload = {"halt": 0, "cmd": commands}
-        resp = requests.post(url, json=payload, timeout=60)
-
-        if resp.status_code != 200:
-            print(f"Batch update HTTP Error {resp.status_code}: {resp.text}")
-            return []
-
-        response_data = resp.json()
-
-        if "error" in response_data:
-            print(f"Batch update Error: {response_data['error']}")
-            return []
-
-        results = response_data.get("result", {}).get("result", {})
-        successful = [k for k, v in results.items() if v is True]
+    operations = build_link_operations(contact_company_pairs)
+    with tracer.span("bx_batch_update", **{"batch.size": len(operations)}) as span:
+        results, errors = execute_operations(operations)
+        successful = [key for key, value in results.items() if value is True]
+        span.set_attribute("batch.failures", len(operations) - len(successful))
         return successful
-
-    except Exception as e:
-        print(f"Error calling batch update: {e}")
-        return []
@@ -0,0 +1,325 @@
+"""
+Индекс дублей контактов по телефону и email.
+
+Телефоны приводятся к E.164 (+79123456789), email - к нижнему регистру. Каждый ключ
+хранится 64-битным хешем в отсортированном array('q') рядом с ID контакта - 16 байт
+на ключ, поэтому миллионы ключей занимают десятки мегабайт, а поиск - двоичный.
+Новые ключи сначала попадают в небольшой словарь и вливаются в массивы в фоне: сортируются
+только новые ключи, а массивы копируются срезами между позициями вставки, поэтому при
+слиянии временно нужны вторые массивы, а не список перестановки всех ключей.
+Индекс заполняется из зеркала CRM или из выгрузки crm_export и проверяется перед
+crm.item.batchImport: совпавшие строки пропускаются или дописываются в найденный контакт.
+Случайное совпадение 64-битных хешей при миллионах ключей практически исключено.
+"""
+
+import os
+import re
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException
+
+from config import DEDUP_MODE, DEDUP_DEFAULT_COUNTRY
+from crm_export import job_directory
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "skip", "merge")
+MIN_RECENT_LIMIT = 50000  # Сколько новых ключей копится в словаре до слияния с массивами
+LOAD_CHUNK_KEYS = 500000  # Ключей, сортируемых за раз при загрузке индекса
+
+
+def normalize_phone(value, default_country: str = DEDUP_DEFAULT_COUNTRY) -> Optional[str]:
+    """Приводит номер к E.164: '8 (912) 345-67-89' -> '+79123456789'; None, если это не номер"""
+    text = str(value).strip()
+    digits = re.sub(r"\D", "", text)
+    if text.startswith("00"):
+        digits = digits[2:]
+    elif not text.startswith("+"):
+        if default_country == "7" and len(digits) == 11 and digits[0] == "8":
+            digits = "7" + digits[1:]
+        elif len(digits) == 10:
+            digits = default_country + digits
+    if not 8 <= len(digits) <= 15:
+        return None
+    return "+" + digits
+
+
+def normalize_email(value) -> Optional[str]:
+    email = str(value).strip().lower()
+    return email if "@" in email else None
+
+
+def _values(multifield) -> Iterator[str]:
+    """Значения мультиполя PHONE/EMAIL: список {"VALUE": ...}, JSON строка (Parquet) или строка"""
+    if isinstance(multifield, str):
+        try:
+            multifield = json.loads(multifield)
+        except ValueError:
+            yield multifield
+            return
+    for item in multifield or []:
+        value = item.get("VALUE") if isinstance(item, dict) else item
+        if value:
+            yield value
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def merge_sorted(hashes: array, ids: array, pairs: List[Tuple[int, int]]) -> Tuple[array, array]:
+    """
+    Вливает отсортированные пары (хеш, ID) с разными хешами в отсортированные массивы за один проход:
+    позиция вставки ищется двоичным поиском, участки между позициями копируются срезами.
+    Хеши, которые уже есть в массивах, пропускаются - остается прежний ID.
+    """
+    merged_hashes = array("q")
+    merged_ids = array("q")
+    start = 0
+    for key, contact_id in pairs:
+        position = bisect_left(hashes, key, start)
+        if position < len(hashes) and hashes[position] == key:
+            continue
+        merged_hashes.extend(hashes[start:position])
+        merged_ids.extend(ids[start:position])
+        merged_hashes.append(key)
+        merged_ids.append(contact_id)
+        start = position
+    merged_hashes.extend(hashes[start:])
+    merged_ids.extend(ids[start:])
+    return merged_hashes, merged_ids
+
+
+class DedupIndex:
+    """Хеши нормализованных телефонов и email контактов с ID найденного контакта"""
+
+    def __init__(self, mode: str = DEDUP_MODE, default_country: str = DEDUP_DEFAULT_COUNTRY):
+        if mode not in MODES:
+            raise ValueError(f"DEDUP_MODE должен быть одним из {MODES}")
+        self.mode = mode
+        self.default_country = default_country
+        self.lock = threading.Lock()
+        self._hashes = array("q")  # отсортированы, ID контакта в _ids под тем же индексом
+        self._ids = array("q")
+        self._recent: Dict[int, int] = {}
+        self._merging: Dict[int, int] = {}  # ключи, которые сейчас вливаются в массивы
+        self._compacting = False
+        self._loading = False  # Во время загрузки новые ключи копятся в словаре без слияния
+        self._compaction_task = None
+        self.source = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def key_hashes(self, fields: dict) -> List[int]:
+        """Хеши ключей контакта (поля в формате batchImport или строка crm.contact.get)"""
+        keys = []
+        for value in _values(fields.get("PHONE")):
+            phone = normalize_phone(value, self.default_country)
+            if phone:
+                keys.append(_hash("p:" + phone))
+        for value in _values(fields.get("EMAIL")):
+            email = normalize_email(value)
+            if email:
+                keys.append(_hash("e:" + email))
+        return keys
+
+    def _find(self, key: int) -> Optional[int]:
+        contact_id = self._recent.get(key)
+        if contact_id is None:
+            contact_id = self._merging.get(key)
+        if contact_id is not None:
+            return contact_id
+        position = bisect_left(self._hashes, key)
+        if position < len(self._hashes) and self._hashes[position] == key:
+            return self._ids[position]
+        return None
+
+    def find_hashes(self, keys: Iterable[int]) -> Optional[int]:
+        """ID контакта, у которого совпадает хотя бы один ключ"""
+        with self.lock:
+            for key in keys:
+                contact_id = self._find(key)
+                if contact_id is not None:
+                    return contact_id
+        return None
+
+    def find(self, fields: dict) -> Optional[int]:
+        return self.find_hashes(self.key_hashes(fields))
+
+    def add(self, contact_id: int, fields: dict):
+        keys = self.key_hashes(fields)
+        with self.lock:
+            for key in keys:
+                if self._find(key) is None:
+                    self._recent[key] = int(contact_id)
+            due = not self._compacting and not self._loading and len(self._recent) > max(MIN_RECENT_LIMIT, len(self._hashes) // 8)
+            if due:
+                self._compacting = True
+        if due:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # Вызов из рабочего потока (батч в asyncio.to_thread) - event loop слияние не задерживает
+                self._compact()
+            else:
+                self._compaction_task = loop.create_task(asyncio.to_thread(self._compact))
+
+    def add_many(self, records: Iterable[Tuple[int, dict]]):
+        """Добавляет созданные контакты: пары (ID, поля)"""
+        for contact_id, fields in records:
+            self.add(contact_id, fields)
+
+    def unique(self, rows: List[dict]) -> List[dict]:
+        """Строки без дублей: ни с индексом, ни друг с другом"""
+        seen = set()
+        result = []
+        for row in rows:
+            keys = self.key_hashes(row)
+            if self.find_hashes(keys) is not None or any(key in seen for key in keys):
+                continue
+            seen.update(keys)
+            result.append(row)
+        return result
+
+    def _compact(self):
+        """Вливает накопленные ключи в массивы; поиск и добавление на время слияния не блокируются"""
+        with self.lock:
+            hashes, ids = self._hashes, self._ids
+            pending, self._merging, self._recent = self._recent, self._recent, {}
+        merged = None
+        try:
+            merged = merge_sorted(hashes, ids, sorted(pending.items()))
+        finally:
+            with self.lock:
+                if merged is None:
+                    # Слияние не удалось - ключи остаются в словаре до следующей попытки
+                    self._recent = {**pending, **self._recent}
+                elif self._hashes is hashes:  # индекс не перезагружали во время слияния
+                    self._hashes, self._ids = merged
+                self._merging = {}
+                self._compacting = False
+
+    def load(self, rows: Iterable[dict], source: str) -> int:
+        """
+        Заменяет содержимое индекса контактами из строк crm.contact.get/list (блокирующая).
+        Ключи, добавленные через add() во время загрузки, вливаются в загруженные массивы.
+        """
+        with self.lock:
+            self._loading = True
+        try:
+            hashes = array("q")
+            ids = array("q")
+            chunk: Dict[int, int] = {}
+            contacts = 0
+            for row in rows:
+                contact_id = int(row["ID"])
+                for key in self.key_hashes(row):
+                    chunk.setdefault(key, contact_id)  # при совпадении ключей остается первый контакт
+                contacts += 1
+                if len(chunk) >= LOAD_CHUNK_KEYS:
+                    hashes, ids = merge_sorted(hashes, ids, sorted(chunk.items()))
+                    chunk = {}
+            hashes, ids = merge_sorted(hashes, ids, sorted(chunk.items()))
+
+            with self.lock:
+                live = {**self._merging, **self._recent}
+            hashes, ids = merge_sorted(hashes, ids, sorted(live.items()))
+            with self.lock:
+                # Ключи, добавленные во время последнего слияния, остаются в словаре
+                added = {key: contact_id for key, contact_id in {**self._merging, **self._recent}.items()
+                         if key not in live}
+                self._hashes, self._ids, self._recent = hashes, ids, added
+                self.source = source
+        finally:
+            with self.lock:
+                self._loading = False
+        logger.info("Индекс дублей загружен из %s: %d контактов, %d ключей", source, contacts, len(hashes))
+        return contacts
+
+    def load_from_mirror(self, mirror) -> int:
+        return self.load(mirror.iter_contacts(), "mirror")
+
+    def load_from_export(self, job_id: str) -> int:
+        """Загружает контакты из выгрузки crm_export (contacts.jsonl или части contacts-*.parquet)"""
+        directory = job_directory(job_id)
+        jsonl_path = os.path.join(directory, "contacts.jsonl")
+        if os.path.exists(jsonl_path):
+            def rows():
+                with open(jsonl_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            yield json.loads(line)
+            return self.load(rows(), f"export:{job_id}")
+
+        parts = sorted(name for name in os.listdir(directory) if name.startswith("contacts-")
+                       and name.endswith(".parquet")) if os.path.isdir(directory) else []
+        if not parts:
+            raise ValueError(f"В выгрузке {job_id} нет контактов")
+        import pyarrow.parquet as pq  # Parquet пишется только при установленном pyarrow
+
+        def rows():
+            for name in parts:
+                table = pq.read_table(os.path.join(directory, name), columns=["ID", "PHONE", "EMAIL"])
+                yield from table.to_pylist()
+        return self.load(rows(), f"export:{job_id}")
+
+    def get_status(self) -> dict:
+        with self.lock:
+            keys = len(self._hashes) + len(self._recent) + len(self._merging)
+            storage = self._hashes.itemsize * len(self._hashes) + self._ids.itemsize * len(self._ids)
+        return {"mode": self.mode, "source": self.source, "keys": keys, "storage_bytes": storage}
+
+
+# Глобальный индекс дублей
+dedup_index = DedupIndex()
+
+
+def create_dedup_routes(app: FastAPI, mirror=None):
+    """Создает маршруты индекса дублей; при включенном поиске дублей загружает индекс из зеркала"""
+    if not dedup_index.enabled:
+        return
+
+    async def load_from_mirror():
+        try:
+            await asyncio.to_thread(dedup_index.load_from_mirror, mirror)
+        except Exception as e:
+            logger.exception("Ошибка загрузки индекса дублей: %s", e)
+
+    @app.on_event("startup")
+    async def initial_dedup_load():
+        if mirror is not None:
+            asyncio.create_task(load_from_mirror())
+
+    @app.get("/api/dedup/status")
+    async def dedup_status():
+        """Размер и источник индекса дублей"""
+        return dedup_index.get_status()
+
+    @app.post("/api/dedup/load")
+    async def dedup_load(source: str = "mirror", job_id: Optional[str] = None):
+        """Перезагружает индекс из зеркала CRM (source=mirror) или выгрузки (source=export&job_id=...)"""
+        if source == "mirror":
+            if mirror is None:
+                raise HTTPException(status_code=400, detail="Зеркало CRM выключено")
+            contacts = await asyncio.to_thread(dedup_index.load_from_mirror, mirror)
+        elif source == "export" and job_id:
+            try:
+                job_directory(job_id)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            try:
+                contacts = await asyncio.to_thread(dedup_index.load_from_export, job_id)
+            except ValueError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+        else:
+            raise HTTPException(status_code=400, detail="source=mirror или source=export&job_id=...")
+        return {"contacts": contacts, **dedup_index.get_status()}
@@ -0,0 +1,93 @@
+"""
+Сборка результата генерации без повторной загрузки.
+
+Поля, отправленные в crm.item.batchImport, сохраняются вместе с выданными ID, привязки
+применяются локально, и результат собирается тем же build_company_records. Вместо полной
+загрузки созданных записей читается небольшая случайная выборка, которая сравнивается
+с локальными данными.
+"""
+
+import random
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bitrix_api import execute_batch_request
+from crm_mirror import CONTACT_SELECT, COMPANY_SELECT
+from result_builder import build_company_records, build_contact_record, _first_value
+
+logger = logging.getLogger(__name__)
+
+# Одна проверка - один batch вызов: до 25 компаний и 25 контактов
+MAX_VERIFY_SAMPLE = 25
+COMPANY_FIELDS = ("TITLE", "PHONE", "EMAIL")
+
+
+def _select_query(select: List[str]) -> str:
+    return "&".join(f"select[{i}]={field}" for i, field in enumerate(select))
+
+
+def _company_record(row: dict) -> dict:
+    return {
+        "title": row.get("TITLE") or "",
+        "phone": _first_value(row.get("PHONE")),
+        "email": _first_value(row.get("EMAIL"))
+    }
+
+
+class LocalResultSet:
+    """Созданные записи в виде строк crm.*.get, собранные из отправленных полей и выданных ID"""
+
+    def __init__(self):
+        self.companies: Dict[str, dict] = {}
+        self.contacts: Dict[str, dict] = {}
+
+    def add_companies(self, records: Iterable[Tuple[int, dict]]):
+        for company_id, fields in records:
+            self.companies[str(company_id)] = {"ID": str(company_id), **{f: fields.get(f) for f in COMPANY_FIELDS}}
+
+    def add_contacts(self, records: Iterable[Tuple[int, dict]]):
+        for contact_id, fields in records:
+            self.contacts[str(contact_id)] = {"ID": str(contact_id), "COMPANY_ID": None, **fields}
+
+    def link(self, pairs: Iterable[Tuple[int, Optional[int]]]):
+        """Применяет успешные привязки (contact_id, company_id); company_id None - контакт без компании"""
+        for contact_id, company_id in pairs:
+            contact = self.contacts.get(str(contact_id))
+            if contact is not None:
+                contact["COMPANY_ID"] = None if company_id is None else str(company_id)
+
+    def build(self) -> list:
+        return build_company_records(self.companies, self.contacts)
+
+    def verify(self, sample_size: int) -> dict:
+        """Загружает случайную выборку созданных записей и сравнивает ее с локальными данными"""
+        sample_size = min(sample_size, MAX_VERIFY_SAMPLE)
+        company_ids = random.sample(list(self.companies), min(sample_size, len(self.companies)))
+        contact_ids = random.sample(list(self.contacts), min(sample_size, len(self.contacts)))
+        if not company_ids and not contact_ids:
+            return {"checked": 0, "mismatches": []}
+
+        commands = {
+            f"company_{company_id}": f"crm.company.get?id={company_id}&{_select_query(COMPANY_SELECT)}"
+            for company_id in company_ids
+        }
+        commands.update({
+            f"contact_{contact_id}": f"crm.contact.get?id={contact_id}&{_select_query(CONTACT_SELECT)}"
+            for contact_id in contact_ids
+        })
+        remote = execute_batch_request(commands, "выборка для проверки")
+
+        mismatches = []
+        for company_id in company_ids:
+            row = remote.get(f"company_{company_id}")
+            if row is None or _company_record(row) != _company_record(self.companies[company_id]):
+                mismatches.append({"company": int(company_id)})
+        for contact_id in contact_ids:
+            row = remote.get(f"contact_{contact_id}")
+            if row is None or build_contact_record(row) != build_contact_record(self.contacts[contact_id]):
+                mismatches.append({"contact": int(contact_id)})
+
+        result = {"checked": len(commands), "mismatches": mismatches}
+        if mismatches:
+            logger.warning("Проверка выборки: %d из %d записей не совпали с отправленными", len(mismatches), len(commands))
+        return result
@@ -0,0 +1,174 @@
+"""
+Настройка логирования backend.
+
+Модули пишут в стандартные логгеры (logging.getLogger(__name__)). Обработчик на корневом
+логгере только формирует сообщение и кладет запись в ограниченную очередь - вывод в stdout
+выполняет фоновый поток QueueListener, поэтому медленный терминал не блокирует event loop.
+Частые сообщения о батчах помечаются extra=SAMPLED и пишутся с выборкой (каждое N-е).
+Перед выводом из текста удаляются токены вебхука и OAuth.
+"""
+
+import re
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from config import (
+    LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_BATCH_SAMPLE_EVERY, LOG_QUEUE_SIZE,
+    WEBHOOK_URL, BITRIX24_CLIENT_SECRET
+)
+from tracing import current_span
+
+# extra для частых сообщений, которые пишутся с выборкой
+SAMPLED = {"sample": True}
+
+_SECRETS = [secret for secret in (WEBHOOK_URL, BITRIX24_CLIENT_SECRET) if secret]
+_SECRET_PATTERNS = [
+    # Токен в URL REST API: вебхук /rest/1/<токен>/ и вызовы с access_token в пути
+    (re.compile(r"(/rest/\d+/)[^/\s'\"]+"), r"\1***"),
+    # Параметры и поля JSON с токенами, в том числе auth[access_token]=...
+    (re.compile(r"((?:access_token|refresh_token|client_secret|application_token|auth_id|refresh_id)"
+                r"\]?['\"]?\s*[:=]\s*['\"]?)[^'\"&\s,}]+", re.IGNORECASE), r"\1***"),
+]
+
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+
+def redact(text: str) -> str:
+    """Скрывает URL вебхука, секрет приложения и OAuth токены в тексте"""
+    for secret in _SECRETS:
+        if secret in text:
+            text = text.replace(secret, "***")
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class BatchSampler(logging.Filter):
+    """Пропускает каждое N-е сообщение с extra=SAMPLED (предупреждения и ошибки - всегда)"""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self.counters = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sample", False) or record.levelno >= logging.WARNING:
+            return True
+        # Счетчик по шаблону сообщения: аргументы в него не входят
+        key = (record.name, record.msg)
+        count = self.counters.get(key, 0)
+        self.counters[key] = count + 1
+        record.sample_every = self.every
+        return count % self.every == 0
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Кладет запись в очередь без блокировки; если очередь переполнена, запись отбрасывается"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Сообщение собирается здесь, пока аргументы не изменились; форматирование - в фоновом потоке
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        span = current_span()
+        if span is not None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s", "%H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON строка на запись: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage())
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key != "sample":
+                data[key] = value
+        if record.exc_text:
+            data["exception"] = redact(record.exc_text)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _parse_levels(levels: str) -> dict:
+    """Разбирает LOG_LEVELS вида 'bitrix_api=DEBUG,main=WARNING'"""
+    result = {}
+    for item in levels.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            result[name.strip()] = level.strip().upper()
+    return result
+
+
+_handler = None
+_listener = None
+
+
+def setup_logging():
+    """Подключает фоновую запись логов к корневому логгеру (повторный вызов ничего не делает)"""
+    global _handler, _listener
+    if _listener is not None:
+        return
+
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)  # Повторный запуск после stop_logging
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler = BackgroundQueueHandler(log_queue)
+    _handler.addFilter(BatchSampler(LOG_BATCH_SAMPLE_EVERY))
+    _listener = QueueListener(log_queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in _parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает фоновый поток"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    if _handler.dropped:
+        sys.stdout.write(f"Логирование: отброшено {_handler.dropped} записей из-за переполнения очереди\n")
@@ -0,0 +1,158 @@
+import sys
+import logging
+import time
+import asyncio
+import threading
+import traceback
+from collections import Counter, deque
+from typing import Optional
+
+from config import (
+    LOOP_MONITOR_INTERVAL, LOOP_STALL_THRESHOLD_MS, LOOP_STALL_SAMPLE_INTERVAL_MS,
+    LOOP_STALL_PROFILE, LOOP_STALL_HISTORY
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LoopStallMonitor:
+    """
+    Монитор задержек event loop.
+    Корутина-пульс раз в interval секунд отмечает, что loop жив, и измеряет задержку
+    планирования. Фоновый поток следит за пульсом: если loop не отвечает дольше порога,
+    поток снимает стек потока loop (и, если включено, делает выборку стеков на протяжении
+    всей остановки), а также запоминает сессию и фазу генерации выполняющейся задачи.
+    """
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold_ms: float = LOOP_STALL_THRESHOLD_MS,
+                 sample_interval_ms: float = LOOP_STALL_SAMPLE_INTERVAL_MS, profile: bool = LOOP_STALL_PROFILE,
+                 history: int = LOOP_STALL_HISTORY):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.sample_interval = sample_interval_ms / 1000
+        self.profile = profile
+        self.stalls = deque(maxlen=history)
+
+        self.loop = None
+        self.loop_thread_id = None
+        self.heartbeat_task = None
+        self.watchdog = None
+        self.running = False
+        self.last_beat = time.monotonic()
+
+        self.lock = threading.Lock()
+        self.task_tags = {}  # задача -> {'session_id': ..., 'phase': ...}
+
+        self.lag_stats = {'samples': 0, 'last_ms': 0.0, 'max_ms': 0.0, 'avg_ms': 0.0}
+
+    def start(self):
+        """Запускает мониторинг (вызывать из работающего event loop)"""
+        if self.running:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.running = True
+        self.last_beat = time.monotonic()
+        self.heartbeat_task = asyncio.create_task(self._heartbeat())
+        self.watchdog = threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True)
+        self.watchdog.start()
+
+    async def stop(self):
+        self.running = False
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            await asyncio.gather(self.heartbeat_task, return_exceptions=True)
+
+    def set_phase(self, session_id: str, phase: str):
+        """Помечает текущую задачу сессией и фазой генерации - они попадут в отчет об остановке"""
+        task = asyncio.current_task()
+        if task is None:
+            return
+        with self.lock:
+            if task not in self.task_tags:
+                task.add_done_callback(self._forget_task)
+            self.task_tags[task] = {'session_id': session_id, 'phase': phase}
+
+    def _forget_task(self, task):
+        with self.lock:
+            self.task_tags.pop(task, None)
+
+    async def _heartbeat(self):
+        while True:
+            started = self.loop.time()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (self.loop.time() - started - self.interval) * 1000)
+            self.last_beat = time.monotonic()
+
+            stats = self.lag_stats
+            stats['samples'] += 1
+            stats['last_ms'] = round(lag_ms, 2)
+            stats['max_ms'] = round(max(stats['max_ms'], lag_ms), 2)
+            stats['avg_ms'] = round(stats['avg_ms'] + (lag_ms - stats['avg_ms']) / stats['samples'], 3)
+
+    def _loop_stack(self):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return []
+        return traceback.extract_stack(frame)
+
+    def _current_tags(self) -> Optional[dict]:
+        # current_task(loop) - просто чтение словаря, безопасно из другого потока
+        task = asyncio.current_task(self.loop)
+        with self.lock:
+            tags = self.task_tags.get(task)
+        result = dict(tags) if tags else {}
+        if task is not None:
+            result['task'] = task.get_name()
+        return result
+
+    def _watch(self):
+        while self.running:
+            time.sleep(self.sample_interval)
+            beat = self.last_beat
+            stalled_for = time.monotonic() - beat - self.interval
+            if stalled_for < self.threshold:
+                continue
+
+            # Loop не отвечает: снимаем стек и, пока остановка длится, собираем выборку
+            stack = self._loop_stack()
+            tags = self._current_tags()
+            samples = Counter()
+            while self.running and self.last_beat == beat:
+                if self.profile:
+                    frames = self._loop_stack()
+                    if frames:
+                        leaf = frames[-1]
+                        samples[f"{leaf.filename}:{leaf.lineno} {leaf.name}"] += 1
+                time.sleep(self.sample_interval)
+
+            self._record_stall(time.monotonic() - beat - self.interval, stack, tags, samples)
+
+    def _record_stall(self, duration: float, stack, tags: dict, samples: Counter):
+        stall = {
+            'time': time.time(),
+            'duration_ms': round(duration * 1000, 1),
+            'session_id': tags.get('session_id'),
+            'phase': tags.get('phase'),
+            'task': tags.get('task'),
+            'stack': traceback.format_list(stack[-15:]),
+            'samples': [{'frame': frame, 'count': count} for frame, count in samples.most_common(10)]
+        }
+        self.stalls.append(stall)
+
+        location = f"{stack[-1].filename}:{stack[-1].lineno} {stack[-1].name}" if stack else "?"
+        session = (stall['session_id'] or '-')[:8]
+        logger.warning("⚠️  Event loop заблокирован на %s мс (сессия %s, фаза %s): %s",
+                       stall['duration_ms'], session, stall['phase'] or '-', location)
+
+    def get_report(self) -> dict:
+        return {
+            'running': self.running,
+            'threshold_ms': self.threshold * 1000,
+            'lag': dict(self.lag_stats),
+            'stalls': list(self.stalls)
+        }
+
+
+# Глобальный экземпляр монитора
+loop_monitor = LoopStallMonitor()
@@ -1,23 +1,40 @@
 import os
 import json
+import time
+import logging
 import asyncio
 import random
-import requests
-import time
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
 from typing import List
-import uvicorn
 
-from config import PORT, HOST, DEBUG, ALLOWED_ORIGINS, NUM_CONTACTS, NUM_COMPANIES, WEBHOOK_URL
-from models import Company, CreateTestDataRequest
+from config import PORT, HOST, DEBUG, ALLOWED_ORIGINS, NUM_CONTACTS, NUM_COMPANIES, WEBHOOK_URL, WS_PER_MESSAGE_DEFLATE, WORKERS, SESSION_BACKEND, LOOP_MONITOR_ENABLED, READBACK_MODE, READBACK_VERIFY_SAMPLE, RECONCILE_LINKS, STREAMING_THRESHOLD, WARMUP_ON_STARTUP
+from models import CreateTestDataRequest
 from websocket_manager import ConnectionManager
-from data_generator import create_companies_batch_import, create_contacts_batch_import, update_contacts_company_batch, create_one_to_one_links
-from bitrix_api import bx_call
+from message_encoding import encode_complete_message, encode_stream_complete_message, negotiate_encoding
+from result_builder import build_company_records
+from data_generator import create_companies_records, create_contacts_records, update_contacts_company_batch, create_one_to_one_links, get_fake
+from bitrix_api import bx_call, execute_batch_request
+from batch_runner import BatchResult, run_batches, flatten, merge
+from batch_tuner import batch_tuning
+from capacity_planner import plan_generation
+from local_results import LocalResultSet
+from reconciliation import reconcile_links
+from streaming_generation import run_streaming_generation
+from bulk_import import create_import_routes
+from crm_export import create_export_routes
 from oauth_handler import create_oauth_routes
 from bitrix_app_handler import create_app_routes
+from session_status import status_board, create_status_routes
+from crm_mirror import crm_mirror, create_mirror_routes
+from dedup_index import create_dedup_routes
+from static_files import create_static_routes
+from loop_monitor import loop_monitor
+from tracing import tracer
+from log_config import setup_logging, redact
+
+setup_logging()
+logger = logging.getLogger("main")  # при запуске python main.py __name__ равен "__main__"
 
 app = FastAPI(title="Bitrix24 Contacts API")
 
@@ -35,151 +52,95 @@ manager = ConnectionManager()
 # Добавляем маршруты для OAuth и интеграции с Битрикс24
 create_oauth_routes(app)
 create_app_routes(app)
+create_mirror_routes(app)
+create_dedup_routes(app, crm_mirror)
+create_import_routes(app, manager)
+create_export_routes(app)
+create_status_routes(app, manager)
+
+def warm_up():
+    """Загружает отложенные зависимости, чтобы первая генерация не ждала импорта Faker и requests"""
+    started = time.perf_counter()
+    import requests  # noqa: F401
+    get_fake()
+    logger.info("Прогрев зависимостей завершен за %.0f мс", (time.perf_counter() - started) * 1000)
 
-def get_generated_data_batch(company_ids, contact_ids):
-    """Получает сгенерированные компании и контакты через batch API батчами по 20"""
+@app.on_event("startup")
+async def start_connection_manager():
+    """Подключает менеджер соединений к общему backend сессий"""
+    await manager.start()
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    if WARMUP_ON_STARTUP:
+        # Сервер уже принимает соединения, пока зависимости загружаются в потоке
+        asyncio.create_task(asyncio.to_thread(warm_up))
+
+@app.on_event("shutdown")
+async def stop_connection_manager():
+    await manager.stop()
+    await loop_monitor.stop()
+
+COMPANY_GET_SELECT = "select[0]=ID&select[1]=TITLE&select[2]=PHONE&select[3]=EMAIL"
+CONTACT_GET_SELECT = "select[0]=ID&select[1]=NAME&select[2]=LAST_NAME&select[3]=PHONE&select[4]=EMAIL&select[5]=POST&select[6]=COMPANY_ID"
+
+async def get_generated_data_batch(company_ids, contact_ids):
+    """Получает сгенерированные компании и контакты через batch API, размер батча подбирается автоматически.
+    Возвращает список словарей в формате Company.model_dump()"""
     try:
-        print(f"Загружаем {len(company_ids)} компаний и {len(contact_ids)} контактов через batch API...")
+        logger.info("Загружаем %d компаний и %d контактов через batch API...", len(company_ids), len(contact_ids))
         
-        batch_size = 20
         companies_data = {}
         contacts_data = {}
         
-        # Загружаем компании батчами
-        for batch_start in range(0, len(company_ids), batch_size):
-            batch_end = min(batch_start + batch_size, len(company_ids))
-            batch_company_ids = company_ids[batch_start:batch_end]
-            
-            company_commands = {}
-            for i, company_id in enumerate(batch_company_ids):
-                company_commands[f"company_{batch_start + i}"] = f"crm.company.get?id={company_id}&select[0]=ID&select[1]=TITLE&select[2]=PHONE&select[3]=EMAIL"
-            
-            batch_companies = execute_batch_request(company_commands, "компании")
-            companies_data.update(batch_companies)
-            
-            time.sleep(0.1)  # Небольшая пауза между батчами
-        
-        # Загружаем контакты батчами
-        for batch_start in range(0, len(contact_ids), batch_size):
-            batch_end = min(batch_start + batch_size, len(contact_ids))
-            batch_contact_ids = contact_ids[batch_start:batch_end]
-            
-            contact_commands = {}
-            for i, contact_id in enumerate(batch_contact_ids):
-                contact_commands[f"contact_{batch_start + i}"] = f"crm.contact.get?id={contact_id}&select[0]=ID&select[1]=NAME&select[2]=LAST_NAME&select[3]=PHONE&select[4]=EMAIL&select[5]=POST&select[6]=COMPANY_ID"
-            
-            batch_contacts = execute_batch_request(contact_commands, "контакты")
-            contacts_data.update(batch_contacts)
-            
-            time.sleep(0.1)  # Небольшая пауза между батчами
-        
-        print(f"Получено {len(companies_data)} компаний и {len(contacts_data)} контактов")
-        
-        # Создаем объекты компаний с контактами
-        companies = []
-        for key, company in companies_data.items():
-            company_id = company["ID"]
-            
-            # Находим контакты для этой компании
-            company_contacts = []
-            for contact_key, contact in contacts_data.items():
-                if contact.get("COMPANY_ID") == company_id:
-                    company_contacts.append({
-                        "id": contact.get("ID"),
-                        "name": contact.get("NAME", ""),
-                        "last_name": contact.get("LAST_NAME", ""),
-                        "phone": contact.get("PHONE", [{}])[0].get("VALUE") if contact.get("PHONE") else None,
-                        "email": contact.get("EMAIL", [{}])[0].get("VALUE") if contact.get("EMAIL") else None,
-                        "post": contact.get("POST"),
-                        "company_id": contact.get("COMPANY_ID")
-                    })
-            
-            company_obj = Company(
-                id=company["ID"],
-                title=company["TITLE"],
-                phone=company.get("PHONE", [{}])[0].get("VALUE") if company.get("PHONE") else None,
-                email=company.get("EMAIL", [{}])[0].get("VALUE") if company.get("EMAIL") else None,
-                contacts=company_contacts
-            )
-            companies.append(company_obj)
-        
-        print(f"Создано {len(companies)} объектов компаний с контактами")
+        # Сначала берем то, что уже есть в локальном зеркале CRM, из API загружаем только остальное
+        if crm_mirror is not None:
+            local_companies = await asyncio.to_thread(crm_mirror.get_companies, company_ids)
+            local_contacts = await asyncio.to_thread(crm_mirror.get_contacts, contact_ids)
+            companies_data.update({f"company_local_{cid}": row for cid, row in local_companies.items()})
+            contacts_data.update({f"contact_local_{cid}": row for cid, row in local_contacts.items()})
+            company_ids = [cid for cid in company_ids if int(cid) not in local_companies]
+            contact_ids = [cid for cid in contact_ids if int(cid) not in local_contacts]
+            logger.info("Из зеркала CRM: %d компаний и %d контактов", len(local_companies), len(local_contacts))
+        
+        def fetch_companies(batch):
+            return execute_batch_request({
+                f"company_{company_id}": f"crm.company.get?id={company_id}&{COMPANY_GET_SELECT}" for company_id in batch
+            }, "компании")
+        
+        def fetch_contacts(batch):
+            return execute_batch_request({
+                f"contact_{contact_id}": f"crm.contact.get?id={contact_id}&{CONTACT_GET_SELECT}" for contact_id in batch
+            }, "контакты")
+        
+        # Загруженные строки сразу сохраняем в зеркало (запись SQLite - в потоке, одна транзакция на батч)
+        async def on_companies(batch, rows):
+            await asyncio.to_thread(crm_mirror.upsert_companies, list(rows.values()))
+        
+        async def on_contacts(batch, rows):
+            await asyncio.to_thread(crm_mirror.upsert_contacts, list(rows.values()))
+        
+        if crm_mirror is None:
+            on_companies = on_contacts = None
+        
+        companies_data.update(merge(await run_batches(
+            company_ids, "company_get", fetch_companies, on_result=on_companies, pause=0.1, idempotent=True
+        )))
+        contacts_data.update(merge(await run_batches(
+            contact_ids, "contact_get", fetch_contacts, on_result=on_contacts, pause=0.1, idempotent=True
+        )))
+        
+        logger.info("Получено %d компаний и %d контактов", len(companies_data), len(contacts_data))
+        
+        # Собираем компании с контактами сразу в словари без Pydantic валидации каждой записи
+        companies = build_company_records(companies_data, contacts_data)
+        
+        logger.info("Создано %d объектов компаний с контактами", len(companies))
         return companies
         
     except Exception as e:
-        print(f"Ошибка batch загрузки данных: {e}")
+        logger.exception("Ошибка batch загрузки данных: %s", e)
         return []
 
-def execute_batch_request(commands, entity_type):
-    """Выполняет batch запрос и возвращает результаты"""
-    try:
-        url = f"{WEBHOOK_URL}batch.json"
-        payload = {"halt": 0, "cmd": commands}
-        
-        resp = requests.post(url, json=payload, timeout=60)
-        
-        if resp.status_code != 200:
-            print(f"Batch request HTTP Error {resp.status_code}: {resp.text}")
-            return {}
-            
-        response_data = resp.json()
-        
-        if "error" in response_data:
-            print(f"Batch request Error: {response_data['error']}")
-            return {}
-        
-        results = response_data.get("result", {}).get("result", {})
-        
-        # Обрабатываем результаты - value уже содержит данные напрямую
-        processed_data = {}
-        for key, value in results.items():
-            if value:
-                processed_data[key] = value
-        
-        print(f"Получено {len(processed_data)} {entity_type} из batch")
-        return processed_data
-        
-    except Exception as e:
-        print(f"Ошибка выполнения batch запроса для {entity_type}: {e}")
-        return {}
-
-# Обслуживание статических файлов фронтенда
-frontend_build_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend", "build")
-if os.path.exists(frontend_build_path):
-    app.mount("/static", StaticFiles(directory=os.path.join(frontend_build_path, "static")), name="static")
-    
-    @app.get("/")
-    async def serve_frontend():
-        """Обслуживание главной страницы React приложения"""
-        return FileResponse(os.path.join(frontend_build_path, "index.html"))
-    
-    @app.get("/favicon.ico")
-    async def favicon():
-        """Обслуживание favicon"""
-        favicon_path = os.path.join(frontend_build_path, "favicon.ico")
-        if os.path.exists(favicon_path):
-            return FileResponse(favicon_path)
-        return {"message": "No favicon"}
-    
-    # Обслуживание всех остальных маршрутов фронтенда
-    @app.get("/{full_path:path}")
-    async def serve_frontend_routes(full_path: str):
-        """Обслуживание всех маршрутов React приложения"""
-        # Проверяем, существует ли файл
-        file_path = os.path.join(frontend_build_path, full_path)
-        if os.path.exists(file_path) and os.path.isfile(file_path):
-            return FileResponse(file_path)
-        # Если файл не найден, возвращаем index.html для SPA
-        return FileResponse(os.path.join(frontend_build_path, "index.html"))
-else:
-    @app.get("/")
-    async def root():
-        return {"message": "Bitrix24 Contacts API", "frontend": "Not built yet. Run 'npm run build' in frontend directory"}
-    
-    @app.get("/favicon.ico")
-    async def favicon():
-        return {"message": "No favicon"}
-
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
@@ -191,13 +152,25 @@ async def websocket_endpoint(websocket: WebSocket):
                 # Ждем сообщение с таймаутом, чтобы не блокировать соединение
                 data = await asyncio.wait_for(websocket.receive_text(), timeout=1.0)
                 
+                if session_id:
+                    manager.touch(session_id)
+                
                 # Обработка ping/pong для поддержания соединения
                 if data == "ping":
                     await manager.send_personal_message("pong", websocket)
                 elif data.startswith("session_id:"):
                     # Получаем session_id от клиента
                     session_id = data.split(":", 1)[1]
-                    await manager.connect_with_session_id(websocket, session_id)
+                    if await manager.connect_with_session_id(websocket, session_id) is None:
+                        # Сервер перегружен - клиент переподключится позже
+                        await websocket.close(code=1013)
+                        session_id = None
+                        break
+                elif data.startswith("encoding:") and session_id:
+                    # Клиент предлагает кодировки больших сообщений, например "encoding:columnar,json"
+                    encoding = negotiate_encoding(data.split(":", 1)[1])
+                    manager.set_session_encoding(session_id, encoding)
+                    await manager.send_personal_message(f"encoding:{encoding}", websocket)
                     
             except asyncio.TimeoutError:
                 # Таймаут - это нормально, продолжаем слушать
@@ -205,7 +178,7 @@ async def websocket_endpoint(websocket: WebSocket):
             except WebSocketDisconnect:
                 break
     except Exception as e:
-        print(f"WebSocket error for session {session_id}: {e}")
+        logger.warning("WebSocket error for session %s: %s", session_id, e)
     finally:
         if session_id:
             manager.disconnect(websocket)
@@ -213,22 +186,44 @@ async def websocket_endpoint(websocket: WebSocket):
 @app.post("/create-test-data")
 async def create_test_data(request: CreateTestDataRequest):
     """Создание тестовых данных в Bitrix24 с real-time обновлениями"""
+    # Корневой span запуска: фазы и вызовы Bitrix24 попадают в него дочерними
+    with tracer.span("create_test_data", **{"session.id": request.session_id or ""}):
+        return await run_test_data_generation(request)
+
+
+async def run_test_data_generation(request: CreateTestDataRequest):
+    if request.dry_run:
+        # Прогноз количества вызовов, длительности и памяти без отправки данных; как и запуск, только для сессии
+        if not request.session_id:
+            raise HTTPException(status_code=400, detail="Session ID required")
+        if not await manager.ensure_session(request.session_id):
+            raise HTTPException(status_code=404, detail="Session not found")
+        return await asyncio.to_thread(
+            plan_generation,
+            NUM_CONTACTS if request.num_contacts is None else request.num_contacts,
+            NUM_COMPANIES if request.num_companies is None else request.num_companies,
+            request.call_ms, request.stream, request.readback, request.reconcile
+        )
+    if request.num_contacts is not None or request.num_companies is not None or request.call_ms is not None:
+        # Количества запуска задаются NUM_CONTACTS/NUM_COMPANIES, а не запросом
+        raise HTTPException(status_code=400, detail="num_contacts, num_companies и call_ms доступны только с dry_run")
+    
     try:
         session_id = request.session_id
         if not session_id:
             raise HTTPException(status_code=400, detail="Session ID required")
         
-        # Проверяем, существует ли сессия
-        if session_id not in manager.user_sessions:
+        # Проверяем, существует ли сессия (в том числе на другом воркере)
+        if not await manager.ensure_session(session_id):
             raise HTTPException(status_code=404, detail="Session not found")
         
         # Убираем глобальную блокировку - она блокирует всех пользователей
         # Каждый пользователь должен иметь возможность запускать свою генерацию независимо
         
         # Проверяем, не запущена ли уже генерация для этой сессии
-        session_data = manager.user_sessions[session_id]
-        if session_data['generation_active']:
-            if session_data['generation_paused']:
+        session_status = await manager.fetch_session_generation_status(session_id)
+        if session_status.get('generation_active'):
+            if session_status.get('generation_paused'):
                 raise HTTPException(status_code=409, detail="Генерация приостановлена. Подключитесь для возобновления.")
             else:
                 # Возвращаем информацию о текущем статусе вместо ошибки
@@ -238,118 +233,170 @@ async def create_test_data(request: CreateTestDataRequest):
                     "session_id": session_id[:8]
                 }
         
+        # В режиме local отправленные поля сохраняются вместе с выданными ID для сборки результата
+        local_results = LocalResultSet() if (request.readback or READBACK_MODE) == "local" else None
+        
+        def import_batch(create_records, add_records):
+            def execute(batch):
+                created = create_records(len(batch))
+                records = [(record_id, fields) for record_id, fields in created if record_id]
+                if add_records is not None:
+                    add_records(records)
+                # Дубли, пропущенные без отправки, не считаются ошибками батча
+                return BatchResult((record_id for record_id, _ in records), skipped=getattr(created, "skipped", 0))
+            return execute
+        
         # Запускаем генерацию для конкретной сессии
         manager.start_generation_for_session(session_id)
-        print(f"Начинаем создание тестовых данных в Битрикс 24: Сессия {session_id[:8]}...")
+        logger.info("Начинаем создание тестовых данных в Битрикс 24: Сессия %s...", session_id[:8])
+        
+        async def check_session():
+            """Проверяет соединение перед каждым батчем и ждет, если генерация приостановлена"""
+            if manager.should_stop_generation_for_session(session_id):
+                await manager.stop_generation_for_session(session_id)
+                raise HTTPException(status_code=408, detail="Сессия неактивна")
+            if manager.is_generation_paused_for_session(session_id):
+                logger.info("Ожидание возобновления генерации для сессии %s...", session_id)
+                await manager.wait_for_resume_for_session(session_id)
+        
+        def set_phase(phase):
+            # Фаза попадает в отчет об остановках event loop и в статус сессии для SSE/long-poll
+            loop_monitor.set_phase(session_id, phase)
+            status_board.update(session_id, phase=phase)
+        
+        stream = request.stream
+        if stream is None:
+            stream = STREAMING_THRESHOLD > 0 and NUM_CONTACTS + NUM_COMPANIES >= STREAMING_THRESHOLD
+        if stream:
+            # Большой запуск: ID в компактных колонках, результат уходит частями по мере загрузки
+            stats = await run_streaming_generation(
+                NUM_CONTACTS, NUM_COMPANIES,
+                lambda message: manager.send_message_to_session(session_id, message),
+                before_batch=check_session, on_phase=set_phase,
+                session_id=session_id, encoding=manager.get_session_encoding(session_id)
+            )
+            await manager.send_message_to_session(session_id, encode_stream_complete_message(
+                "Готово! Случайная привязка завершена", stats["companies_sent"]
+            ))
+            await manager.stop_generation_for_session(session_id)
+            return {"message": "Test data created successfully", "streamed": True, **stats}
+        
+        set_phase("contacts")
+        phase_span = tracer.start_span("phase.contacts", count=NUM_CONTACTS)
         
         # Сначала создаем контакты через batch import
-        print(f"Создаём {NUM_CONTACTS} контактов: Сессия {session_id[:8]}...")
+        logger.info("Создаём %d контактов: Сессия %s...", NUM_CONTACTS, session_id[:8])
         
         # Проверяем соединение перед началом
         if manager.should_stop_generation_for_session(session_id):
             await manager.stop_generation_for_session(session_id)
             raise HTTPException(status_code=408, detail="Сессия неактивна")
         
-        # Создаем контакты батчами по 20 (ограничение batch import)
-        contact_ids = []
-        batch_size = 20
-        for batch_start in range(0, NUM_CONTACTS, batch_size):
-            batch_end = min(batch_start + batch_size, NUM_CONTACTS)
-            batch_count = batch_end - batch_start
-            
-            # Проверяем соединение перед каждым батчем
-            if manager.should_stop_generation_for_session(session_id):
-                await manager.stop_generation_for_session(session_id)
-                raise HTTPException(status_code=408, detail="Сессия неактивна")
-            
-            # Если генерация приостановлена, ждем возобновления
-            if manager.is_generation_paused_for_session(session_id):
-                print(f"Ожидание возобновления генерации для сессии {session_id}...")
-                await manager.wait_for_resume_for_session(session_id)
-            
-            print(f"Создаем контакты {batch_start + 1}-{batch_end}: Сессия {session_id[:8]}...")
-            batch_contacts = create_contacts_batch_import(batch_count)
-            contact_ids.extend([cid for cid in batch_contacts if cid])
-            
-            await asyncio.sleep(0.2)  # Пауза между батчами для избежания лимитов
+        # Создаем контакты батчами, размер подбирается по задержке и ошибкам портала
+        contact_ids = flatten(await run_batches(
+            range(NUM_CONTACTS), "contact_import",
+            import_batch(create_contacts_records, local_results.add_contacts if local_results is not None else None),
+            before_batch=check_session, label="Создаем контакты", session_id=session_id
+        ))
         
-        print(f"Создано контактов: {len(contact_ids)}")
+        logger.info("Создано контактов: %d", len(contact_ids))
         
         # Теперь создаем компании через batch import
-        print(f"Создаём {NUM_COMPANIES} компаний: Сессия {session_id[:8]}...")
+        logger.info("Создаём %d компаний: Сессия %s...", NUM_COMPANIES, session_id[:8])
+        phase_span.set_attribute("created", len(contact_ids))
+        phase_span.end()
+        set_phase("companies")
+        phase_span = tracer.start_span("phase.companies", count=NUM_COMPANIES)
         
         # Проверяем соединение перед созданием компаний
         if manager.should_stop_generation_for_session(session_id):
             await manager.stop_generation_for_session(session_id)
             raise HTTPException(status_code=408, detail="Сессия неактивна")
         
-        # Создаем компании батчами по 20 (ограничение batch import)
-        company_ids = []
-        for batch_start in range(0, NUM_COMPANIES, batch_size):
-            batch_end = min(batch_start + batch_size, NUM_COMPANIES)
-            batch_count = batch_end - batch_start
-            
-            # Проверяем соединение перед каждым батчем
-            if manager.should_stop_generation_for_session(session_id):
-                await manager.stop_generation_for_session(session_id)
-                raise HTTPException(status_code=408, detail="Сессия неактивна")
-            
-            # Если генерация приостановлена, ждем возобновления
-            if manager.is_generation_paused_for_session(session_id):
-                print(f"Ожидание возобновления генерации для сессии {session_id}...")
-                await manager.wait_for_resume_for_session(session_id)
-            
-            print(f"Создаем компании {batch_start + 1}-{batch_end}: Сессия {session_id[:8]}...")
-            batch_companies = create_companies_batch_import(batch_count)
-            company_ids.extend([cid for cid in batch_companies if cid])
-            
-            await asyncio.sleep(0.2)  # Пауза между батчами для избежания лимитов
+        company_ids = flatten(await run_batches(
+            range(NUM_COMPANIES), "company_import",
+            import_batch(create_companies_records, local_results.add_companies if local_results is not None else None),
+            before_batch=check_session, label="Создаем компании", session_id=session_id
+        ))
         
-        print(f"Создано компаний: {len(company_ids)}")
+        logger.info("Создано компаний: %d", len(company_ids))
         
         # Создаем случайные пары контакт-компания (1 к 1)
-        print(f"Создаем случайные пары контакт-компания (1 к 1): Сессия {session_id[:8]}...")
+        logger.info("Создаем случайные пары контакт-компания (1 к 1): Сессия %s...", session_id[:8])
         
         # Создаем пары 1 к 1
+        phase_span.set_attribute("created", len(company_ids))
+        phase_span.end()
+        set_phase("links")
         links = create_one_to_one_links(contact_ids, company_ids)
-        
-        # Привязываем контакты батчами по 20
-        successful_links = 0
-        for batch_start in range(0, len(links), batch_size):
-            batch_end = min(batch_start + batch_size, len(links))
-            batch_links = links[batch_start:batch_end]
-            
-            # Проверяем соединение перед каждым батчем
-            if manager.should_stop_generation_for_session(session_id):
-                await manager.stop_generation_for_session(session_id)
-                raise HTTPException(status_code=408, detail="Сессия неактивна")
-            
-            # Если генерация приостановлена, ждем возобновления
-            if manager.is_generation_paused_for_session(session_id):
-                print(f"Ожидание возобновления генерации для сессии {session_id}...")
-                await manager.wait_for_resume_for_session(session_id)
-            
-            print(f"Привязываем контакты {batch_start + 1}-{batch_end}: Сессия {session_id[:8]}...")
-            batch_results = update_contacts_company_batch(batch_links)
-            successful_links += len(batch_results)
-            
-            await asyncio.sleep(0.2)  # Пауза между батчами для избежания лимитов
-        
-        print(f"Готово! Статистика для сессии {session_id[:8]}:")
-        print(f"Контактов создано: {len(contact_ids)}")
-        print(f"Компаний создано: {len(company_ids)}")
-        print(f"Успешно привязано: {successful_links}")
-        
-        # Загружаем сгенерированные компании с контактами через batch API
-        print("Загружаем сгенерированные компании через batch API...")
-        generated_companies = get_generated_data_batch(company_ids, contact_ids)
+        phase_span = tracer.start_span("phase.links", count=len(links))
+        
+        def link_contacts(batch_links):
+            # Ключи успешных команд имеют вид update_{индекс в пачке}
+            return [batch_links[int(key.split("_")[1])] for key in update_contacts_company_batch(batch_links)]
+        
+        async def on_linked(batch, linked):
+            # Успешные привязки сразу применяем к зеркалу и к локальному результату
+            if local_results is not None:
+                local_results.link(linked)
+            if crm_mirror is not None:
+                await asyncio.to_thread(crm_mirror.set_contacts_company, list(linked))
+        
+        successful_links = len(flatten(await run_batches(
+            links, "contact_link", link_contacts, before_batch=check_session, on_result=on_linked,
+            label="Привязываем контакты", session_id=session_id, idempotent=True
+        )))
+        
+        phase_span.set_attribute("linked", successful_links)
+        phase_span.end()
+        
+        reconciliation = None
+        if RECONCILE_LINKS if request.reconcile is None else request.reconcile:
+            # Проверяем, что на портале каждый контакт привязан к запланированной компании
+            set_phase("reconcile")
+            with tracer.span("phase.reconcile", count=len(links)) as reconcile_span:
+                # Оставшиеся расхождения переносим в локальный результат, чтобы он совпадал с порталом
+                on_drift = None
+                if local_results is not None:
+                    on_drift = lambda drift: local_results.link((item["contact_id"], item["actual"]) for item in drift)
+                reconciliation = await reconcile_links(
+                    links, before_batch=check_session, on_linked=on_linked, on_drift=on_drift, session_id=session_id
+                )
+                reconcile_span.set_attribute("reconcile.drift", reconciliation["drift"])
+                reconcile_span.set_attribute("reconcile.remaining", reconciliation["remaining"])
+            successful_links = len(links) - reconciliation["remaining"]
+        
+        logger.info("Готово! Статистика для сессии %s: контактов создано %d, компаний создано %d, успешно привязано %d",
+                    session_id[:8], len(contact_ids), len(company_ids), successful_links)
+        
+        set_phase("readback")
+        with tracer.span("phase.readback", companies=len(company_ids)) as readback_span:
+            generated_companies = None
+            readback = "full"
+            if local_results is not None:
+                # Результат собирается из отправленных данных, из Битрикс24 читается только выборка
+                verification = await asyncio.to_thread(local_results.verify, READBACK_VERIFY_SAMPLE)
+                readback_span.set_attribute("readback.checked", verification["checked"])
+                readback_span.set_attribute("readback.mismatches", len(verification["mismatches"]))
+                if not verification["mismatches"]:
+                    generated_companies = local_results.build()
+                    readback = "local"
+                    if crm_mirror is not None:
+                        await asyncio.to_thread(crm_mirror.upsert_companies, list(local_results.companies.values()))
+                        await asyncio.to_thread(crm_mirror.upsert_contacts, list(local_results.contacts.values()))
+                else:
+                    logger.warning("Локальный результат расходится с порталом, загружаем все записи")
+            if generated_companies is None:
+                # Загружаем сгенерированные компании с контактами через batch API
+                logger.info("Загружаем сгенерированные компании через batch API...")
+                generated_companies = await get_generated_data_batch(company_ids, contact_ids)
         
         # Отправляем результат только конкретной сессии
-        await manager.send_message_to_session(session_id, json.dumps({
-            "type": "complete",
-            "message": "Готово! Случайная привязка завершена",
-            "companies": [company.model_dump() for company in generated_companies]
-        }))
+        await manager.send_message_to_session(session_id, encode_complete_message(
+            "Готово! Случайная привязка завершена",
+            generated_companies,
+            manager.get_session_encoding(session_id)
+        ))
         
         # Останавливаем генерацию для этой сессии
         await manager.stop_generation_for_session(session_id)
@@ -358,17 +405,20 @@ async def create_test_data(request: CreateTestDataRequest):
             "message": "Test data created successfully",
             "contacts_created": len(contact_ids),
             "companies_created": len(company_ids),
-            "successful_links": successful_links
+            "successful_links": successful_links,
+            "readback": readback,
+            "reconciliation": reconciliation
         }
     except Exception as e:
-        if session_id in manager.user_sessions:
-            print(f"Генерация отменена для сессии {session_id[:8]} - ошибка: {e}")
+        # Сессия могла быть подключена к другому воркеру - ошибка уходит ему через посредника
+        if session_id and await manager.ensure_session(session_id):
+            logger.warning("Генерация отменена для сессии %s - ошибка: %s", session_id[:8], e)
             await manager.stop_generation_for_session(session_id)
             await manager.send_message_to_session(session_id, json.dumps({
                 "type": "error",
-                "message": f"❌ Ошибка создания данных: {e}"
+                "message": f"❌ Ошибка создания данных: {redact(str(e))}"
             }))
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=redact(str(e)))
 
 @app.get("/generation-status")
 async def get_generation_status():
@@ -378,7 +428,17 @@ async def get_generation_status():
 @app.get("/generation-status/{session_id}")
 async def get_session_generation_status(session_id: str):
     """Получение статуса генерации для конкретной сессии"""
-    return manager.get_session_generation_status(session_id)
+    return await manager.fetch_session_generation_status(session_id)
+
+@app.get("/debug/loop-stalls")
+async def get_loop_stalls():
+    """Задержки event loop и последние остановки со стеком, сессией и фазой генерации"""
+    return loop_monitor.get_report()
+
+@app.get("/debug/batch-tuning")
+async def get_batch_tuning():
+    """Размеры батчей, на которых остановился подбор, по порталам и операциям"""
+    return batch_tuning.get_state()
 
 @app.get("/session-info")
 async def get_session_info():
@@ -389,11 +449,32 @@ async def get_session_info():
         "any_active_generation": manager.has_any_active_generation()
     }
 
+# Обслуживание статических файлов фронтенда.
+# Регистрируется последним, чтобы маршрут SPA не перехватывал API маршруты
+frontend_build_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "frontend", "build")
+create_static_routes(app, frontend_build_path)
+
 if __name__ == "__main__":
-    print(f"🚀 Starting Bitrix24 Contacts API on {HOST}:{PORT}")
-    print(f"📁 Frontend build path: {frontend_build_path}")
-    print(f"🌐 Allowed origins: {ALLOWED_ORIGINS}")
-    print(f"🔗 Bitrix24 Webhook: {'*' * 50}")  # Скрываем webhook URL
-    print(f"📊 Will create {NUM_CONTACTS} contacts and {NUM_COMPANIES} companies")
+    logger.info("🚀 Starting Bitrix24 Contacts API on %s:%s", HOST, PORT)
+    logger.info("📁 Frontend build path: %s", frontend_build_path)
+    logger.info("🌐 Allowed origins: %s", ALLOWED_ORIGINS)
+    logger.info("🔗 Bitrix24 Webhook: %s", WEBHOOK_URL)  # URL скрывается при выводе
+    logger.info("📊 Will create %d contacts and %d companies", NUM_CONTACTS, NUM_COMPANIES)
+    
+    workers = WORKERS
+    if workers > 1 and SESSION_BACKEND == "memory":
+        logger.warning("⚠️  WORKERS > 1 требует общего backend сессий (SESSION_BACKEND=redis), запускаем один воркер")
+        workers = 1
+    
+    import uvicorn  # Нужен только при запуске python main.py; воркеры uvicorn импортируют main:app сами
     
-    uvicorn.run(app, host=HOST, port=PORT, log_level="info" if DEBUG else "warning")
+    # Несколько воркеров uvicorn запускает только по строке импорта приложения
+    uvicorn.run(
+        "main:app" if workers > 1 else app,
+        workers=workers,
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host=HOST,
+        port=PORT,
+        log_level="info" if DEBUG else "warning",
+        ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE
+    )
@@ -0,0 +1,81 @@
+"""
+Кодирование больших WebSocket сообщений.
+
+По умолчанию сообщения отправляются обычным JSON (список объектов компаний).
+Клиент может договориться о колоночном формате: ключи не повторяются для
+каждой записи, а значения одного поля лежат в одном массиве. Это заметно
+уменьшает размер сообщения и ускоряет его разбор на больших результатах.
+"""
+
+from result_builder import dumps
+
+ENCODING_JSON = "json"
+ENCODING_COLUMNAR = "columnar"
+SUPPORTED_ENCODINGS = (ENCODING_COLUMNAR, ENCODING_JSON)
+
+COMPANY_FIELDS = ("id", "title", "phone", "email")
+CONTACT_FIELDS = ("id", "name", "last_name", "phone", "email", "post", "company_id")
+
+
+def negotiate_encoding(offer: str) -> str:
+    """Выбирает первую поддерживаемую кодировку из предложения клиента ("columnar,json")"""
+    for encoding in offer.split(","):
+        encoding = encoding.strip().lower()
+        if encoding in SUPPORTED_ENCODINGS:
+            return encoding
+    return ENCODING_JSON
+
+
+def encode_companies_columnar(companies):
+    """
+    Преобразует список компаний (dict в формате Company.model_dump()) в колонки.
+    Контакты всех компаний идут подряд, contacts_count задает их разбиение по компаниям.
+    """
+    company_columns = [[] for _ in COMPANY_FIELDS]
+    contact_columns = [[] for _ in CONTACT_FIELDS]
+    contacts_count = []
+
+    for company in companies:
+        for column, field in zip(company_columns, COMPANY_FIELDS):
+            column.append(company.get(field))
+
+        contacts = company.get("contacts") or []
+        contacts_count.append(len(contacts))
+        for contact in contacts:
+            for column, field in zip(contact_columns, CONTACT_FIELDS):
+                column.append(contact.get(field))
+
+    return {
+        "fields": list(COMPANY_FIELDS),
+        "columns": company_columns,
+        "contacts_count": contacts_count,
+        "contact_fields": list(CONTACT_FIELDS),
+        "contact_columns": contact_columns,
+    }
+
+
+def encode_complete_message(message: str, companies, encoding: str = ENCODING_JSON) -> str:
+    """Собирает сообщение о завершении генерации в согласованной кодировке"""
+    payload = {"type": "complete", "message": message}
+    if encoding == ENCODING_COLUMNAR:
+        payload["encoding"] = ENCODING_COLUMNAR
+        payload["companies"] = encode_companies_columnar(companies)
+    else:
+        payload["companies"] = companies
+    return dumps(payload)
+
+
+def encode_result_chunk(companies, offset: int, encoding: str = ENCODING_JSON) -> str:
+    """Часть результата потоковой генерации: компании начиная с позиции offset"""
+    payload = {"type": "result_chunk", "offset": offset}
+    if encoding == ENCODING_COLUMNAR:
+        payload["encoding"] = ENCODING_COLUMNAR
+        payload["companies"] = encode_companies_columnar(companies)
+    else:
+        payload["companies"] = companies
+    return dumps(payload)
+
+
+def encode_stream_complete_message(message: str, total: int) -> str:
+    """Завершение потоковой генерации: компании уже отправлены частями result_chunk"""
+    return dumps({"type": "complete", "message": message, "streamed": True, "total": total})
@@ -1,5 +1,7 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+from config import PLAN_MAX_RECORDS
 
 class Contact(BaseModel):
     id: Optional[int] = None
@@ -18,4 +20,16 @@ class Company(BaseModel):
     contacts: List[Contact] = []
 
 class CreateTestDataRequest(BaseModel):
-    session_id: str
\ No newline at end of file
+    session_id: str = ""
+    # Прогноз запуска без обращений к Битрикс24 (нужна сессия). Количества и call_ms - только для прогноза:
+    # настоящий запуск создает NUM_CONTACTS/NUM_COMPANIES и отвечает 400, если они переданы
+    dry_run: bool = False
+    num_contacts: Optional[int] = Field(None, ge=0, le=PLAN_MAX_RECORDS)
+    num_companies: Optional[int] = Field(None, ge=0, le=PLAN_MAX_RECORDS)
+    call_ms: Optional[float] = Field(None, gt=0)
+    # Сборка результата: full - загрузить созданные записи, local - из отправленных данных (по умолчанию READBACK_MODE)
+    readback: Optional[Literal["full", "local"]] = None
+    # Сверка привязок с порталом после запуска (по умолчанию RECONCILE_LINKS)
+    reconcile: Optional[bool] = None
+    # Потоковый режим для больших запусков (по умолчанию - по STREAMING_THRESHOLD)
+    stream: Optional[bool] = None
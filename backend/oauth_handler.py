@@ -1,11 +1,14 @@
 import os
 import json
-import requests
+import logging
 from fastapi import FastAPI, Request, HTTPException, Query
 from fastapi.responses import RedirectResponse, HTMLResponse
 from typing import Optional
 import urllib.parse
 from config import BITRIX24_CLIENT_ID, BITRIX24_CLIENT_SECRET, BITRIX24_REDIRECT_URI
+from log_config import redact
+
+logger = logging.getLogger(__name__)
 
 class Bitrix24OAuth:
     def __init__(self):
@@ -38,11 +41,13 @@ class Bitrix24OAuth:
         }
         
         try:
+            import requests  # Импортируется при первом обмене токенов, а не при старте приложения
             response = requests.post(self.token_url, data=data, timeout=30)
             response.raise_for_status()
             return response.json()
         except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Ошибка получения токена: {e}")
+            logger.error("Ошибка получения токена для %s: %s", domain, e)
+            raise HTTPException(status_code=400, detail=redact(f"Ошибка получения токена: {e}"))
     
     def refresh_access_token(self, refresh_token: str) -> dict:
         """Обновляет токен доступа"""
@@ -54,11 +59,13 @@ class Bitrix24OAuth:
         }
         
         try:
+            import requests  # Импортируется при первом обмене токенов, а не при старте приложения
             response = requests.post(self.token_url, data=data, timeout=30)
             response.raise_for_status()
             return response.json()
         except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Ошибка обновления токена: {e}")
+            logger.error("Ошибка обновления токена: %s", e)
+            raise HTTPException(status_code=400, detail=redact(f"Ошибка обновления токена: {e}"))
 
 # Глобальный экземпляр OAuth
 oauth = Bitrix24OAuth()
@@ -114,6 +121,7 @@ def create_oauth_routes(app: FastAPI):
         try:
             # Получаем токены
             tokens = oauth.get_access_token(code, state)
+            logger.info("Приложение установлено на портале %s", state)
             
             # Сохраняем токены (в реальном приложении - в базе данных)
             # Здесь просто возвращаем успешную страницу
@@ -274,7 +282,7 @@ def create_oauth_routes(app: FastAPI):
                 <head><title>Ошибка установки</title></head>
                 <body>
                     <h1>Ошибка установки</h1>
-                    <p>Ошибка: {str(e)}</p>
+                    <p>Ошибка: {redact(str(e))}</p>
                 </body>
             </html>
             """, status_code=500)
@@ -0,0 +1,123 @@
+"""
+Сверка привязок контактов после запуска.
+
+successful_links считает только команды batch, вернувшие True, поэтому частичные сбои
+остаются незамеченными. Сверка читает COMPANY_ID всех контактов запуска (crm.contact.list
+с фильтром @ID по 50 контактов на команду, до 50 команд в одном вызове batch), сравнивает
+с запланированными парами через словарь contact_id -> company_id и заново отправляет
+только отсутствующие и неверные привязки.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from batch_compiler import Operation, execute_operations, send_batch
+from batch_runner import run_batches
+from data_generator import update_contacts_company_batch
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 50  # crm.contact.list отдает не больше 50 строк
+BATCH_PAUSE = 0.2
+DRIFT_SAMPLE_SIZE = 20
+
+
+def _paced_send(commands: Dict[str, str]) -> Optional[dict]:
+    response = send_batch(commands)
+    time.sleep(BATCH_PAUSE)  # Пауза между вызовами для избежания лимитов
+    return response
+
+
+def list_contact_companies(contact_ids: List[int]) -> Dict[int, Optional[int]]:
+    """Текущие COMPANY_ID контактов (блокирующая); контактов, которых нет на портале, в ответе нет"""
+    operations = [
+        Operation(f"list_{start // PAGE_SIZE}", "crm.contact.list", {
+            "filter": {"@ID": contact_ids[start:start + PAGE_SIZE]},
+            "select": ["ID", "COMPANY_ID"],
+            "start": -1
+        })
+        for start in range(0, len(contact_ids), PAGE_SIZE)
+    ]
+    results, errors = execute_operations(operations, _paced_send)
+    if errors:
+        raise RuntimeError(f"Не удалось прочитать контакты для сверки: {next(iter(errors.values()))}")
+    return {
+        int(row["ID"]): int(row["COMPANY_ID"]) if row.get("COMPANY_ID") else None
+        for rows in results.values() for row in rows
+    }
+
+
+def diff_links(planned: Dict[int, int], actual: Dict[int, Optional[int]]) -> List[dict]:
+    """Расхождения запланированных привязок с порталом"""
+    drift = []
+    for contact_id, company_id in planned.items():
+        if contact_id not in actual:
+            drift.append({"contact_id": contact_id, "company_id": company_id, "actual": None, "kind": "missing_contact"})
+        elif actual[contact_id] is None:
+            drift.append({"contact_id": contact_id, "company_id": company_id, "actual": None, "kind": "unlinked"})
+        elif actual[contact_id] != company_id:
+            drift.append({"contact_id": contact_id, "company_id": company_id, "actual": actual[contact_id],
+                          "kind": "wrong_company"})
+    return drift
+
+
+def _count_kinds(drift: List[dict]) -> Dict[str, int]:
+    counts = {"missing_contact": 0, "unlinked": 0, "wrong_company": 0}
+    for item in drift:
+        counts[item["kind"]] += 1
+    return counts
+
+
+async def reconcile_links(links: Iterable[Tuple[int, int]], repair: bool = True,
+                          before_batch: Optional[Callable[[], Awaitable[None]]] = None,
+                          on_linked: Optional[Callable[[list, list], Optional[Awaitable[None]]]] = None,
+                          on_drift: Optional[Callable[[List[dict]], None]] = None,
+                          session_id: str = "") -> dict:
+    """
+    Сверяет привязки (contact_id, company_id) с порталом и, если repair, исправляет расхождения.
+    Удаленные контакты не исправляются. on_linked вызывается с исправленными парами, как при привязке,
+    on_drift - с расхождениями, оставшимися после сверки.
+    """
+    planned = {int(contact_id): int(company_id) for contact_id, company_id in links}
+    actual = await asyncio.to_thread(list_contact_companies, list(planned))
+    drift = diff_links(planned, actual)
+    report = {
+        "planned": len(planned),
+        "drift": len(drift),
+        "kinds": _count_kinds(drift),
+        "sample": drift[:DRIFT_SAMPLE_SIZE],
+        "repaired": 0,
+        "remaining": len(drift)
+    }
+    if drift:
+        logger.warning("Сверка привязок: %d из %d расходятся с планом %s", len(drift), len(planned), report["kinds"])
+    else:
+        logger.info("Сверка привязок: все %d привязок на месте", len(planned))
+
+    to_repair = [(item["contact_id"], item["company_id"]) for item in drift if item["kind"] != "missing_contact"]
+    if not repair or not to_repair:
+        if drift and on_drift is not None:
+            on_drift(drift)
+        return report
+
+    def relink(batch):
+        # Ключи успешных команд имеют вид update_{индекс в пачке}
+        return [batch[int(key.split("_")[1])] for key in update_contacts_company_batch(batch)]
+
+    await run_batches(
+        to_repair, "contact_link", relink, before_batch=before_batch, on_result=on_linked,
+        label="Исправляем привязки", session_id=session_id, collect=False, idempotent=True
+    )
+
+    # Повторная сверка только исправленных контактов
+    repaired_ids = [contact_id for contact_id, _ in to_repair]
+    actual.update(await asyncio.to_thread(list_contact_companies, repaired_ids))
+    remaining = diff_links(planned, actual)
+    report["repaired"] = len(drift) - len(remaining)
+    report["remaining"] = len(remaining)
+    if remaining and on_drift is not None:
+        on_drift(remaining)
+    logger.info("Сверка привязок: исправлено %d, осталось расхождений %d", report["repaired"], len(remaining))
+    return report
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Redis для разработки и тестов SESSION_BACKEND=redis.
+
+Поддерживает только команды, которые использует RedisSessionBackend: hash с TTL
+(HSET, HGETALL, EXPIRE, TTL, EXISTS, DEL) и pub/sub (PUBLISH, SUBSCRIBE, UNSUBSCRIBE).
+Данные хранятся в памяти процесса, истекшие ключи удаляются при обращении.
+Запуск: python redis_stand_in.py [--port 6379], затем REDIS_URL=redis://127.0.0.1:6379/0
+"""
+
+import time
+import asyncio
+import argparse
+from typing import Dict, Optional, Set
+
+
+class RedisStandIn:
+    """RESP2 сервер с hash ключами и pub/sub"""
+
+    def __init__(self):
+        self.hashes: Dict[str, Dict[str, str]] = {}
+        self.expires: Dict[str, float] = {}
+        self.channels: Dict[str, Set[asyncio.StreamWriter]] = {}
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Запускает сервер и возвращает порт"""
+        self.server = await asyncio.start_server(self._serve, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    # Протокол
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(RedisStandIn._encode(item) for item in value)
+        data = str(value).encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> Optional[list]:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.decode().split()  # Inline команда (redis-cli, telnet)
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2].decode())
+        return args
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if args:
+                    writer.write(self._execute(writer, args[0].upper(), args[1:]))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for subscribers in self.channels.values():
+                subscribers.discard(writer)
+            writer.close()
+
+    # Команды
+
+    def _alive(self, key: str) -> bool:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.hashes.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.hashes
+
+    def _execute(self, writer: asyncio.StreamWriter, command: str, args: list) -> bytes:
+        if command == "PING":
+            return b"+PONG\r\n"
+        if command in ("CLIENT", "SELECT"):
+            return b"+OK\r\n"
+        if command == "HSET":
+            key = args[0]
+            self._alive(key)
+            fields = self.hashes.setdefault(key, {})
+            added = sum(1 for name in args[1::2] if name not in fields)
+            fields.update(zip(args[1::2], args[2::2]))
+            return self._encode(added)
+        if command == "HGETALL":
+            fields = self.hashes[args[0]] if self._alive(args[0]) else {}
+            return self._encode([item for pair in fields.items() for item in pair])
+        if command == "EXPIRE":
+            if not self._alive(args[0]):
+                return self._encode(0)
+            self.expires[args[0]] = time.monotonic() + int(args[1])
+            return self._encode(1)
+        if command == "TTL":
+            if not self._alive(args[0]):
+                return self._encode(-2)
+            expires = self.expires.get(args[0])
+            return self._encode(-1 if expires is None else round(expires - time.monotonic()))
+        if command == "EXISTS":
+            return self._encode(sum(1 for key in args if self._alive(key)))
+        if command == "DEL":
+            deleted = sum(1 for key in args if self._alive(key))
+            for key in args:
+                self.hashes.pop(key, None)
+                self.expires.pop(key, None)
+            return self._encode(deleted)
+        if command == "PUBLISH":
+            subscribers = self.channels.get(args[0], set())
+            for subscriber in subscribers:
+                subscriber.write(self._encode(["message", args[0], args[1]]))
+            return self._encode(len(subscribers))
+        if command in ("SUBSCRIBE", "UNSUBSCRIBE"):
+            replies = []
+            for channel in args:
+                subscribers = self.channels.setdefault(channel, set())
+                if command == "SUBSCRIBE":
+                    subscribers.add(writer)
+                else:
+                    subscribers.discard(writer)
+                count = sum(1 for members in self.channels.values() if writer in members)
+                replies.append(self._encode([command.lower(), channel, count]))
+            return b"".join(replies)
+        return f"-ERR unknown command '{command}'\r\n".encode()
+
+
+async def serve(host: str, port: int):
+    stand_in = RedisStandIn()
+    port = await stand_in.start(host, port)
+    print(f"Redis stand-in: redis://{host}:{port}/0")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Redis для SESSION_BACKEND=redis")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Быстрая сборка результатов генерации.
+
+Строки Bitrix24 (crm.company.get / crm.contact.get) сразу превращаются в
+словари того же вида, что и Company.model_dump(), без создания и валидации
+Pydantic моделей для каждой записи. Контакты группируются по компании через
+индекс, а сериализация выполняется orjson, если он установлен.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость
+    orjson = None
+
+
+def _to_int(value):
+    """Приводит ID из ответа Bitrix24 ("123") к int, как это делает Pydantic"""
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _first_value(multifield):
+    """Возвращает первое значение мультиполя PHONE/EMAIL"""
+    if not multifield:
+        return None
+    return multifield[0].get("VALUE")
+
+
+def build_contact_record(contact):
+    """Собирает словарь контакта в формате Contact.model_dump()"""
+    return {
+        "id": _to_int(contact.get("ID")),
+        "name": contact.get("NAME") or "",
+        "last_name": contact.get("LAST_NAME") or "",
+        "phone": _first_value(contact.get("PHONE")),
+        "email": _first_value(contact.get("EMAIL")),
+        "post": contact.get("POST"),
+        "company_id": _to_int(contact.get("COMPANY_ID"))
+    }
+
+
+def build_company_records(companies_data, contacts_data):
+    """
+    Собирает список компаний с контактами (формат Company.model_dump()).
+    companies_data и contacts_data - словари {ключ batch: строка Bitrix24}.
+    """
+    contacts_by_company = {}
+    for contact in contacts_data.values():
+        contacts_by_company.setdefault(contact.get("COMPANY_ID"), []).append(build_contact_record(contact))
+
+    companies = []
+    for company in companies_data.values():
+        companies.append({
+            "id": _to_int(company.get("ID")),
+            "title": company.get("TITLE") or "",
+            "phone": _first_value(company.get("PHONE")),
+            "email": _first_value(company.get("EMAIL")),
+            "contacts": contacts_by_company.get(company.get("ID"), [])
+        })
+    return companies
+
+
+def dumps(payload) -> str:
+    """Сериализует результат в JSON строку (orjson, если доступен)"""
+    if orjson is not None:
+        return orjson.dumps(payload).decode("utf-8")
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,155 @@
+import json
+import logging
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from config import SESSION_BACKEND, REDIS_URL, SESSION_TTL
+
+logger = logging.getLogger(__name__)
+
+# Поля статуса генерации, которые видны всем воркерам
+STATUS_FIELDS = ('generation_active', 'generation_paused', 'generation_initiator')
+
+MessageCallback = Callable[[dict], Awaitable[None]]
+
+
+class InMemorySessionBackend:
+    """
+    Реестр сессий и доставка сообщений внутри одного процесса.
+    Используется по умолчанию, когда сервер запущен одним воркером.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, dict] = {}
+        self.worker_id = None
+        self.on_message: Optional[MessageCallback] = None
+
+    async def start(self, worker_id: str, on_message: MessageCallback):
+        self.worker_id = worker_id
+        self.on_message = on_message
+
+    async def stop(self):
+        self.on_message = None
+
+    async def register_session(self, session_id: str, worker_id: str):
+        self.sessions[session_id] = {'worker_id': worker_id, **{field: False for field in STATUS_FIELDS}}
+
+    async def unregister_session(self, session_id: str):
+        self.sessions.pop(session_id, None)
+
+    async def touch_session(self, session_id: str):
+        pass  # Сессии в памяти не истекают
+
+    async def get_session(self, session_id: str) -> Optional[dict]:
+        session = self.sessions.get(session_id)
+        return dict(session) if session else None
+
+    async def update_session(self, session_id: str, fields: dict):
+        if session_id in self.sessions:
+            self.sessions[session_id].update(fields)
+
+    async def publish(self, worker_id: str, payload: dict):
+        if worker_id == self.worker_id and self.on_message:
+            await self.on_message(payload)
+
+    async def publish_all(self, payload: dict):
+        if self.on_message:
+            await self.on_message(payload)
+
+
+class RedisSessionBackend:
+    """
+    Общий реестр сессий и pub/sub между воркерами через Redis-совместимый сервер
+    (Redis, KeyDB, Valkey или локальная замена для разработки).
+    Сессия хранится в hash с TTL, у каждого воркера свой канал сообщений.
+    """
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = SESSION_TTL, prefix: str = "bitrix24-contacts"):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("Для SESSION_BACKEND=redis установите пакет redis: pip install redis")
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.worker_id = None
+        self.on_message: Optional[MessageCallback] = None
+        self.pubsub = None
+        self.listener = None
+
+    def _session_key(self, session_id: str) -> str:
+        return f"{self.prefix}:session:{session_id}"
+
+    def _worker_channel(self, worker_id: str) -> str:
+        return f"{self.prefix}:worker:{worker_id}"
+
+    def _all_channel(self) -> str:
+        return f"{self.prefix}:all"
+
+    async def start(self, worker_id: str, on_message: MessageCallback):
+        self.worker_id = worker_id
+        self.on_message = on_message
+        self.pubsub = self.redis.pubsub()
+        await self.pubsub.subscribe(self._worker_channel(worker_id), self._all_channel())
+        self.listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self.listener:
+            self.listener.cancel()
+            await asyncio.gather(self.listener, return_exceptions=True)
+        if self.pubsub:
+            await self.pubsub.aclose()
+        await self.redis.aclose()
+
+    async def _listen(self):
+        async for message in self.pubsub.listen():
+            if message.get('type') != 'message':
+                continue
+            try:
+                await self.on_message(json.loads(message['data']))
+            except Exception as e:
+                logger.exception("Ошибка обработки сообщения от другого воркера: %s", e)
+
+    async def register_session(self, session_id: str, worker_id: str):
+        key = self._session_key(session_id)
+        await self.redis.hset(key, mapping={'worker_id': worker_id, **{field: '0' for field in STATUS_FIELDS}})
+        await self.redis.expire(key, self.ttl)
+
+    async def unregister_session(self, session_id: str):
+        await self.redis.delete(self._session_key(session_id))
+
+    async def touch_session(self, session_id: str):
+        """Продлевает TTL активной сессии, чтобы она не исчезла для остальных воркеров"""
+        await self.redis.expire(self._session_key(session_id), self.ttl)
+
+    async def get_session(self, session_id: str) -> Optional[dict]:
+        data = await self.redis.hgetall(self._session_key(session_id))
+        if not data:
+            return None
+        return {
+            'worker_id': data.get('worker_id'),
+            **{field: data.get(field) == '1' for field in STATUS_FIELDS}
+        }
+
+    async def update_session(self, session_id: str, fields: dict):
+        key = self._session_key(session_id)
+        values = {name: ('1' if value else '0') if isinstance(value, bool) else value for name, value in fields.items()}
+        if values and await self.redis.exists(key):
+            await self.redis.hset(key, mapping=values)
+            await self.redis.expire(key, self.ttl)
+
+    async def publish(self, worker_id: str, payload: dict):
+        await self.redis.publish(self._worker_channel(worker_id), json.dumps(payload, ensure_ascii=False))
+
+    async def publish_all(self, payload: dict):
+        await self.redis.publish(self._all_channel(), json.dumps(payload, ensure_ascii=False))
+
+
+def create_session_backend(name: str = SESSION_BACKEND):
+    """Создает backend сессий по имени из настроек (memory или redis)"""
+    if name == "redis":
+        return RedisSessionBackend()
+    if name == "memory":
+        return InMemorySessionBackend()
+    raise ValueError(f"Неизвестный SESSION_BACKEND: {name}")
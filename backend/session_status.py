@@ -0,0 +1,244 @@
+"""
+Статус генерации для клиентов без WebSocket.
+
+Некоторые корпоративные прокси перед iframe Битрикс24 не пропускают WebSocket, и клиенту
+остается часто опрашивать /generation-status/{session_id}. Здесь у каждой сессии есть номер
+версии, короткий журнал изменений статуса (старт и остановка генерации, фаза, ход батчей)
+и очередь сообщений сессии, у которой нет WebSocket: сообщения с результатом не вытесняются
+изменениями статуса и хранятся, пока клиент не подтвердит их следующим запросом. Каждое
+событие увеличивает версию и будит ожидающих, поэтому SSE (/stream) и long-poll (/poll) отвечают только при изменениях.
+"""
+
+import json
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from config import STATUS_EVENT_BUFFER, SSE_KEEPALIVE_SECONDS, LONG_POLL_TIMEOUT
+from session_backend import STATUS_FIELDS
+
+logger = logging.getLogger(__name__)
+
+EVENT_STATUS = "status"
+EVENT_MESSAGE = "message"
+EVENT_CLOSED = "closed"
+SSE_RETRY_MS = 3000  # Через сколько EventSource переподключается после обрыва
+MAX_SESSION_ID_LENGTH = 128
+
+Event = Tuple[int, str, object]  # (версия, тип, данные)
+
+
+class SessionStatus:
+    """
+    Версия, текущий статус и последние события одной сессии. Изменения статуса хранятся в кольцевом
+    буфере (пропущенные заменяет снимок), сообщения - в отдельной очереди до доставки клиенту.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.status = {field: False for field in STATUS_FIELDS}
+        self.status.update(phase=None, progress=None)
+        self.events = deque(maxlen=STATUS_EVENT_BUFFER)
+        self.evicted_version = 0  # Версия последнего вытесненного из буфера изменения статуса
+        self.messages: deque = deque()  # Сообщения (complete, result_chunk, error) не вытесняются
+        self.changed = asyncio.Event()  # Заменяется новым при каждом событии
+        self.forward: Optional[Callable[[dict], None]] = None  # Пересылка изменений воркеру сессии
+
+    def publish(self, kind: str, data):
+        self.version += 1
+        if kind == EVENT_MESSAGE:
+            self.messages.append((self.version, kind, data))
+        else:
+            if len(self.events) == self.events.maxlen:
+                self.evicted_version = self.events[0][0]
+            self.events.append((self.version, kind, data))
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def acknowledge(self, version: int):
+        """Удаляет сообщения, которые клиент уже получил (он запрашивает события после version)"""
+        while self.messages and self.messages[0][0] <= version:
+            self.messages.popleft()
+
+
+class SessionStatusBoard:
+    """Журналы статуса сессий этого процесса"""
+
+    def __init__(self):
+        self.sessions: Dict[str, SessionStatus] = {}
+
+    def open(self, session_id: str, forward: Optional[Callable[[dict], None]] = None):
+        """
+        Заводит журнал новой сессии; события сессий без журнала (уже закрытых) не записываются.
+        forward получает изменения статуса сессии, которая подключена к другому воркеру: ее клиент
+        SSE/long-poll читает журнал того воркера.
+        """
+        session = self.sessions.setdefault(session_id, SessionStatus())
+        session.forward = forward
+
+    def update(self, session_id: str, **fields):
+        """Меняет поля статуса; событие публикуется, только если значение изменилось"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        changed = {key: value for key, value in fields.items() if session.status.get(key) != value}
+        if changed:
+            session.status.update(changed)
+            session.publish(EVENT_STATUS, dict(session.status))
+            if session.forward is not None:
+                session.forward(changed)
+
+    def set_progress(self, session_id: str, label: str, done: int, total: Optional[int]):
+        self.update(session_id, progress={"label": label, "done": done, "total": total})
+
+    def push_message(self, session_id: str, message: str):
+        """Сообщение сессии без WebSocket (то, что иначе ушло бы через send_text)"""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.publish(EVENT_MESSAGE, message)
+
+    def changes(self, session_id: str, version: Optional[int]) -> List[Event]:
+        """
+        События после version; сообщения до version считаются доставленными и удаляются. Если часть
+        изменений статуса уже вытеснена из буфера, version неизвестна клиенту (None) или больше текущей
+        (сервер перезапускался) - вместо изменений статуса после недоставленных сообщений идет снимок.
+        """
+        session = self.sessions.get(session_id) or SessionStatus()
+        stale = version is None or version > session.version
+        if not stale:
+            session.acknowledge(version)
+        if version == session.version:
+            return []
+        messages = [event for event in session.messages if stale or event[0] > version]
+        if stale or session.evicted_version > version:
+            return messages + [(session.version, EVENT_STATUS, dict(session.status))]
+        events = sorted(messages + [event for event in session.events if event[0] > version])
+        if not events:
+            # Событий после version нет, хотя версия изменилась (сообщения получил другой клиент)
+            events.append((session.version, EVENT_STATUS, dict(session.status)))
+        return events
+
+    def acknowledge(self, session_id: str, version: int):
+        """Клиент получил события до version: его сообщения больше не хранятся"""
+        session = self.sessions.get(session_id)
+        if session is not None and version <= session.version:
+            session.acknowledge(version)
+
+    async def wait(self, session_id: str, version: Optional[int], timeout: float) -> bool:
+        """Ждет версию, отличную от version; False, если за timeout ничего не изменилось"""
+        session = self.sessions.get(session_id)
+        if session is None or version != session.version:
+            return True
+        try:
+            await asyncio.wait_for(session.changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def remove(self, session_id: str):
+        """Удаляет журнал закрытой сессии и будит ожидающих"""
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.changed.set()
+
+
+# Глобальные журналы статуса сессий
+status_board = SessionStatusBoard()
+
+
+def format_sse(event_id: Optional[int], kind: str, data) -> str:
+    """Событие text/event-stream; сообщения сессии идут событием по умолчанию (onmessage)"""
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    if kind != EVENT_MESSAGE:
+        lines.append(f"event: {kind}")
+    text = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    lines.extend(f"data: {line}" for line in text.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+def create_status_routes(app: FastAPI, manager):
+    """Создает SSE и long-poll маршруты статуса сессии"""
+
+    async def attach_session(session_id: str):
+        """Находит существующую сессию (на этом или другом воркере) и продлевает ее; 404, если ее нет"""
+        if not await manager.ensure_session(session_id):
+            raise HTTPException(status_code=404, detail="Session not found")
+        manager.touch(session_id)
+
+    @app.post("/generation-status/{session_id}")
+    async def open_session_status(session_id: str):
+        """
+        Подключает сессию без WebSocket, если ее еще нет ни на одном воркере. Клиент вызывает его
+        перед /stream и /poll и повторяет, если они ответили 404 (сессия закрыта по неактивности).
+        """
+        if len(session_id) > MAX_SESSION_ID_LENGTH:
+            raise HTTPException(status_code=400, detail="Некорректный session_id")
+        if await manager.ensure_session(session_id):
+            manager.touch(session_id)
+        elif await manager.connect_stream_session(session_id) is None:
+            raise HTTPException(status_code=503, detail="Достигнут лимит сессий, повторите позже")
+        return {"session_id": session_id}
+
+    @app.get("/generation-status/{session_id}/stream")
+    async def stream_session_status(session_id: str, request: Request):
+        """
+        SSE: снимок статуса, затем его изменения, ход батчей и сообщения сессии (если у нее нет WebSocket).
+        После переподключения EventSource передает Last-Event-ID, и пропущенные события повторяются.
+        """
+        await attach_session(session_id)
+        last_event_id = request.headers.get("last-event-id", "")
+        version = int(last_event_id) if last_event_id.isdigit() else None
+
+        async def events():
+            nonlocal version
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            while True:
+                for event_id, kind, data in status_board.changes(session_id, version):
+                    yield format_sse(event_id, kind, data)
+                    version = event_id
+                if version is not None:
+                    # События записаны в поток - их сообщения доставлены
+                    status_board.acknowledge(session_id, version)
+                changed = await status_board.wait(session_id, version, SSE_KEEPALIVE_SECONDS)
+                if session_id not in manager.user_sessions:
+                    yield format_sse(None, EVENT_CLOSED, {"session_id": session_id})
+                    return
+                if not changed:
+                    # Комментарий не дает прокси закрыть соединение и продлевает сессию
+                    manager.touch(session_id)
+                    yield ": keepalive\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.get("/generation-status/{session_id}/poll")
+    async def poll_session_status(session_id: str, request: Request, version: Optional[int] = None,
+                                  timeout: float = LONG_POLL_TIMEOUT):
+        """
+        Long-poll: ждет до timeout секунд версию статуса больше version (или ETag из If-None-Match)
+        и возвращает события после нее; без изменений - 304. Без version сразу возвращает снимок статуса.
+        """
+        await attach_session(session_id)
+        if version is None:
+            etag = request.headers.get("if-none-match", "").removeprefix("W/").strip('"')
+            version = int(etag) if etag.isdigit() else None
+        if version is not None:
+            status_board.acknowledge(session_id, version)
+            changed = await status_board.wait(session_id, version, max(0.0, min(timeout, LONG_POLL_TIMEOUT)))
+            if session_id not in manager.user_sessions:
+                return JSONResponse({"version": version, "closed": True, "events": []})
+            manager.touch(session_id)
+            if not changed:
+                return Response(status_code=304, headers={"ETag": f'"{version}"', "Cache-Control": "no-cache"})
+
+        events = status_board.changes(session_id, version)
+        current = events[-1][0] if events else version
+        return JSONResponse({
+            "version": current,
+            "closed": session_id not in manager.user_sessions,
+            "events": [{"id": event_id, "type": kind, "data": data} for event_id, kind, data in events]
+        }, headers={"ETag": f'"{current}"', "Cache-Control": "no-cache"})
@@ -0,0 +1,195 @@
+import os
+import time
+import asyncio
+import logging
+import gzip
+import hashlib
+import mimetypes
+from typing import Dict, Optional
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, FileResponse
+
+from config import STATIC_MEMORY_FILE_LIMIT
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # brotli - необязательная зависимость, без нее отдаем только gzip
+    brotli = None
+
+# Хешированные файлы сборки React (static/js/main.1a2b3c.js) можно кешировать навсегда
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Остальные файлы (index.html, favicon.ico, manifest.json) проверяются по ETag
+REVALIDATE_CACHE_CONTROL = "no-cache"
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml", "application/xml")
+MIN_COMPRESS_SIZE = 1024
+ENCODING_ETAG_SUFFIXES = {"br": "br", "gzip": "gz"}  # Суффикс ETag сжатого варианта: "<хеш>-br"
+
+
+class StaticAsset:
+    """
+    Файл сборки фронтенда: метаданные и, для небольших файлов, содержимое. Сжатые варианты
+    строятся вызовом compress() после запуска; до этого файл отдается без сжатия.
+    """
+
+    __slots__ = ("path", "stat", "content_type", "etag", "cache_control", "body", "gzip", "br")
+
+    def __init__(self, path: str, rel_path: str, memory_limit: int):
+        self.path = path
+        self.stat = os.stat(path)
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if rel_path.startswith("static/") else REVALIDATE_CACHE_CONTROL
+        self.body = None
+        self.gzip = None
+        self.br = None
+
+        if self.stat.st_size > memory_limit:
+            self.etag = f'"{self.stat.st_size:x}-{self.stat.st_mtime_ns:x}"'
+            return
+
+        with open(path, "rb") as f:
+            self.body = f.read()
+        self.etag = f'"{hashlib.blake2b(self.body, digest_size=16).hexdigest()}"'
+
+    @property
+    def compressible(self) -> bool:
+        return (self.body is not None and len(self.body) >= MIN_COMPRESS_SIZE
+                and self.content_type.startswith(COMPRESSIBLE_TYPES))
+
+    def compress(self):
+        """Строит gzip и brotli варианты с максимальным сжатием (блокирующая, вызывать в потоке)"""
+        if not self.compressible:
+            return
+        compressed = gzip.compress(self.body, compresslevel=9)
+        if len(compressed) < len(self.body):
+            self.gzip = compressed
+        if brotli is not None:
+            compressed = brotli.compress(self.body, quality=11)
+            if len(compressed) < len(self.body):
+                self.br = compressed
+
+
+def _accepted_encodings(request: Request):
+    """Возвращает кодировки из Accept-Encoding, которые клиент не запретил (q=0)"""
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Проверяет If-None-Match: клиент уже имеет актуальную версию"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+class FrontendAssets:
+    """
+    Индекс сборки фронтенда, построенный один раз при запуске.
+    Небольшие файлы хранятся в памяти, сжатые gzip/brotli варианты строятся в фоне после
+    запуска (precompress), запросы обслуживаются без обращения к файловой системе.
+    """
+
+    def __init__(self, build_path: str, memory_limit: int = STATIC_MEMORY_FILE_LIMIT):
+        self.build_path = build_path
+        self.assets: Dict[str, StaticAsset] = {}
+
+        for root, _, files in os.walk(build_path):
+            for name in files:
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, build_path).replace(os.sep, "/")
+                self.assets[rel_path] = StaticAsset(path, rel_path, memory_limit)
+
+        self.index_html = self.assets.get("index.html")
+
+    def precompress(self):
+        """Сжимает файлы в памяти, начиная с index.html (блокирующая, вызывать в потоке)"""
+        started = time.perf_counter()
+        assets = sorted(self.assets.values(), key=lambda asset: asset is not self.index_html)
+        for asset in assets:
+            asset.compress()
+        logger.info("Фронтенд: сжатые варианты построены за %.1f с", time.perf_counter() - started)
+
+    def get(self, rel_path: str) -> Optional[StaticAsset]:
+        return self.assets.get(rel_path.lstrip("/"))
+
+    def response(self, request: Request, asset: StaticAsset) -> Response:
+        """
+        Отдает файл с заголовками кеширования, поддержкой 304 и сжатием. У каждого варианта
+        (без сжатия, gzip, br) свой ETag: байты вариантов различаются, а кеш по Vary может
+        проверить сохраненный вариант.
+        """
+        body = asset.body
+        encoding = None
+        if body is not None:
+            accepted = _accepted_encodings(request)
+            if asset.br is not None and "br" in accepted:
+                body, encoding = asset.br, "br"
+            elif asset.gzip is not None and "gzip" in accepted:
+                body, encoding = asset.gzip, "gzip"
+
+        etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{ENCODING_ETAG_SUFFIXES[encoding]}"'
+        headers = {
+            "cache-control": asset.cache_control,
+            "etag": etag,
+            "vary": "Accept-Encoding"
+        }
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+
+        if body is None:
+            return FileResponse(asset.path, media_type=asset.content_type, headers=headers, stat_result=asset.stat)
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+        return Response(content=body, media_type=asset.content_type, headers=headers)
+
+
+def create_static_routes(app: FastAPI, build_path: str):
+    """Создает маршруты фронтенда. Регистрировать последними: маршрут SPA перехватывает все GET запросы"""
+    if not os.path.exists(build_path):
+        @app.get("/")
+        async def root():
+            return {"message": "Bitrix24 Contacts API", "frontend": "Not built yet. Run 'npm run build' in frontend directory"}
+
+        @app.get("/favicon.ico")
+        async def favicon():
+            return {"message": "No favicon"}
+
+        return None
+
+    assets = FrontendAssets(build_path)
+    logger.info("📁 Фронтенд: %d файлов, в памяти %d", len(assets.assets),
+                sum(1 for asset in assets.assets.values() if asset.body is not None))
+
+    @app.on_event("startup")
+    async def precompress_frontend():
+        # Сжатие с максимальным уровнем не задерживает запуск: сервер уже принимает запросы
+        asyncio.create_task(asyncio.to_thread(assets.precompress))
+
+    @app.get("/favicon.ico")
+    async def favicon(request: Request):
+        """Обслуживание favicon"""
+        asset = assets.get("favicon.ico")
+        if asset is None:
+            return {"message": "No favicon"}
+        return assets.response(request, asset)
+
+    @app.get("/{full_path:path}")
+    async def serve_frontend_routes(request: Request, full_path: str):
+        """Обслуживание файлов сборки и всех маршрутов React приложения (SPA)"""
+        asset = assets.get(full_path) if full_path else None
+        if asset is None:
+            asset = assets.index_html
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Not found")
+        return assets.response(request, asset)
+
+    return assets
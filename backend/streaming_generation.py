@@ -0,0 +1,155 @@
+"""
+Потоковый режим генерации для больших запусков.
+
+Обычный запуск держит все ID в списках, строит список пар целиком и собирает все
+загруженные компании и контакты перед отправкой результата, поэтому память растет
+вместе с NUM_CONTACTS. Здесь каждый этап - поток батчей run_batches:
+  - синтез и создание: данные синтезируются на батч и сразу отправляются;
+  - ID хранятся в колонках array('q') (8 байт на запись вместо ~36 в списке);
+  - пары - позиции в перемешанных колонках, успешные привязки отмечаются в bytearray;
+  - результат загружается батчами и отправляется частями по STREAM_RESULT_CHUNK компаний.
+В памяти одновременно находятся только колонки ID, текущий батч и одна часть результата.
+"""
+
+import random
+import asyncio
+import logging
+from array import array
+from typing import Awaitable, Callable, Optional
+
+from batch_runner import BatchResult, run_batches
+from bitrix_api import execute_batch_request
+from config import STREAM_RESULT_CHUNK
+from crm_mirror import crm_mirror, CONTACT_SELECT, COMPANY_SELECT
+from data_generator import create_companies_records, create_contacts_records, update_contacts_company_batch
+from message_encoding import encode_result_chunk, ENCODING_JSON
+from result_builder import build_company_records
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+def _select_query(select):
+    return "&".join(f"select[{i}]={field}" for i, field in enumerate(select))
+
+
+COMPANY_GET_QUERY = _select_query(COMPANY_SELECT)
+CONTACT_GET_QUERY = _select_query(CONTACT_SELECT)
+
+
+def _import_ids(create_records):
+    def execute(batch):
+        created = create_records(len(batch))
+        return BatchResult((record_id for record_id, _ in created if record_id), skipped=getattr(created, "skipped", 0))
+    return execute
+
+
+async def run_streaming_generation(num_contacts: int, num_companies: int,
+                                   send: Callable[[str], Awaitable[None]],
+                                   before_batch: Optional[Callable[[], Awaitable[None]]] = None,
+                                   on_phase: Optional[Callable[[str], None]] = None,
+                                   session_id: str = "", encoding: str = ENCODING_JSON,
+                                   pause: float = 0.2, chunk_size: int = STREAM_RESULT_CHUNK) -> dict:
+    """
+    Создает контакты и компании, привязывает их 1 к 1 и отправляет результат частями через send.
+    Возвращает статистику запуска.
+    """
+    def phase(name):
+        if on_phase is not None:
+            on_phase(name)
+
+    # Создание: ID сразу дописываются в колонки
+    contact_ids = array("q")
+    company_ids = array("q")
+    phase("contacts")
+    with tracer.span("phase.contacts", count=num_contacts):
+        await run_batches(
+            range(num_contacts), "contact_import", _import_ids(create_contacts_records),
+            before_batch=before_batch, on_result=lambda batch, ids: contact_ids.extend(ids),
+            label="Создаем контакты", session_id=session_id, pause=pause, collect=False
+        )
+    logger.info("Создано контактов: %d", len(contact_ids))
+
+    phase("companies")
+    with tracer.span("phase.companies", count=num_companies):
+        await run_batches(
+            range(num_companies), "company_import", _import_ids(create_companies_records),
+            before_batch=before_batch, on_result=lambda batch, ids: company_ids.extend(ids),
+            label="Создаем компании", session_id=session_id, pause=pause, collect=False
+        )
+    logger.info("Создано компаний: %d", len(company_ids))
+
+    # Пары 1 к 1 - одинаковые позиции в перемешанных колонках, отдельный список пар не строится
+    phase("links")
+    random.shuffle(contact_ids)
+    random.shuffle(company_ids)
+    pairs = min(len(contact_ids), len(company_ids))
+    linked = bytearray(pairs)
+
+    def link_positions(positions):
+        batch_links = [(contact_ids[i], company_ids[i]) for i in positions]
+        # Ключи успешных команд имеют вид update_{индекс в пачке}
+        return [positions[int(key.split("_")[1])] for key in update_contacts_company_batch(batch_links)]
+
+    async def on_linked(positions, done):
+        for position in done:
+            linked[position] = 1
+        if crm_mirror is not None:
+            await asyncio.to_thread(crm_mirror.set_contacts_company, [(contact_ids[i], company_ids[i]) for i in done])
+
+    with tracer.span("phase.links", count=pairs):
+        await run_batches(
+            range(pairs), "contact_link", link_positions, before_batch=before_batch, on_result=on_linked,
+            label="Привязываем контакты", session_id=session_id, pause=pause, collect=False,
+            idempotent=True
+        )
+    successful_links = sum(linked)
+    logger.info("Успешно привязано: %d", successful_links)
+
+    # Результат: компании загружаются батчами вместе со своими контактами и отправляются частями
+    phase("readback")
+    chunk = []
+    sent = 0
+
+    async def flush():
+        nonlocal chunk, sent
+        await send(encode_result_chunk(chunk, sent, encoding))
+        sent += len(chunk)
+        chunk = []
+
+    async def before_readback():
+        if before_batch is not None:
+            await before_batch()
+        if len(chunk) >= chunk_size:
+            await flush()
+
+    def fetch_positions(positions):
+        companies = execute_batch_request({
+            f"company_{company_ids[i]}": f"crm.company.get?id={company_ids[i]}&{COMPANY_GET_QUERY}" for i in positions
+        }, "компании")
+        contact_positions = [i for i in positions if i < pairs and linked[i]]
+        contacts = execute_batch_request({
+            f"contact_{contact_ids[i]}": f"crm.contact.get?id={contact_ids[i]}&{CONTACT_GET_QUERY}"
+            for i in contact_positions
+        }, "контакты") if contact_positions else {}
+        if crm_mirror is not None:
+            crm_mirror.upsert_companies(companies.values())
+            crm_mirror.upsert_contacts(contacts.values())
+        return build_company_records(companies, contacts)
+
+    with tracer.span("phase.readback", companies=len(company_ids)):
+        await run_batches(
+            range(len(company_ids)), "company_get", fetch_positions, before_batch=before_readback,
+            on_result=lambda positions, records: chunk.extend(records),
+            label="Загружаем результат", session_id=session_id, pause=pause / 2, collect=False,
+            idempotent=True
+        )
+        if chunk:
+            await flush()
+
+    return {
+        "contacts_created": len(contact_ids),
+        "companies_created": len(company_ids),
+        "successful_links": successful_links,
+        "companies_sent": sent
+    }
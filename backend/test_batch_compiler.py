@@ -0,0 +1,103 @@
+"""
+Тесты компилятора batch запросов: кодирование параметров, порядок операций
+по зависимостям и подстановка $result.
+"""
+
+import pytest
+
+from batch_compiler import (DEPENDENCY_FAILED, Operation, Ref, compile_batches, compile_commands,
+                            encode_params, execute_operations, order_operations)
+
+
+def test_encode_params_like_http_build_query():
+    query = encode_params({
+        "fields": {"NAME": "Иван Петров", "PHONE": [{"VALUE": "+7 900", "VALUE_TYPE": "WORK"}], "OPENED": True,
+                   "COMMENTS": None},
+        "id": 5
+    })
+    assert query == ("fields[NAME]=%D0%98%D0%B2%D0%B0%D0%BD%20%D0%9F%D0%B5%D1%82%D1%80%D0%BE%D0%B2"
+                     "&fields[PHONE][0][VALUE]=%2B7%20900&fields[PHONE][0][VALUE_TYPE]=WORK"
+                     "&fields[OPENED]=Y&id=5")
+
+
+def test_encode_params_keeps_ref_unquoted():
+    assert encode_params({"fields": {"COMPANY_ID": Ref("company_0")}}) == "fields[COMPANY_ID]=$result[company_0]"
+    assert Ref("list", 0, "ID").expression() == "$result[list][0][ID]"
+
+
+def test_operation_rejects_bad_key():
+    with pytest.raises(ValueError):
+        Operation("company 0", "crm.company.add")
+
+
+def test_order_puts_dependencies_first_and_keeps_order():
+    contact = Operation("contact_0", "crm.contact.add", {"fields": {"COMPANY_ID": Ref("company_0")}})
+    other = Operation("contact_1", "crm.contact.add")
+    company = Operation("company_0", "crm.company.add")
+    assert [op.key for op in order_operations([contact, other, company])] == ["company_0", "contact_0", "contact_1"]
+
+
+def test_order_rejects_cycles_and_unknown_refs():
+    a = Operation("a", "m", {"x": Ref("b")})
+    b = Operation("b", "m", {"x": Ref("a")})
+    with pytest.raises(ValueError, match="Циклическая"):
+        order_operations([a, b])
+    with pytest.raises(ValueError, match="неизвестную"):
+        order_operations([a])
+    assert order_operations([a], known=["b"]) == [a]
+
+
+def test_compile_batches_splits_in_dependency_order():
+    operations = [Operation(f"op_{i}", "m") for i in range(5)]
+    assert [[op.key for op in batch] for batch in compile_batches(operations, max_commands=2)] == [
+        ["op_0", "op_1"], ["op_2", "op_3"], ["op_4"]
+    ]
+    with pytest.raises(ValueError):
+        compile_commands([Operation(f"op_{i}", "m") for i in range(51)])
+
+
+def test_compile_commands_chains_result():
+    commands = compile_commands([
+        Operation("contact_0", "crm.contact.add", {"fields": {"COMPANY_ID": Ref("company_0")}}),
+        Operation("company_0", "crm.company.add", {"fields": {"TITLE": "A"}})
+    ])
+    assert list(commands) == ["company_0", "contact_0"]
+    assert commands["contact_0"] == "crm.contact.add?fields[COMPANY_ID]=$result[company_0]"
+
+
+def test_execute_resolves_refs_from_previous_call():
+    sent = []
+
+    def send(commands):
+        sent.append(commands)
+        return {"result": {"result": {key: 100 + len(sent) for key in commands}, "result_error": []}}
+
+    operations = [Operation("company_0", "crm.company.add"),
+                  Operation("contact_0", "crm.contact.add", {"fields": {"COMPANY_ID": Ref("company_0")}})]
+    results, errors = execute_operations(operations, send=send, max_commands=1)
+    assert errors == {}
+    assert results == {"company_0": 101, "contact_0": 102}
+    assert sent[1] == {"contact_0": "crm.contact.add?fields[COMPANY_ID]=101"}
+
+
+def test_execute_marks_dependents_of_failed_operation():
+    def send(commands):
+        result = {key: 1 for key in commands if key != "company_0"}
+        errors = {"company_0": {"error": "ERROR"}} if "company_0" in commands else []
+        return {"result": {"result": result, "result_error": errors}}
+
+    operations = [Operation("company_0", "crm.company.add"),
+                  Operation("contact_0", "crm.contact.add", {"fields": {"COMPANY_ID": Ref("company_0")}}),
+                  Operation("contact_1", "crm.contact.add", {"fields": {"COMPANY_ID": Ref("company_0")}})]
+    # contact_0 в том же вызове, что и компания, contact_1 - в следующем
+    results, errors = execute_operations(operations, send=send, max_commands=2)
+    assert results == {}
+    assert errors["company_0"] == {"error": "ERROR"}
+    assert errors["contact_0"]["error"] == DEPENDENCY_FAILED and errors["contact_0"]["result"] == 1
+    assert errors["contact_1"]["error"] == DEPENDENCY_FAILED
+
+
+def test_execute_reports_failed_call():
+    results, errors = execute_operations([Operation("a", "m")], send=lambda commands: None)
+    assert results == {}
+    assert errors["a"]["error"] == "BATCH_FAILED"
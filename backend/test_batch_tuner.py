@@ -0,0 +1,122 @@
+"""
+Тесты подбора размера батча (AIMD), хранилища подобранных размеров и run_batches.
+"""
+
+import asyncio
+
+from batch_runner import BatchResult, flatten, run_batches
+from batch_tuner import BatchTuner, BatchTuningStore
+
+
+def make_tuner(**kwargs):
+    options = dict(initial=20, min_size=5, max_size=50, step=5, max_error_rate=0.1, max_call_seconds=10,
+                   enabled=True)
+    options.update(kwargs)
+    return BatchTuner("test", **options)
+
+
+def test_size_grows_while_latency_per_item_holds():
+    tuner = make_tuner()
+    for _ in range(10):
+        tuner.record(tuner.size, tuner.size * 0.01, 0)
+    assert tuner.size == 50  # Не больше max_size
+
+
+def test_size_steps_back_when_latency_per_item_grows():
+    tuner = make_tuner()
+    tuner.record(20, 0.2, 0)
+    assert tuner.size == 25
+    tuner.record(25, 0.5, 0)  # 20 мс на элемент вместо 10
+    assert tuner.size == 20
+
+
+def test_size_halves_on_errors_or_slow_call():
+    tuner = make_tuner(initial=40)
+    tuner.record(40, 0.4, 10)
+    assert tuner.size == 20
+    tuner.record(20, 11, 0)
+    assert tuner.size == 10
+    tuner.record(10, 11, 0)
+    assert tuner.size == 5  # Не меньше min_size
+    assert tuner.get_stats()["failures"] == 10
+
+
+def test_partial_last_batch_does_not_change_size():
+    tuner = make_tuner()
+    tuner.record(7, 0.07, 0)
+    assert tuner.size == 20
+
+
+def test_disabled_tuner_keeps_size():
+    tuner = make_tuner(enabled=False)
+    tuner.record(20, 20, 20)
+    assert tuner.size == 20 and tuner.calls == 1
+
+
+def test_store_restores_saved_size(tmp_path):
+    path = str(tmp_path / "batch_tuning.json")
+    store = BatchTuningStore(path=path, portal="portal.example")
+    tuner = store.tuner("contact_import")
+    tuner.size = 35
+    tuner.record(10, 1.0, 0)
+    store.save(tuner)
+
+    restored = BatchTuningStore(path=path, portal="portal.example")
+    assert restored.tuner("contact_import").size == 35
+    assert restored.get_saved("contact_import")["avg_call_seconds"] == 1.0
+    assert BatchTuningStore(path=path, portal="other.example").get_saved("contact_import") == {}
+
+
+def test_run_batches_retries_idempotent_batch_smaller():
+    tuner = make_tuner(initial=10, min_size=5)
+    calls = []
+    failed = []
+
+    def execute(batch):
+        calls.append(list(batch))
+        return None if len(batch) > 5 or 11 in batch else [item * 2 for item in batch]
+
+    async def on_result(batch, result):
+        await asyncio.sleep(0)
+
+    results = asyncio.run(run_batches(range(15), "test", execute, on_result=on_result, pause=0, tuner=tuner,
+                                      on_failure=failed.append, idempotent=True))
+    # Первый батч из 10 не прошел и повторен по 5; батч с 11 при минимальном размере пропущен
+    assert calls[0] == list(range(10))
+    assert calls[1] == list(range(5))
+    assert failed == [[10, 11, 12, 13, 14]]
+    assert flatten(results) == [item * 2 for item in range(10)]
+
+
+def test_run_batches_does_not_resend_failed_import():
+    tuner = make_tuner(initial=10, min_size=5)
+    calls = []
+    failed = []
+
+    def execute(batch):
+        calls.append(list(batch))
+        return None if 3 in batch else list(batch)
+
+    results = asyncio.run(run_batches(range(15), "contact_import", execute, pause=0, tuner=tuner,
+                                      on_failure=failed.append))
+    # Портал мог создать записи несмотря на ошибку - батч не отправляется повторно
+    assert failed == [list(range(10))]
+    assert calls == [list(range(10)), list(range(10, 15))]
+    assert flatten(results) == list(range(10, 15))
+
+
+def test_run_batches_skipped_items_are_not_failures():
+    tuner = make_tuner(initial=10, min_size=5)
+    failed = []
+
+    def execute(batch):
+        # Первый батч - одни дубли, во втором половина пропущена
+        if batch[0] == 0:
+            return BatchResult(skipped=len(batch))
+        return BatchResult(batch[:5], skipped=5)
+
+    results = asyncio.run(run_batches(range(20), "contact_import", execute, pause=0, tuner=tuner,
+                                      on_failure=failed.append))
+    assert failed == []
+    assert tuner.failures == 0 and tuner.calls == 1
+    assert flatten(results) == list(range(10, 15))
@@ -0,0 +1,131 @@
+"""
+Тесты массового импорта: чтение файлов, соответствие колонок, поля batchImport и ключи дублей.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+import bulk_import
+from bulk_import import BulkImporter, ImportRefs, _multifield, read_rows, resolve_mapping
+from dedup_index import DedupIndex
+
+
+@pytest.fixture
+def importer(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_import, "ImportRefs", lambda job_id: ImportRefs(job_id, str(tmp_path)))
+    monkeypatch.setattr(bulk_import, "dedup_index", DedupIndex(mode="skip", default_country="7"))
+    created = []
+
+    def make(entity):
+        instance = BulkImporter(entity, "test-job")
+        created.append(instance)
+        return instance
+
+    yield make
+    for instance in created:
+        instance.refs.close()
+
+
+def test_multifield_splits_on_semicolon_only():
+    assert _multifield("+7 912 345-67-89; a@b.ru ;") == [
+        {"VALUE": "+7 912 345-67-89", "VALUE_TYPE": "WORK"}, {"VALUE": "a@b.ru", "VALUE_TYPE": "WORK"}
+    ]
+    # Запятая бывает внутри номера с добавочным
+    assert _multifield("+7 495 123-45-67, доб. 12") == [{"VALUE": "+7 495 123-45-67, доб. 12", "VALUE_TYPE": "WORK"}]
+    assert _multifield(["1", 2, " "]) == [{"VALUE": "1", "VALUE_TYPE": "WORK"}, {"VALUE": "2", "VALUE_TYPE": "WORK"}]
+
+
+def test_resolve_mapping_prefers_explicit_columns():
+    columns = ["id", "name", "surname", "Телефон"]
+    assert resolve_mapping("contacts", columns, {"PHONE": "Телефон"}) == {
+        "REF": "id", "NAME": "name", "LAST_NAME": "surname", "PHONE": "Телефон"
+    }
+    with pytest.raises(ValueError):
+        resolve_mapping("contacts", columns, {"EMAIL": "email"})
+    assert "EMAIL" not in resolve_mapping("contacts", columns, {"EMAIL": "email"}, strict=False)
+
+
+def test_read_rows_sniffs_delimiter_and_strips_bom(tmp_path):
+    path = tmp_path / "contacts.csv"
+    path.write_text("\ufeffname;surname;phone\nИван;Петров;+7 912 345-67-89\n", encoding="utf-8")
+    assert list(read_rows(str(path), "csv")) == [{"name": "Иван", "surname": "Петров", "phone": "+7 912 345-67-89"}]
+
+    path = tmp_path / "contacts.jsonl"
+    path.write_text('{"name": "Иван"}\n\n{"name": "Анна"}\n', encoding="utf-8")
+    assert list(read_rows(str(path), "jsonl")) == [{"name": "Иван"}, {"name": "Анна"}]
+
+
+def test_map_rows_builds_fields_and_resolves_company_refs(importer):
+    companies = importer("companies")
+    companies.refs.put_many([("c1", 501)])
+    contacts = importer("contacts")
+
+    rows = [
+        {"id": "p1", "name": "Иван", "surname": "Петров", "phone": "+79123456789;8 912 000 00 00", "company_ref": "c1"},
+        {"id": "p2", "name": "", "surname": "", "phone": "+79123456780"},
+        {"name": "Анна", "company_ref": "unknown"},
+    ]
+    items = list(contacts.map_rows(iter(rows)))
+    assert items == [
+        ("p1", {"NAME": "Иван", "LAST_NAME": "Петров", "COMPANY_ID": 501,
+                "PHONE": [{"VALUE": "+79123456789", "VALUE_TYPE": "WORK"},
+                          {"VALUE": "8 912 000 00 00", "VALUE_TYPE": "WORK"}]}),
+        (None, {"NAME": "Анна"})
+    ]
+    assert contacts.stats["rows"] == 3
+    assert contacts.stats["skipped"] == 1
+    assert contacts.stats["unresolved_company_refs"] == 1
+
+
+def test_dedupe_and_release_keys(importer):
+    contacts = importer("contacts")
+    bulk_import.dedup_index.load([{"ID": "7", "EMAIL": [{"VALUE": "old@b.ru"}]}], "test")
+    items = [
+        ("1", {"NAME": "A", "EMAIL": _multifield("old@b.ru")}),
+        ("2", {"NAME": "B", "EMAIL": _multifield("new@b.ru")}),
+        ("3", {"NAME": "C", "EMAIL": _multifield("NEW@b.ru")}),
+    ]
+    assert [ref for ref, _ in contacts.dedupe(iter(items))] == ["2"]
+    assert contacts.stats["duplicates"] == 2
+
+    # Батч не прошел - его строки покидают импорт, и повтор той же строки уже не считается дублем
+    contacts.release_keys([items[1]])
+    assert [ref for ref, _ in contacts.dedupe(iter(items[2:]))] == ["3"]
+
+
+def test_execute_adds_created_contacts_to_index(importer, monkeypatch):
+    contacts = importer("contacts")
+    monkeypatch.setattr(bulk_import, "bx_batch_import", lambda entity_type, items: {
+        "items": [{"item": {"id": 10}}, {"error": "ERROR"}]
+    })
+    batch = [("1", {"NAME": "A", "EMAIL": _multifield("a@b.ru")}), ("2", {"NAME": "B", "EMAIL": _multifield("b@b.ru")})]
+    list(contacts.dedupe(iter(batch)))
+
+    assert contacts.execute(batch) == [("1", 10)]
+    assert bulk_import.dedup_index.find({"EMAIL": _multifield("a@b.ru")}) == 10
+    assert contacts.in_flight == set()
+
+
+def test_run_parses_and_merges_off_event_loop(importer, monkeypatch, tmp_path):
+    monkeypatch.setattr(bulk_import, "dedup_index", DedupIndex(mode="merge", default_country="7"))
+    bulk_import.dedup_index.load([{"ID": "7", "EMAIL": [{"VALUE": "old@b.ru"}]}], "test")
+    loop_thread = threading.get_ident()
+    merge_threads = []
+
+    def execute_operations(operations):
+        merge_threads.append(threading.get_ident())
+        return {operation.key: True for operation in operations}, {}
+
+    monkeypatch.setattr(bulk_import, "execute_operations", execute_operations)
+    monkeypatch.setattr(bulk_import, "bx_batch_import", lambda entity_type, items: {
+        "items": [{"item": {"id": 100 + i}} for i in range(len(items))]
+    })
+    path = tmp_path / "contacts.csv"
+    path.write_text("name,surname,email,phone\nА,Б,old@b.ru,+79123456789\nВ,Г,new@b.ru,\n", encoding="utf-8")
+
+    stats = asyncio.run(importer("contacts").run(str(path), "csv"))
+    assert (stats["created"], stats["duplicates"], stats["merged"]) == (1, 1, 1)
+    assert merge_threads and loop_thread not in merge_threads
+    assert bulk_import.dedup_index.find({"PHONE": _multifield("+79123456789")}) == 7
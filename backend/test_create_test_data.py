@@ -0,0 +1,23 @@
+"""
+Тесты запроса создания тестовых данных: параметры прогноза не принимаются настоящим запуском.
+"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from models import CreateTestDataRequest
+
+
+@pytest.mark.parametrize("fields", [{"num_contacts": 10}, {"num_companies": 0}, {"call_ms": 50}])
+def test_real_run_rejects_plan_only_fields(fields, monkeypatch):
+    started = []
+    monkeypatch.setattr(main.manager, "start_generation_for_session", started.append)
+    request = CreateTestDataRequest(session_id="s1", **fields)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.run_test_data_generation(request))
+    assert error.value.status_code == 400
+    assert started == []
@@ -0,0 +1,63 @@
+"""
+Тесты выгрузки портала: команды страниц с $result, сборка страниц и каталог задания.
+"""
+
+import os
+
+import pytest
+
+import crm_export
+from crm_export import PAGE_SIZE, build_page_commands, collect_pages, job_directory
+
+
+def page(first_id, count=PAGE_SIZE):
+    return [{"ID": str(first_id + i)} for i in range(count)]
+
+
+def test_build_page_commands_chains_last_id():
+    commands = build_page_commands("crm.contact.list", 120, 3)
+    assert list(commands) == ["page_0", "page_1", "page_2"]
+    assert commands["page_0"].startswith("crm.contact.list?order[ID]=ASC&filter[>ID]=120&")
+    assert f"filter[>ID]=$result[page_0][{PAGE_SIZE - 1}][ID]&" in commands["page_1"]
+    assert f"filter[>ID]=$result[page_1][{PAGE_SIZE - 1}][ID]&" in commands["page_2"]
+    assert all(command.endswith("&start=-1") for command in commands.values())
+
+
+def test_collect_full_pages_continues():
+    results = {"page_0": page(1), "page_1": page(51)}
+    rows, last_id, done = collect_pages(results, {}, 2, 0)
+    assert len(rows) == 2 * PAGE_SIZE
+    assert (last_id, done) == (100, False)
+
+
+def test_collect_stops_at_short_page_and_drops_restarted_pages():
+    # После неполной страницы Битрикс24 выполнил следующую с пустым фильтром - с начала таблицы
+    results = {"page_0": page(1), "page_1": page(51, 10), "page_2": page(1)}
+    rows, last_id, done = collect_pages(results, {}, 3, 0)
+    assert [row["ID"] for row in rows] == [str(i) for i in range(1, 61)]
+    assert (last_id, done) == (60, True)
+
+
+def test_collect_empty_page_finishes():
+    assert collect_pages({"page_0": []}, {}, 2, 75) == ([], 75, True)
+
+
+def test_collect_rejects_errors_and_rewinds():
+    with pytest.raises(RuntimeError, match="Ошибка страницы"):
+        collect_pages({}, {"page_0": "QUERY_LIMIT_EXCEEDED"}, 1, 0)
+    with pytest.raises(RuntimeError, match="вернулась"):
+        collect_pages({"page_0": page(1)}, {}, 1, 50)
+
+
+def test_job_directory_stays_inside_export_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(crm_export, "EXPORT_DIR", str(tmp_path))
+    assert job_directory("job-1_a") == os.path.join(os.path.realpath(tmp_path), "job-1_a")
+    for job_id in (".", "..", "a/b", "", "x" * 65):
+        with pytest.raises(ValueError):
+            job_directory(job_id)
+
+    outside = tmp_path.parent / f"{tmp_path.name}-outside"
+    outside.mkdir()
+    (tmp_path / "link").symlink_to(outside)
+    with pytest.raises(ValueError):
+        job_directory("link")
@@ -0,0 +1,52 @@
+"""
+Тесты маршрутов зеркала CRM: запуск полной синхронизации и чтение вне event loop.
+"""
+
+import asyncio
+import threading
+
+import pytest
+from fastapi import FastAPI, HTTPException
+
+import crm_mirror
+from crm_mirror import CrmMirror
+
+
+def route(app, path, method):
+    for item in app.routes:
+        if getattr(item, "path", None) == path and method in item.methods:
+            return item.endpoint
+    raise KeyError(path)
+
+
+def test_mirror_sync_is_claimed_before_task_starts(tmp_path, monkeypatch):
+    mirror = CrmMirror(str(tmp_path / "mirror.sqlite3"))
+    release = threading.Event()
+    runs = []
+
+    def full_sync():
+        runs.append(threading.get_ident())
+        release.wait(5)
+        return {"companies": 0, "contacts": 0}
+
+    monkeypatch.setattr(mirror, "full_sync", full_sync)
+    monkeypatch.setattr(crm_mirror, "crm_mirror", mirror)
+    monkeypatch.setattr(crm_mirror.webhook_queue, "handlers", {})
+    app = FastAPI()
+    crm_mirror.create_mirror_routes(app)
+    mirror_sync = route(app, "/api/mirror/sync", "POST")
+    mirror_status = route(app, "/api/mirror/status", "GET")
+
+    async def check():
+        # Второй запрос приходит до того, как задача первого успела запуститься
+        assert await mirror_sync() == {"status": "started"}
+        with pytest.raises(HTTPException) as error:
+            await mirror_sync()
+        assert error.value.status_code == 409
+        assert (await mirror_status())["syncing"] is True
+        release.set()
+        while mirror.syncing:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(check())
+    assert len(runs) == 1 and runs[0] != threading.get_ident()
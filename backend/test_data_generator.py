@@ -0,0 +1,33 @@
+"""
+Тесты создания контактов с проверкой дублей.
+"""
+
+import data_generator
+from batch_runner import BatchResult
+from dedup_index import DedupIndex
+
+
+def contact(email):
+    return {"NAME": "Иван", "LAST_NAME": "Петров", "EMAIL": [{"VALUE": email, "VALUE_TYPE": "WORK"}]}
+
+
+def test_duplicates_are_skipped_not_sent(monkeypatch):
+    index = DedupIndex(mode="skip")
+    index.load([{"ID": "1", "EMAIL": [{"VALUE": "old@b.ru"}]}], "test")
+    sent = []
+    monkeypatch.setattr(data_generator, "dedup_index", index)
+    monkeypatch.setattr(data_generator, "build_contacts_payload",
+                        lambda count: [contact("old@b.ru"), contact("new@b.ru")][:count])
+    monkeypatch.setattr(data_generator, "bx_batch_import", lambda entity_type, data: sent.append(data) or {
+        "items": [{"item": {"id": 100 + i}} for i in range(len(data))]
+    })
+
+    records = data_generator.create_contacts_records(2)
+    assert isinstance(records, BatchResult)
+    assert records == [(100, contact("new@b.ru"))] and records.skipped == 1
+    assert index.find(contact("new@b.ru")) == 100
+
+    # Батч из одних дублей не отправляется
+    records = data_generator.create_contacts_records(1)
+    assert records == [] and records.skipped == 1
+    assert len(sent) == 1
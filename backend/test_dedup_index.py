@@ -0,0 +1,92 @@
+"""
+Тесты индекса дублей: нормализация ключей, поиск и слияние новых ключей с массивами.
+"""
+
+import random
+from array import array
+
+import dedup_index
+from dedup_index import DedupIndex, merge_sorted, normalize_email, normalize_phone
+
+
+def test_normalize_phone():
+    assert normalize_phone("8 (912) 345-67-89", "7") == "+79123456789"
+    assert normalize_phone("+7 912 345 67 89", "7") == "+79123456789"
+    assert normalize_phone("9123456789", "7") == "+79123456789"
+    assert normalize_phone("0049 30 1234567", "7") == "+49301234567"
+    assert normalize_phone("12-34", "7") is None
+
+
+def test_normalize_email():
+    assert normalize_email("  Ivan@Example.COM ") == "ivan@example.com"
+    assert normalize_email("not an email") is None
+
+
+def test_find_by_any_key_and_format():
+    index = DedupIndex(mode="skip", default_country="7")
+    index.load([{"ID": "10", "PHONE": [{"VALUE": "+79123456789"}], "EMAIL": [{"VALUE": "a@b.ru"}]},
+                {"ID": "11", "PHONE": '[{"VALUE": "8 912 000-00-00"}]'}], "test")
+    assert index.find({"PHONE": [{"VALUE": "8 (912) 345-67-89", "VALUE_TYPE": "WORK"}]}) == 10
+    assert index.find({"EMAIL": [{"VALUE": "A@B.RU"}]}) == 10
+    assert index.find({"PHONE": [{"VALUE": "+79120000000"}]}) == 11
+    assert index.find({"EMAIL": [{"VALUE": "c@d.ru"}]}) is None
+
+
+def test_load_keeps_first_contact_for_shared_key():
+    index = DedupIndex(mode="skip")
+    index.load([{"ID": "1", "EMAIL": [{"VALUE": "a@b.ru"}]}, {"ID": "2", "EMAIL": [{"VALUE": "a@b.ru"}]}], "test")
+    assert index.find({"EMAIL": [{"VALUE": "a@b.ru"}]}) == 1
+
+
+def test_unique_drops_duplicates_within_rows():
+    index = DedupIndex(mode="skip")
+    index.load([{"ID": "1", "EMAIL": [{"VALUE": "old@b.ru"}]}], "test")
+    rows = [{"EMAIL": [{"VALUE": "old@b.ru"}]}, {"EMAIL": [{"VALUE": "new@b.ru"}]},
+            {"EMAIL": [{"VALUE": "NEW@b.ru"}]}]
+    assert index.unique(rows) == [rows[1]]
+
+
+def test_merge_sorted_matches_sort_and_skips_known():
+    rng = random.Random(1)
+    existing = sorted(rng.sample(range(-10 ** 6, 10 ** 6), 1000))
+    hashes = array("q", existing)
+    ids = array("q", range(len(existing)))
+    pairs = sorted({key: -1 for key in rng.sample(range(-10 ** 6, 10 ** 6), 300) + existing[:5]}.items())
+
+    merged_hashes, merged_ids = merge_sorted(hashes, ids, pairs)
+
+    expected = dict(zip(existing, range(len(existing))))
+    for key, contact_id in pairs:
+        expected.setdefault(key, contact_id)
+    assert list(merged_hashes) == sorted(expected)
+    assert list(merged_ids) == [expected[key] for key in sorted(expected)]
+
+
+def test_compact_moves_recent_keys_into_arrays(monkeypatch):
+    monkeypatch.setattr(dedup_index, "MIN_RECENT_LIMIT", 3)
+    index = DedupIndex(mode="skip")
+    for contact_id in range(1, 5):
+        index.add(contact_id, {"EMAIL": [{"VALUE": f"user{contact_id}@b.ru"}]})
+
+    # Четвертый ключ превысил порог, и слияние выполнилось без event loop в этом же потоке
+    assert len(index._recent) == 0 and len(index._hashes) == 4
+    assert list(index._hashes) == sorted(index._hashes)
+    for contact_id in range(1, 5):
+        assert index.find({"EMAIL": [{"VALUE": f"user{contact_id}@b.ru"}]}) == contact_id
+    assert index.get_status()["keys"] == 4
+
+
+def test_load_keeps_keys_added_during_reload():
+    index = DedupIndex(mode="skip")
+    index.add(1, {"EMAIL": [{"VALUE": "before@b.ru"}]})
+
+    def rows():
+        yield {"ID": "10", "EMAIL": [{"VALUE": "loaded@b.ru"}]}
+        # Контакт создан батчем генерации, пока индекс перезагружается
+        index.add(2, {"EMAIL": [{"VALUE": "during@b.ru"}]})
+
+    index.load(rows(), "test")
+    assert index.find({"EMAIL": [{"VALUE": "loaded@b.ru"}]}) == 10
+    assert index.find({"EMAIL": [{"VALUE": "during@b.ru"}]}) == 2
+    assert index.find({"EMAIL": [{"VALUE": "before@b.ru"}]}) == 1
+    assert index._recent == {} and len(index._hashes) == 3
@@ -0,0 +1,61 @@
+"""
+Тесты локальной сборки результата: совпадение с результатом из Битрикс24 и проверка выборки.
+"""
+
+import local_results
+from local_results import LocalResultSet
+from result_builder import build_company_records
+
+COMPANY = {"TITLE": "ООО Ромашка", "PHONE": [{"VALUE": "+79120000000", "VALUE_TYPE": "WORK"}],
+           "EMAIL": [{"VALUE": "info@romashka.ru", "VALUE_TYPE": "WORK"}], "COMMENTS": "не входит в результат"}
+CONTACT = {"NAME": "Иван", "LAST_NAME": "Петров", "POST": "Менеджер",
+           "PHONE": [{"VALUE": "+79123456789", "VALUE_TYPE": "WORK"}], "EMAIL": []}
+
+
+def make_results():
+    results = LocalResultSet()
+    results.add_companies([(1, COMPANY), (2, {"TITLE": "ООО Лютик"})])
+    results.add_contacts([(10, CONTACT), (11, {"NAME": "Анна", "LAST_NAME": "Смирнова"})])
+    results.link([(10, 1), (11, 1), (11, None), (99, 2)])
+    return results
+
+
+def test_build_matches_readback():
+    # Те же записи в виде строк crm.company.get / crm.contact.get
+    companies = {"company_1": {"ID": "1", **COMPANY}, "company_2": {"ID": "2", "TITLE": "ООО Лютик"}}
+    contacts = {"contact_10": {"ID": "10", "COMPANY_ID": "1", **CONTACT},
+                "contact_11": {"ID": "11", "COMPANY_ID": None, "NAME": "Анна", "LAST_NAME": "Смирнова"}}
+    assert make_results().build() == build_company_records(companies, contacts)
+
+
+def test_link_applies_last_pair_and_ignores_unknown_contacts():
+    results = make_results()
+    assert results.contacts["10"]["COMPANY_ID"] == "1"
+    assert results.contacts["11"]["COMPANY_ID"] is None
+    assert "99" not in results.contacts
+    [company_1, company_2] = results.build()
+    assert [contact["id"] for contact in company_1["contacts"]] == [10]
+    assert company_2["contacts"] == []
+
+
+def test_verify_reports_mismatches(monkeypatch):
+    results = make_results()
+    sent = []
+
+    def execute_batch_request(commands, entity_type):
+        sent.append(commands)
+        remote = {f"company_{key}": dict(row) for key, row in results.companies.items()}
+        remote.update({f"contact_{key}": dict(row) for key, row in results.contacts.items()})
+        remote["company_2"]["TITLE"] = "Изменено"
+        del remote["contact_11"]
+        return remote
+
+    monkeypatch.setattr(local_results, "execute_batch_request", execute_batch_request)
+    report = results.verify(100)
+    assert report["checked"] == 4 and len(sent[0]) == 4
+    assert sorted(report["mismatches"], key=str) == [{"company": 2}, {"contact": 11}]
+
+
+def test_verify_empty_result_skips_call(monkeypatch):
+    monkeypatch.setattr(local_results, "execute_batch_request", lambda commands, entity_type: 1 / 0)
+    assert LocalResultSet().verify(10) == {"checked": 0, "mismatches": []}
@@ -0,0 +1,74 @@
+"""
+Тесты сверки привязок: расхождения плана с порталом, чтение COMPANY_ID и исправление.
+"""
+
+import asyncio
+from urllib.parse import unquote
+
+import reconciliation
+from batch_tuner import BatchTuner, batch_tuning
+from reconciliation import diff_links, list_contact_companies, reconcile_links
+
+
+def test_diff_links_kinds():
+    planned = {1: 10, 2: 20, 3: 30, 4: 40}
+    actual = {1: 10, 2: None, 3: 31}
+    assert diff_links(planned, actual) == [
+        {"contact_id": 2, "company_id": 20, "actual": None, "kind": "unlinked"},
+        {"contact_id": 3, "company_id": 30, "actual": 31, "kind": "wrong_company"},
+        {"contact_id": 4, "company_id": 40, "actual": None, "kind": "missing_contact"}
+    ]
+
+
+class Portal:
+    """COMPANY_ID контактов портала; отвечает на crm.contact.list с фильтром @ID"""
+
+    def __init__(self, companies):
+        self.companies = companies
+        self.commands = []
+
+    def send(self, commands):
+        self.commands.append(commands)
+        result = {}
+        for key, command in commands.items():
+            query = unquote(command.split("?", 1)[1])
+            ids = [int(part.split("=")[1]) for part in query.split("&") if part.startswith("filter[@ID]")]
+            result[key] = [{"ID": str(contact_id), "COMPANY_ID": str(self.companies[contact_id] or "")}
+                           for contact_id in ids if contact_id in self.companies]
+        return {"result": {"result": result, "result_error": []}}
+
+
+def test_list_contact_companies_pages_ids(monkeypatch):
+    portal = Portal({contact_id: contact_id + 1000 for contact_id in range(120)})
+    portal.companies[5] = None
+    monkeypatch.setattr(reconciliation, "send_batch", portal.send)
+    monkeypatch.setattr(reconciliation, "BATCH_PAUSE", 0)
+
+    actual = list_contact_companies(list(range(130)))
+    assert len(portal.commands) == 1 and list(portal.commands[0]) == ["list_0", "list_1", "list_2"]
+    assert len(actual) == 120
+    assert actual[5] is None and actual[119] == 1119
+
+
+def test_reconcile_repairs_drift(monkeypatch):
+    portal = Portal({1: 10, 2: None, 3: 99})
+    linked = []
+
+    def relink(pairs):
+        for contact_id, company_id in pairs:
+            portal.companies[contact_id] = company_id
+        return [f"update_{index}" for index in range(len(pairs))]
+
+    async def on_linked(batch, result):
+        linked.extend(result)
+
+    monkeypatch.setattr(reconciliation, "send_batch", portal.send)
+    monkeypatch.setattr(reconciliation, "BATCH_PAUSE", 0)
+    monkeypatch.setattr(reconciliation, "update_contacts_company_batch", relink)
+    monkeypatch.setattr(batch_tuning, "tuner", lambda operation: BatchTuner(operation))
+    monkeypatch.setattr(batch_tuning, "save", lambda tuner: None)
+
+    report = asyncio.run(reconcile_links([(1, 10), (2, 20), (3, 30), (4, 40)], on_linked=on_linked))
+    assert report["kinds"] == {"missing_contact": 1, "unlinked": 1, "wrong_company": 1}
+    assert (report["drift"], report["repaired"], report["remaining"]) == (3, 2, 1)
+    assert sorted(linked) == [(2, 20), (3, 30)]
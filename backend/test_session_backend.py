@@ -0,0 +1,151 @@
+"""
+Тесты общего реестра сессий: RedisSessionBackend на локальной замене Redis
+и записи-посредники сессий другого воркера в ConnectionManager.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from redis_stand_in import RedisStandIn
+from session_backend import InMemorySessionBackend
+from session_status import status_board
+from websocket_manager import ConnectionManager
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _with_backends(check, ttl=60):
+    pytest.importorskip("redis")
+    from session_backend import RedisSessionBackend
+
+    stand_in = RedisStandIn()
+    port = await stand_in.start()
+    received = {"a": [], "b": []}
+    backends = []
+    try:
+        for name in ("a", "b"):
+            backend = RedisSessionBackend(url=f"redis://127.0.0.1:{port}/0", ttl=ttl, prefix="test")
+
+            async def on_message(payload, name=name):
+                received[name].append(payload)
+
+            await backend.start(f"worker-{name}", on_message)
+            backends.append(backend)
+        await check(*backends, received)
+    finally:
+        for backend in backends:
+            await backend.stop()
+        await stand_in.stop()
+
+
+def test_redis_session_visible_to_other_worker():
+    async def check(a, b, received):
+        await a.register_session("s1", "worker-a")
+        await a.update_session("s1", {"generation_active": True})
+        assert await b.get_session("s1") == {
+            "worker_id": "worker-a", "generation_active": True,
+            "generation_paused": False, "generation_initiator": False
+        }
+        await b.unregister_session("s1")
+        assert await a.get_session("s1") is None
+
+    run(_with_backends(check))
+
+
+def test_redis_publish_reaches_worker_channel():
+    async def check(a, b, received):
+        await b.publish("worker-a", {"type": "message", "session_id": "s1", "message": "привет"})
+        await b.publish_all({"type": "session_closed", "session_id": "s1"})
+        for _ in range(50):
+            if len(received["a"]) == 2 and received["b"]:
+                break
+            await asyncio.sleep(0.02)
+        assert received["a"] == [{"type": "message", "session_id": "s1", "message": "привет"},
+                                 {"type": "session_closed", "session_id": "s1"}]
+        assert received["b"] == [{"type": "session_closed", "session_id": "s1"}]
+
+    run(_with_backends(check))
+
+
+def test_redis_touch_refreshes_ttl():
+    async def check(a, b, received):
+        await a.register_session("s1", "worker-a")
+        key = a._session_key("s1")
+        await a.redis.expire(key, 5)
+        await a.touch_session("s1")
+        assert await a.redis.ttl(key) == 60
+        # Продление не создает запись закрытой сессии
+        await a.touch_session("missing")
+        assert await b.get_session("missing") is None
+
+    run(_with_backends(check))
+
+
+def test_remote_proxy_is_reaped_without_releasing_shared_session():
+    async def check():
+        manager = ConnectionManager()
+        manager.backend = InMemorySessionBackend()
+        await manager.backend.register_session("s1", "other-worker")
+
+        assert await manager.ensure_session("s1")
+        assert manager.user_sessions["s1"]["remote_worker"] == "other-worker"
+
+        assert manager.reap_idle_sessions(time.time() + manager.idle_timeout + 1) == 1
+        assert "s1" not in manager.user_sessions
+        await asyncio.sleep(0)
+        assert await manager.backend.get_session("s1") is not None
+
+    run(check())
+
+
+def test_remote_proxy_kept_while_generation_runs():
+    async def check():
+        manager = ConnectionManager()
+        manager.backend = InMemorySessionBackend()
+        await manager.backend.register_session("s1", "other-worker")
+        await manager.ensure_session("s1")
+        manager.user_sessions["s1"]["generation_active"] = True
+
+        assert manager.reap_idle_sessions(time.time() + manager.idle_timeout + 1) == 0
+        assert "s1" in manager.user_sessions
+
+    run(check())
+
+
+def test_remote_proxy_forwards_status_to_session_worker():
+    async def check():
+        proxy = ConnectionManager()
+        proxy.backend = InMemorySessionBackend()
+        await proxy.backend.register_session("s1", "other-worker")
+        published = []
+
+        async def publish(worker_id, payload):
+            published.append((worker_id, payload))
+
+        proxy.backend.publish = publish
+        await proxy.ensure_session("s1")
+        status_board.update("s1", phase="links")
+        status_board.set_progress("s1", "Привязываем контакты", 10, 20)
+        await asyncio.sleep(0)
+        assert published == [
+            ("other-worker", {"type": "status", "session_id": "s1", "fields": {"phase": "links"}}),
+            ("other-worker", {"type": "status", "session_id": "s1", "fields": {
+                "progress": {"label": "Привязываем контакты", "done": 10, "total": 20}
+            }})
+        ]
+        proxy.remove_session("s1")
+
+        # Воркер, к которому подключен клиент SSE, записывает статус в свой журнал
+        owner = ConnectionManager()
+        owner.backend = InMemorySessionBackend()
+        await owner.connect_stream_session("s1")
+        await owner.handle_backend_message(published[0][1])
+        assert status_board.sessions["s1"].status["phase"] == "links"
+        assert status_board.sessions["s1"].forward is None
+        owner.remove_session("s1")
+
+    run(check())
@@ -0,0 +1,118 @@
+"""
+Тесты журнала статуса сессий: версии, снимки статуса и ожидание изменений.
+"""
+
+import asyncio
+
+import session_status
+from session_status import EVENT_MESSAGE, EVENT_STATUS, SessionStatusBoard, format_sse
+
+
+def test_changes_after_version():
+    board = SessionStatusBoard()
+    board.open("s1")
+    board.update("s1", generation_active=True)
+    board.push_message("s1", "привет")
+    board.update("s1", generation_active=True)  # Без изменений события нет
+
+    events = board.changes("s1", 1)
+    assert events == [(2, EVENT_MESSAGE, "привет")]
+    assert board.changes("s1", 2) == []
+
+
+def test_changes_without_version_start_with_snapshot():
+    board = SessionStatusBoard()
+    board.open("s1")
+    board.update("s1", phase="links")
+    events = board.changes("s1", None)
+    assert len(events) == 1
+    version, kind, status = events[0]
+    assert (version, kind, status["phase"]) == (1, EVENT_STATUS, "links")
+    # Версия больше текущей - сервер перезапускался, клиент получает снимок
+    assert board.changes("s1", 5)[0][0] == 1
+
+
+def test_changes_snapshot_when_status_events_evicted(monkeypatch):
+    monkeypatch.setattr(session_status, "STATUS_EVENT_BUFFER", 3)
+    board = SessionStatusBoard()
+    board.open("s1")
+    for done in range(6):
+        board.set_progress("s1", "Импорт", done, 6)
+
+    events = board.changes("s1", 1)
+    # Изменения 2 и 3 вытеснены - вместо изменений статуса снимок на текущей версии
+    assert events == [(6, EVENT_STATUS, dict(board.sessions["s1"].status))]
+
+
+def test_messages_survive_progress_events(monkeypatch):
+    monkeypatch.setattr(session_status, "STATUS_EVENT_BUFFER", 3)
+    board = SessionStatusBoard()
+    board.open("s1")
+    board.push_message("s1", "result_chunk 0")
+    for done in range(10):
+        board.set_progress("s1", "Загружаем результат", done, 10)
+    board.push_message("s1", "complete")
+
+    events = board.changes("s1", 0)
+    assert events == [(1, EVENT_MESSAGE, "result_chunk 0"), (12, EVENT_MESSAGE, "complete"),
+                      (12, EVENT_STATUS, dict(board.sessions["s1"].status))]
+    # Клиент без Last-Event-ID тоже получает недоставленные сообщения
+    assert [data for _, kind, data in board.changes("s1", None) if kind == EVENT_MESSAGE] == [
+        "result_chunk 0", "complete"
+    ]
+
+
+def test_messages_dropped_after_delivery():
+    board = SessionStatusBoard()
+    board.open("s1")
+    board.push_message("s1", "a")
+    board.update("s1", phase="links")
+    board.push_message("s1", "b")
+
+    assert board.changes("s1", 0) == [(1, EVENT_MESSAGE, "a"), (2, EVENT_STATUS, dict(board.sessions["s1"].status)),
+                                      (3, EVENT_MESSAGE, "b")]
+    assert board.changes("s1", 1) == [(2, EVENT_STATUS, dict(board.sessions["s1"].status)), (3, EVENT_MESSAGE, "b")]
+    assert [event[0] for event in board.sessions["s1"].messages] == [3]
+    assert board.changes("s1", 3) == []
+    assert not board.sessions["s1"].messages
+
+
+def test_changes_snapshot_when_buffer_empty():
+    board = SessionStatusBoard()
+    board.open("s1")
+    board.update("s1", generation_active=True)
+    board.sessions["s1"].events.clear()
+    assert board.changes("s1", 0) == [(1, EVENT_STATUS, dict(board.sessions["s1"].status))]
+
+
+def test_closed_session_is_not_recorded():
+    board = SessionStatusBoard()
+    board.update("s1", generation_active=True)
+    board.push_message("s1", "x")
+    assert "s1" not in board.sessions
+    assert board.changes("s1", None)[0][0] == 0
+
+
+def test_wait_wakes_on_change_and_times_out():
+    async def check():
+        board = SessionStatusBoard()
+        board.open("s1")
+        assert not await board.wait("s1", 0, 0.01)
+        assert await board.wait("s1", 5, 0.01)  # Версия уже другая
+
+        waiter = asyncio.ensure_future(board.wait("s1", 0, 1))
+        await asyncio.sleep(0)
+        board.push_message("s1", "x")
+        assert await waiter
+
+        waiter = asyncio.ensure_future(board.wait("s1", 1, 1))
+        await asyncio.sleep(0)
+        board.remove("s1")
+        assert await waiter
+
+    asyncio.run(check())
+
+
+def test_format_sse():
+    assert format_sse(3, EVENT_MESSAGE, "a\nb") == "id: 3\ndata: a\ndata: b\n\n"
+    assert format_sse(None, EVENT_STATUS, {"phase": "ссылки"}) == 'event: status\ndata: {"phase": "ссылки"}\n\n'
@@ -0,0 +1,27 @@
+"""
+Тест холодного старта: тяжелые зависимости не загружаются при импорте main.
+"""
+
+import os
+import sys
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFERRED_MODULES = ("faker", "requests", "uvicorn")
+
+
+def test_main_import_defers_heavy_modules():
+    # Отдельный процесс: в процессе pytest эти модули могли загрузить другие тесты
+    code = "import sys, main; print(','.join(m for m in %r if m in sys.modules))" % (DEFERRED_MODULES,)
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True,
+                            timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+
+
+def test_data_generator_loads_faker_on_first_use():
+    code = ("import sys, data_generator; assert 'faker' not in sys.modules; "
+            "data_generator.build_contacts_payload(1); assert 'faker' in sys.modules")
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True,
+                            timeout=60)
+    assert result.returncode == 0, result.stderr
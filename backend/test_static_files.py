@@ -0,0 +1,43 @@
+"""
+Тесты отдачи фронтенда: сжатые варианты, их ETag и ответ 304.
+"""
+
+from starlette.requests import Request
+
+from static_files import FrontendAssets
+
+
+def make_request(path="/", **headers):
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": b"",
+                    "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]})
+
+
+def make_assets(tmp_path):
+    (tmp_path / "index.html").write_text("<html>" + "<div>Контакты</div>" * 200 + "</html>", encoding="utf-8")
+    assets = FrontendAssets(str(tmp_path))
+    assets.precompress()
+    return assets
+
+
+def test_each_encoding_has_own_etag(tmp_path):
+    assets = make_assets(tmp_path)
+    index = assets.index_html
+    identity = assets.response(make_request(), index)
+    gzipped = assets.response(make_request(accept_encoding="gzip"), index)
+
+    assert identity.headers["etag"] == index.etag and "content-encoding" not in identity.headers
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.headers["etag"] == index.etag[:-1] + '-gz"'
+    assert gzipped.body == index.gzip
+
+
+def test_if_none_match_compared_with_served_variant(tmp_path):
+    assets = make_assets(tmp_path)
+    index = assets.index_html
+    gzip_etag = index.etag[:-1] + '-gz"'
+
+    assert assets.response(make_request(accept_encoding="gzip", if_none_match=gzip_etag), index).status_code == 304
+    # ETag сжатого варианта не подходит клиенту без сжатия, и наоборот
+    assert assets.response(make_request(if_none_match=gzip_etag), index).status_code == 200
+    assert assets.response(make_request(accept_encoding="gzip", if_none_match=index.etag), index).status_code == 200
+    assert assets.response(make_request(if_none_match=f'W/{index.etag}'), index).status_code == 304
@@ -0,0 +1,84 @@
+"""
+Тест потокового режима генерации на портале в памяти: создание, привязка и отправка результата частями.
+"""
+
+import json
+import asyncio
+from itertools import count
+
+import pytest
+
+import streaming_generation
+from batch_tuner import BatchTuner, batch_tuning
+from streaming_generation import run_streaming_generation
+
+
+class Portal:
+    """Контакты и компании портала; привязка не проходит для каждого пятого контакта"""
+
+    def __init__(self):
+        self.ids = count(1)
+        self.contacts = {}
+        self.companies = {}
+
+    def create(self, storage, prefix):
+        def create_records(batch_size):
+            records = []
+            for _ in range(batch_size):
+                record_id = next(self.ids)
+                storage[record_id] = {"ID": str(record_id), "TITLE": f"{prefix} {record_id}", "NAME": prefix}
+                records.append((record_id, storage[record_id]))
+            return records
+        return create_records
+
+    def link(self, pairs):
+        successful = []
+        for index, (contact_id, company_id) in enumerate(pairs):
+            if contact_id % 5:
+                self.contacts[contact_id]["COMPANY_ID"] = str(company_id)
+                successful.append(f"update_{index}")
+        return successful
+
+    def get(self, commands, entity_type):
+        storage = self.companies if entity_type == "компании" else self.contacts
+        return {key: storage[int(key.split("_")[1])] for key in commands}
+
+
+@pytest.fixture
+def portal(monkeypatch):
+    portal = Portal()
+    monkeypatch.setattr(streaming_generation, "create_contacts_records", portal.create(portal.contacts, "contact"))
+    monkeypatch.setattr(streaming_generation, "create_companies_records", portal.create(portal.companies, "company"))
+    monkeypatch.setattr(streaming_generation, "update_contacts_company_batch", portal.link)
+    monkeypatch.setattr(streaming_generation, "execute_batch_request", portal.get)
+    monkeypatch.setattr(streaming_generation, "crm_mirror", None)
+    monkeypatch.setattr(batch_tuning, "tuner", lambda operation: BatchTuner(operation, initial=7, enabled=False))
+    monkeypatch.setattr(batch_tuning, "save", lambda tuner: None)
+    return portal
+
+
+def test_streaming_generation_sends_result_in_chunks(portal):
+    messages = []
+    phases = []
+
+    async def send(message):
+        messages.append(json.loads(message))
+
+    stats = asyncio.run(run_streaming_generation(40, 30, send, on_phase=phases.append, pause=0, chunk_size=10))
+
+    assert phases == ["contacts", "companies", "links", "readback"]
+    assert stats["contacts_created"] == 40 and stats["companies_created"] == 30
+    linked_contacts = [contact for contact in portal.contacts.values() if "COMPANY_ID" in contact]
+    assert stats["successful_links"] == len(linked_contacts)
+    assert stats["companies_sent"] == 30
+
+    # Части идут подряд и не больше chunk_size плюс один батч
+    offsets = [message["offset"] for message in messages]
+    assert offsets == sorted(offsets) and offsets[0] == 0
+    assert all(len(message["companies"]) < 10 + 7 for message in messages)
+    companies = [company for message in messages for company in message["companies"]]
+    assert sorted(company["id"] for company in companies) == sorted(portal.companies)
+    # У каждой компании не больше одного контакта, и это контакт с успешной привязкой
+    result_contacts = [contact for company in companies for contact in company["contacts"]]
+    assert all(len(company["contacts"]) <= 1 for company in companies)
+    assert sorted(contact["id"] for contact in result_contacts) == sorted(int(c["ID"]) for c in linked_contacts)
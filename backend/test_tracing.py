@@ -0,0 +1,94 @@
+"""
+Тесты трассировки: вложенность спанов, выгрузка трейса и время ответа Битрикс24.
+"""
+
+import json
+import asyncio
+
+import pytest
+
+import tracing
+from tracing import NOOP_SPAN, Tracer, current_span, record_bitrix_timing
+
+
+def read_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_disabled_tracer_returns_noop_span():
+    tracer = Tracer(export_path="")
+    with tracer.span("run") as span:
+        assert span is NOOP_SPAN
+        assert current_span() is None
+
+
+def test_nested_spans_exported_with_root(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    tracer = Tracer(export_path=path, export_format="json")
+
+    def call():
+        with tracer.span("bx_call"):
+            pass
+
+    async def run():
+        with tracer.span("create_test_data", contacts=10) as root:
+            await asyncio.to_thread(call)
+            with tracer.span("phase"):
+                assert current_span().parent_id == root.span_id
+            return root
+
+    root = asyncio.run(run())
+    spans = {span["name"]: span for span in read_lines(path)}
+    assert set(spans) == {"create_test_data", "bx_call", "phase"}
+    assert spans["bx_call"]["parent_id"] == root.span_id
+    assert spans["phase"]["trace_id"] == root.trace_id
+    assert spans["create_test_data"]["attributes"] == {"contacts": 10}
+    assert current_span() is None
+
+
+def test_error_marks_span_and_closes_children(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    tracer = Tracer(export_path=path, export_format="json")
+    with pytest.raises(RuntimeError):
+        with tracer.span("run"):
+            tracer.start_span("unfinished")
+            raise RuntimeError("сбой")
+    spans = {span["name"]: span for span in read_lines(path)}
+    assert spans["run"]["status"] == "error" and spans["run"]["status_message"] == "сбой"
+    assert spans["unfinished"]["end_ns"] == spans["run"]["end_ns"]
+
+
+def test_long_trace_flushed_in_parts(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FLUSH_SPANS", 3)
+    path = str(tmp_path / "traces.jsonl")
+    tracer = Tracer(export_path=path, export_format="json")
+    with tracer.span("run") as root:
+        for _ in range(3):
+            with tracer.span("batch"):
+                pass
+        assert len(read_lines(path)) == 2
+        assert len(tracer.traces[root.trace_id]) == 2
+    assert len(read_lines(path)) == 4
+
+
+def test_otlp_export(tmp_path):
+    path = str(tmp_path / "traces.otlp.jsonl")
+    tracer = Tracer(export_path=path, export_format="otlp")
+    with tracer.span("run", ok=True, size=5, ratio=0.5, label="x"):
+        pass
+    [request] = read_lines(path)
+    [span] = request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert span["name"] == "run" and "parentSpanId" not in span
+    assert span["attributes"] == [
+        {"key": "ok", "value": {"boolValue": True}}, {"key": "size", "value": {"intValue": "5"}},
+        {"key": "ratio", "value": {"doubleValue": 0.5}}, {"key": "label", "value": {"stringValue": "x"}}
+    ]
+
+
+def test_record_bitrix_timing(tmp_path):
+    tracer = Tracer(export_path=str(tmp_path / "traces.jsonl"))
+    with tracer.span("bx_call") as span:
+        record_bitrix_timing(span, {"result": {}, "time": {"processing": 0.25}}, 300)
+    assert span.attributes == {"http.elapsed_ms": 300, "bitrix.time.processing_ms": 250.0,
+                               "bitrix.overhead_ms": 50.0}
@@ -0,0 +1,68 @@
+"""
+Тесты очереди webhook событий: повтор только упавших обработчиков и учет недоставленных событий.
+"""
+
+import asyncio
+import json
+
+from webhook_queue import WebhookEventQueue
+
+
+def make_queue(tmp_path, **kwargs):
+    options = dict(journal_path=str(tmp_path / "events.jsonl"), dead_letter_path=str(tmp_path / "dead.jsonl"),
+                   workers=0, retry_delay=60)
+    options.update(kwargs)
+    return WebhookEventQueue(**options)
+
+
+def test_retry_runs_only_failed_handler(tmp_path):
+    queue = make_queue(tmp_path)
+    calls = {"mirror": 0, "flaky": 0}
+    fail = [True]
+
+    async def mirror(events):
+        calls["mirror"] += len(events)
+
+    async def flaky(events):
+        calls["flaky"] += len(events)
+        if fail[0]:
+            raise RuntimeError("портал недоступен")
+
+    queue.register_handler("ONCRMCONTACTUPDATE", mirror)
+    queue.register_handler("ONCRMCONTACTUPDATE", flaky)
+
+    async def check():
+        await queue.start()
+        queue.submit({"event": "ONCRMCONTACTUPDATE", "data": {"FIELDS": {"ID": 1}}, "ts": 1})
+        record = queue.queue.get_nowait()
+        await queue._process_batch([record])
+        assert record["pending_handlers"] == [1] and queue.stats["processed"] == 0
+
+        fail[0] = False
+        queue.retry_handles.pop(record["id"]).cancel()
+        await queue._process_batch([record])
+        await queue.stop()
+
+    asyncio.run(check())
+    assert calls == {"mirror": 1, "flaky": 2}
+    assert queue.stats["processed"] == 1 and queue.stats["retried"] == 1 and queue.unacked == 0
+
+
+def test_dead_letter_is_not_counted_as_processed(tmp_path):
+    queue = make_queue(tmp_path, max_attempts=1)
+
+    async def broken(events):
+        raise RuntimeError("ошибка")
+
+    queue.register_handler("ONCRMCOMPANYADD", broken)
+
+    async def check():
+        await queue.start()
+        queue.submit({"event": "ONCRMCOMPANYADD", "data": {"FIELDS": {"ID": 2}}, "ts": 1})
+        await queue._process_batch([queue.queue.get_nowait()])
+        await queue.stop()
+
+    asyncio.run(check())
+    assert queue.stats["processed"] == 0 and queue.stats["dead_lettered"] == 1 and queue.unacked == 0
+    with open(tmp_path / "dead.jsonl", encoding="utf-8") as dead_letter:
+        assert json.loads(dead_letter.readline())["error"] == "ошибка"
@@ -0,0 +1,24 @@
+"""
+Дымовой тест нагрузочного стенда: несколько клиентов /ws и одна генерация на имитации Битрикс24.
+"""
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_load_harness_runs_generation():
+    pytest.importorskip("websockets")
+    pytest.importorskip("requests")
+    result = subprocess.run(
+        [sys.executable, "bench_websocket_load.py", "--clients", "5", "--generations", "1", "--records", "5",
+         "--hold", "0.5", "--portal-latency-ms", "1"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "Подключения: 5/5" in result.stdout
+    assert "Генерации: 1/1" in result.stdout
@@ -0,0 +1,218 @@
+"""
+Трассировка запусков генерации в стиле OpenTelemetry.
+
+Каждый запуск create_test_data - корневой span, фазы и вызовы Bitrix24 - дочерние.
+Текущий span хранится в ContextVar, поэтому вложенность сохраняется и в asyncio
+задачах, и в потоках asyncio.to_thread. Когда корневой span завершается, весь
+трейс дописывается в файл TRACE_EXPORT_PATH: по строке на span (json) или одним
+запросом OTLP/JSON на трейс (otlp), который понимают коллекторы OpenTelemetry.
+В длинных запусках завершенные спаны выгружаются порциями по TRACE_FLUSH_SPANS,
+чтобы трейс не накапливался в памяти целиком.
+"""
+
+import os
+import logging
+import json
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from config import TRACE_EXPORT_PATH, TRACE_EXPORT_FORMAT
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "bitrix24-contacts"
+TRACE_FLUSH_SPANS = 1000
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "status", "status_message", "_token", "_tracer")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: dict):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.status = "unset"
+        self.status_message = None
+        self._token = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict):
+        self.attributes.update(attributes)
+
+    def record_error(self, error):
+        self.status = "error"
+        self.status_message = str(error)
+
+    def end(self):
+        """Завершает span, начатый через Tracer.start_span"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                pass  # Span завершен в другом контексте
+            self._token = None
+        self._tracer._finish(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": self.status,
+            "status_message": self.status_message
+        }
+
+
+def current_span() -> Optional[Span]:
+    """Текущий span контекста или None, если трассировка выключена или span не начат"""
+    return _current_span.get()
+
+
+class _NoopSpan:
+    """Span-заглушка, когда трассировка выключена"""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span: Span) -> dict:
+    result = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": {"unset": 0, "ok": 1, "error": 2}[span.status]}
+    }
+    if span.parent_id:
+        result["parentSpanId"] = span.parent_id
+    if span.status_message:
+        result["status"]["message"] = span.status_message
+    return result
+
+
+class Tracer:
+    def __init__(self, export_path: str = TRACE_EXPORT_PATH, export_format: str = TRACE_EXPORT_FORMAT):
+        self.export_path = export_path
+        self.export_format = export_format
+        self.enabled = bool(export_path)
+        self.lock = threading.Lock()
+        self.traces: Dict[str, List[Span]] = {}  # trace_id -> спаны трейса до завершения корня
+
+    def start_span(self, name: str, **attributes):
+        """Начинает span и делает его текущим. Завершить нужно вызовом span.end()"""
+        if not self.enabled:
+            return NOOP_SPAN
+        span = Span(self, name, _current_span.get(), attributes)
+        span._token = _current_span.set(span)
+        with self.lock:
+            self.traces.setdefault(span.trace_id, []).append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Контекстный менеджер span: исключение помечает span ошибкой"""
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            span.end()
+
+    def _finish(self, span: Span):
+        if span.parent_id is not None:
+            with self.lock:
+                spans = self.traces.get(span.trace_id)
+                if spans is None or len(spans) < TRACE_FLUSH_SPANS:
+                    return
+                finished = [s for s in spans if s.end_ns is not None]
+                self.traces[span.trace_id] = [s for s in spans if s.end_ns is None]
+            self._export(finished)
+            return
+        # Завершился корневой span - выгружаем весь трейс
+        with self.lock:
+            spans = self.traces.pop(span.trace_id, [])
+        for child in spans:
+            if child.end_ns is None:
+                # Span не был завершен (например, из-за исключения) - закрываем по корню
+                child.end_ns = span.end_ns
+        self._export(spans)
+
+    def _export(self, spans: List[Span]):
+        if self.export_format == "otlp":
+            lines = [json.dumps({
+                "resourceSpans": [{
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                    "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": [_otlp_span(s) for s in spans]}]
+                }]
+            }, ensure_ascii=False)]
+        else:
+            lines = [json.dumps(s.to_dict(), ensure_ascii=False) for s in spans]
+
+        try:
+            with self.lock, open(self.export_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            logger.error("Ошибка записи трейса в %s: %s", self.export_path, e)
+
+
+def record_bitrix_timing(span, response_data: dict, elapsed_ms: float):
+    """Записывает в span время ответа HTTP и время обработки на стороне Битрикс24 (time.processing)"""
+    span.set_attribute("http.elapsed_ms", round(elapsed_ms, 2))
+    timing = response_data.get("time") if isinstance(response_data, dict) else None
+    if timing and "processing" in timing:
+        processing_ms = float(timing["processing"]) * 1000
+        span.set_attribute("bitrix.time.processing_ms", round(processing_ms, 2))
+        # Все, что сверх обработки порталом: DNS, TLS, сеть, очередь на стороне Битрикс24
+        span.set_attribute("bitrix.overhead_ms", round(max(0.0, elapsed_ms - processing_ms), 2))
+
+
+# Глобальный трассировщик
+tracer = Tracer()
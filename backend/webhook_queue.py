@@ -0,0 +1,343 @@
+import os
+import logging
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Tuple
+
+from config import (
+    WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, WEBHOOK_BATCH_SIZE, WEBHOOK_BATCH_TIMEOUT,
+    WEBHOOK_JOURNAL_PATH, WEBHOOK_JOURNAL_FSYNC, WEBHOOK_DEDUP_SIZE,
+    WEBHOOK_MAX_ATTEMPTS, WEBHOOK_RETRY_DELAY, WEBHOOK_DEAD_LETTER_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+# Журнал сжимается, когда все события обработаны и файл больше этого размера
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+# Окно для расчета пропускной способности, секунды
+THROUGHPUT_WINDOW = 60
+# Пауза воркера после непредвиденной ошибки, секунды
+WORKER_ERROR_PAUSE = 1.0
+
+
+def get_event_id(data: dict) -> str:
+    """Возвращает идентификатор события для дедупликации"""
+    event_type = data.get('event', '')
+    fields = data.get('data', {}).get('FIELDS', {}) or {}
+    entity_id = fields.get('ID')
+    ts = data.get('ts')
+    if entity_id is not None and ts is not None:
+        return f"{event_type}:{entity_id}:{ts}"
+    # Нет ID или метки времени - используем хеш содержимого
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return f"{event_type}:{hashlib.sha1(raw).hexdigest()}"
+
+
+class WebhookEventQueue:
+    """
+    Очередь входящих webhook событий Битрикс24.
+    Событие сначала пишется в журнал на диске, затем подтверждается отправителю
+    и обрабатывается фоновыми воркерами пачками. Если очередь в памяти заполнена,
+    событие остается только в журнале и дочитывается позже.
+    Событие подтверждается в журнале, только если все его обработчики завершились без ошибки;
+    иначе оно повторяется с растущей задержкой только для упавших обработчиков, а после max_attempts
+    попыток записывается в файл недоставленных. После перезапуска событие из журнала снова получают
+    все обработчики, поэтому они должны быть идемпотентными.
+    """
+
+    def __init__(self, journal_path: str = WEBHOOK_JOURNAL_PATH, maxsize: int = WEBHOOK_QUEUE_SIZE,
+                 workers: int = WEBHOOK_WORKERS, batch_size: int = WEBHOOK_BATCH_SIZE,
+                 batch_timeout: float = WEBHOOK_BATCH_TIMEOUT, dedup_size: int = WEBHOOK_DEDUP_SIZE,
+                 fsync: bool = WEBHOOK_JOURNAL_FSYNC, max_attempts: int = WEBHOOK_MAX_ATTEMPTS,
+                 retry_delay: float = WEBHOOK_RETRY_DELAY, dead_letter_path: str = WEBHOOK_DEAD_LETTER_PATH):
+        self.journal_path = journal_path
+        self.maxsize = maxsize
+        self.workers_count = workers
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.dedup_size = dedup_size
+        self.fsync = fsync
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.dead_letter_path = dead_letter_path
+
+        self.handlers: Dict[str, List[Callable]] = {}
+        self.queue = None
+        self.workers = []
+        self.journal = None
+
+        self.seen_ids = OrderedDict()  # последние ID событий для дедупликации
+        self.in_memory_ids = set()     # события в очереди или в обработке
+        self.spilled = 0               # события, оставшиеся только в журнале
+        self.unacked = 0               # события в журнале без подтверждения обработки
+        self.read_offset = 0           # до этой позиции журнала все события в памяти или подтверждены
+        self.retry_handles = {}        # ID события -> отложенный повтор после ошибки обработки
+
+        self.stats = {
+            'received': 0,
+            'duplicates': 0,
+            'spilled': 0,
+            'processed': 0,
+            'failed': 0,
+            'retried': 0,
+            'dead_lettered': 0,
+            'batches': 0
+        }
+        self.last_lag = 0.0
+        self.processed_times = deque()  # (время обработки пачки, количество событий)
+
+    def register_handler(self, event_type: str, handler: Callable):
+        """Регистрирует async обработчик пачки событий: handler(events: List[dict])"""
+        self.handlers.setdefault(event_type, []).append(handler)
+
+    async def start(self):
+        """Открывает журнал, восстанавливает необработанные события и запускает воркеров"""
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+
+        pending = self._read_pending_from_journal()
+        self.journal = open(self.journal_path, "a", encoding="utf-8")
+        self.unacked = len(pending)
+        self.read_offset = self.journal.tell()
+        for offset, record in pending:
+            self._remember(record['id'])
+            if not self.spilled and self._enqueue(record):
+                continue
+            if not self.spilled:
+                self.read_offset = offset
+            self.spilled += 1
+        if pending:
+            logger.info("Webhook очередь: восстановлено %d необработанных событий из журнала", len(pending))
+
+        self.workers = [asyncio.create_task(self._worker(i)) for i in range(self.workers_count)]
+
+    async def stop(self):
+        """Останавливает воркеров и закрывает журнал"""
+        for handle in self.retry_handles.values():
+            handle.cancel()  # События остаются в журнале неподтвержденными и повторятся после запуска
+        self.retry_handles.clear()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        self.queue = None
+
+    def submit(self, data: dict) -> str:
+        """Принимает событие: пишет в журнал и ставит в очередь. Возвращает статус приема"""
+        self.stats['received'] += 1
+        event_id = get_event_id(data)
+        if event_id in self.seen_ids:
+            self.stats['duplicates'] += 1
+            return "duplicate"
+
+        record = {'op': 'event', 'id': event_id, 'received_at': time.time(), 'data': data}
+        self._write_journal(record)
+        self._remember(event_id)
+        self.unacked += 1
+
+        if self.queue is None or not self._enqueue(record):
+            self.spilled += 1
+            self.stats['spilled'] += 1
+            return "spilled"
+        return "queued"
+
+    def get_stats(self) -> dict:
+        """Возвращает статистику очереди: пропускную способность и задержку обработки"""
+        now = time.time()
+        while self.processed_times and now - self.processed_times[0][0] > THROUGHPUT_WINDOW:
+            self.processed_times.popleft()
+        processed_in_window = sum(count for _, count in self.processed_times)
+
+        return {
+            **self.stats,
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            'queue_capacity': self.maxsize,
+            'spilled_pending': self.spilled,
+            'unacked': self.unacked,
+            'lag_seconds': round(self.last_lag, 3),
+            'throughput_per_sec': round(processed_in_window / THROUGHPUT_WINDOW, 2),
+            'workers': len(self.workers)
+        }
+
+    def _remember(self, event_id: str):
+        self.seen_ids[event_id] = True
+        self.seen_ids.move_to_end(event_id)
+        while len(self.seen_ids) > self.dedup_size:
+            self.seen_ids.popitem(last=False)
+
+    def _enqueue(self, record: dict) -> bool:
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            return False
+        self.in_memory_ids.add(record['id'])
+        return True
+
+    def _write_journal(self, record: dict):
+        if not self.journal:
+            return
+        self.journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+
+    def _read_pending_from_journal(self, offset: int = 0) -> List[Tuple[int, dict]]:
+        """Читает из журнала, начиная с offset, события без подтверждения обработки: пары (позиция строки, запись)"""
+        if not os.path.exists(self.journal_path):
+            return []
+
+        events = OrderedDict()
+        with open(self.journal_path, "rb") as journal:
+            journal.seek(offset)
+            position = offset
+            for line in journal:
+                line_offset, position = position, position + len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Оборванная последняя строка после аварийной остановки
+                if record.get('op') == 'event':
+                    events[record['id']] = (line_offset, record)
+                elif record.get('op') == 'ack':
+                    for event_id in record.get('ids', []):
+                        events.pop(event_id, None)
+        return list(events.values())
+
+    def _refill_from_journal(self):
+        """Дочитывает в очередь события, не поместившиеся в память; журнал читается с read_offset"""
+        self.journal.flush()
+        pending = [(offset, record) for offset, record in self._read_pending_from_journal(self.read_offset)
+                   if record['id'] not in self.in_memory_ids]
+        enqueued = 0
+        for offset, record in pending:
+            if not self._enqueue(record):
+                self.read_offset = offset
+                break
+            enqueued += 1
+        else:
+            self.read_offset = self.journal.tell()
+        self.spilled = len(pending) - enqueued
+
+    def _compact_journal(self):
+        """Очищает журнал, если все события обработаны"""
+        if self.unacked or self.spilled or self.journal.tell() < JOURNAL_COMPACT_BYTES:
+            return
+        self.journal.close()
+        self.journal = open(self.journal_path, "w", encoding="utf-8")
+        self.read_offset = 0
+
+    async def _next_batch(self) -> List[dict]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self, worker_id: int):
+        while True:
+            try:
+                batch = await self._next_batch()
+                await self._process_batch(batch)
+
+                if self.spilled and self.queue.qsize() < self.maxsize // 2:
+                    self._refill_from_journal()
+                self._compact_journal()
+            except Exception as e:
+                # Неподтвержденные события остаются в журнале; воркер продолжает работу
+                logger.exception("Webhook воркер %d: непредвиденная ошибка: %s", worker_id, e)
+                await asyncio.sleep(WORKER_ERROR_PAUSE)
+
+    def _retry(self, record: dict):
+        """Возвращает событие в очередь после задержки; при полной очереди откладывает еще раз"""
+        self.retry_handles.pop(record['id'], None)
+        if self.queue is None:
+            return
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self._schedule_retry(record)
+
+    def _schedule_retry(self, record: dict):
+        delay = self.retry_delay * 2 ** (record['attempts'] - 1)
+        self.retry_handles[record['id']] = asyncio.get_running_loop().call_later(delay, self._retry, record)
+
+    def _dead_letter(self, record: dict, error: str):
+        """Записывает событие, исчерпавшее попытки, в файл недоставленных"""
+        with open(self.dead_letter_path, "a", encoding="utf-8") as dead_letter:
+            dead_letter.write(json.dumps({**record, 'error': error, 'failed_at': time.time()}, ensure_ascii=False) + "\n")
+        logger.error("Webhook событие %s не обработано за %d попыток и записано в %s",
+                     record['id'], record['attempts'], self.dead_letter_path)
+
+    async def _process_batch(self, batch: List[dict]):
+        by_type: Dict[str, List[dict]] = {}
+        for record in batch:
+            by_type.setdefault(record['data'].get('event', ''), []).append(record)
+
+        # Ошибки по обработчикам: (тип события, номер обработчика) -> текст ошибки
+        errors: Dict[Tuple[str, int], str] = {}
+        for event_type, records in by_type.items():
+            for index, handler in enumerate(self.handlers.get(event_type, [])):
+                # Повторное событие получают только обработчики, которые на нем упали
+                events = [record['data'] for record in records
+                          if record.get('pending_handlers') is None or index in record['pending_handlers']]
+                if not events:
+                    continue
+                try:
+                    await handler(events)
+                except Exception as e:
+                    errors[(event_type, index)] = str(e)
+                    logger.exception("Ошибка обработки webhook событий %s: %s", event_type, e)
+
+        # Подтверждаются обработанные события и события, исчерпавшие попытки
+        done = []
+        processed = 0
+        for record in batch:
+            event_type = record['data'].get('event', '')
+            pending = record.get('pending_handlers')
+            if pending is None:
+                pending = range(len(self.handlers.get(event_type, [])))
+            failed = [index for index in pending if (event_type, index) in errors]
+            if not failed:
+                done.append(record)
+                processed += 1
+                continue
+            self.stats['failed'] += 1
+            record['attempts'] = record.get('attempts', 0) + 1
+            record['pending_handlers'] = failed
+            if record['attempts'] >= self.max_attempts:
+                self._dead_letter(record, "; ".join(errors[(event_type, index)] for index in failed))
+                self.stats['dead_lettered'] += 1
+                done.append(record)
+            else:
+                self.stats['retried'] += 1
+                self._schedule_retry(record)
+
+        now = time.time()
+        ids = [record['id'] for record in done]
+        if ids:
+            self._write_journal({'op': 'ack', 'ids': ids})
+        self.in_memory_ids.difference_update(ids)
+        self.unacked = max(0, self.unacked - len(done))
+
+        # Недоставленные события подтверждены в журнале, но обработанными не считаются
+        self.stats['processed'] += processed
+        self.stats['batches'] += 1
+        self.last_lag = max(now - record['received_at'] for record in batch)
+        self.processed_times.append((now, processed))
+
+
+# Глобальный экземпляр очереди
+webhook_queue = WebhookEventQueue()
@@ -1,8 +1,18 @@
+import os
+import logging
 import time
+import heapq
+import socket
 import asyncio
 import uuid
 from typing import List, Dict
 from fastapi import WebSocket
+from message_encoding import ENCODING_JSON
+from session_backend import STATUS_FIELDS, create_session_backend
+from session_status import status_board
+from config import SESSION_IDLE_TIMEOUT, SESSION_REAPER_INTERVAL, MAX_SESSIONS, SESSION_TTL
+
+logger = logging.getLogger(__name__)
 
 class ConnectionManager:
     def __init__(self):
@@ -10,6 +20,158 @@ class ConnectionManager:
         self.user_sessions: Dict[str, dict] = {}  # session_id -> {websocket, generation_active, generation_paused, etc.}
         # Убираем глобальные флаги - теперь все индивидуально
         self.last_activity = time.time()
+        # Общий реестр сессий для нескольких воркеров: сессия может быть подключена к другому процессу
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.backend = create_session_backend()
+        # Куча (last_activity, session_id) для поиска простаивающих сессий.
+        # Записи обновляются лениво: при извлечении сверяются с текущим last_activity сессии
+        self.activity_heap = []
+        self.reaper_task = None
+        self.idle_timeout = SESSION_IDLE_TIMEOUT
+        self.max_sessions = MAX_SESSIONS
+
+    async def start(self):
+        """Подключается к backend сессий, запускает очистку простаивающих сессий"""
+        await self.backend.start(self.worker_id, self.handle_backend_message)
+        self.reaper_task = asyncio.create_task(self._reaper_loop())
+
+    async def stop(self):
+        if self.reaper_task:
+            self.reaper_task.cancel()
+            await asyncio.gather(self.reaper_task, return_exceptions=True)
+            self.reaper_task = None
+        await self.backend.stop()
+
+    def touch(self, session_id: str):
+        """Отмечает активность сессии (любое сообщение от клиента, в том числе ping)"""
+        if session_id in self.user_sessions:
+            now = time.time()
+            session_data = self.user_sessions[session_id]
+            session_data['last_activity'] = now
+            self.last_activity = now
+            # TTL записи в общем реестре продлевается не чаще раза в четверть SESSION_TTL
+            if now - session_data.get('ttl_refreshed', 0) >= SESSION_TTL / 4:
+                session_data['ttl_refreshed'] = now
+                self._schedule(self.backend.touch_session(session_id))
+
+    def _schedule_reap(self, session_id: str, activity: float):
+        heapq.heappush(self.activity_heap, (activity, session_id))
+        self.user_sessions[session_id]['reap_entry'] = activity
+
+    def reap_idle_sessions(self, now: float = None) -> int:
+        """Закрывает сессии без активности дольше idle_timeout. Возвращает количество закрытых"""
+        now = now or time.time()
+        reaped = 0
+        while self.activity_heap and self.activity_heap[0][0] + self.idle_timeout <= now:
+            activity, session_id = heapq.heappop(self.activity_heap)
+            session_data = self.user_sessions.get(session_id)
+            if not session_data or session_data.get('reap_entry') != activity:
+                continue  # Сессия уже закрыта или запись устарела
+            if session_data['last_activity'] > activity:
+                # Была активность - переносим проверку
+                self._schedule_reap(session_id, session_data['last_activity'])
+                continue
+            if session_data.get('remote_worker') and session_data['generation_active']:
+                # Посредник сессии другого воркера живет, пока здесь идет ее генерация
+                self._schedule_reap(session_id, now)
+                continue
+
+            logger.info("Сессия %s закрыта по неактивности", session_id[:8])
+            websocket = session_data['websocket']
+            self.remove_session(session_id)
+            if websocket is not None:
+                self._schedule(self._close_websocket(websocket, 1001))
+            reaped += 1
+        return reaped
+
+    async def _close_websocket(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass  # Соединение уже разорвано
+
+    async def _reaper_loop(self):
+        while True:
+            await asyncio.sleep(SESSION_REAPER_INTERVAL)
+            try:
+                self.reap_idle_sessions()
+            except Exception as e:
+                logger.exception("Ошибка очистки сессий: %s", e)
+
+    def get_local_sessions_count(self) -> int:
+        """Количество сессий, WebSocket которых открыт на этом воркере"""
+        return sum(1 for session in self.user_sessions.values() if not session.get('remote_worker'))
+
+    def _schedule(self, coro):
+        """Запускает корутину в фоне из синхронного кода"""
+        try:
+            asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+
+    def _sync_status(self, session_id: str):
+        """Публикует статус генерации сессии для остальных воркеров и подписчиков SSE/long-poll"""
+        if session_id in self.user_sessions:
+            session_data = self.user_sessions[session_id]
+            status = {field: session_data[field] for field in STATUS_FIELDS}
+            self._schedule(self.backend.update_session(session_id, status))
+            # Генерация запущена или остановлена - фаза и ход батчей начинаются заново
+            status_board.update(session_id, phase=None, progress=None, **status)
+
+    async def _release_session(self, session_id: str):
+        await self.backend.unregister_session(session_id)
+        await self.backend.publish_all({'type': 'session_closed', 'session_id': session_id})
+
+    async def ensure_session(self, session_id: str) -> bool:
+        """
+        Проверяет, что сессия существует на этом или другом воркере.
+        Для сессии другого воркера создается локальная запись-посредник: сообщения для нее
+        пересылаются через backend воркеру, который держит WebSocket.
+        """
+        if session_id in self.user_sessions:
+            return True
+
+        shared = await self.backend.get_session(session_id)
+        if not shared or shared['worker_id'] == self.worker_id:
+            return False
+
+        self.user_sessions[session_id] = {
+            'websocket': None,
+            'remote_worker': shared['worker_id'],
+            'generation_active': shared['generation_active'],
+            'generation_paused': shared['generation_paused'],
+            'generation_task': None,
+            'pause_start_time': None,
+            'last_activity': time.time(),
+            'generation_initiator': shared['generation_initiator'],
+            'encoding': ENCODING_JSON
+        }
+        # Посредник без активности удаляется, как и обычная сессия; при следующем запросе создается заново
+        self._schedule_reap(session_id, self.user_sessions[session_id]['last_activity'])
+        # Фаза и ход батчей генерации, запущенной здесь, уходят воркеру сессии, как и ее сообщения
+        status_board.open(session_id, forward=lambda fields: self._schedule(self.backend.publish(
+            shared['worker_id'], {'type': 'status', 'session_id': session_id, 'fields': fields}
+        )))
+        return True
+
+    async def handle_backend_message(self, payload: dict):
+        """Обрабатывает сообщения от других воркеров"""
+        session_id = payload.get('session_id')
+        if payload.get('type') == 'message':
+            session_data = self.user_sessions.get(session_id)
+            if session_data and not session_data.get('remote_worker'):
+                await self.send_message_to_session(session_id, payload['message'])
+        elif payload.get('type') == 'status':
+            session_data = self.user_sessions.get(session_id)
+            if session_data and not session_data.get('remote_worker'):
+                status_board.update(session_id, **payload['fields'])
+        elif payload.get('type') == 'session_closed':
+            # WebSocket сессии закрылся на другом воркере - останавливаем генерацию здесь
+            session_data = self.user_sessions.get(session_id)
+            if session_data and session_data.get('remote_worker'):
+                await self.stop_generation_for_session(session_id)
+                del self.user_sessions[session_id]
+                status_board.remove(session_id)
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
@@ -23,16 +185,43 @@ class ConnectionManager:
             'generation_task': None,
             'pause_start_time': None,
             'last_activity': time.time(),
-            'generation_initiator': False  # Флаг того, кто инициировал генерацию
+            'generation_initiator': False,  # Флаг того, кто инициировал генерацию
+            'encoding': ENCODING_JSON  # Кодировка больших сообщений, согласованная с клиентом
         }
         
         self.active_connections.append(websocket)
         self.last_activity = time.time()
+        status_board.open(session_id)
         
         return session_id
 
     async def connect_with_session_id(self, websocket: WebSocket, session_id: str):
-        """Подключает WebSocket с предопределенным session_id"""
+        """
+        Подключает WebSocket с предопределенным session_id.
+        Возвращает None, если достигнут лимит сессий.
+        """
+        existing = self.user_sessions.get(session_id)
+        if existing and not existing.get('remote_worker'):
+            # Повторное подключение той же сессии: сохраняем состояние генерации,
+            # заменяем WebSocket и закрываем старый
+            old_websocket = existing['websocket']
+            if old_websocket is not websocket:
+                existing['websocket'] = websocket
+                if old_websocket in self.active_connections:
+                    self.active_connections.remove(old_websocket)
+                self.active_connections.append(websocket)
+                if old_websocket is not None:  # None - сессия была подключена через SSE или long-poll
+                    self._schedule(self._close_websocket(old_websocket, 1000))
+            self.touch(session_id)
+            return session_id
+
+        # Контроль допуска: сначала освобождаем простаивающие сессии, затем проверяем лимит
+        if self.get_local_sessions_count() >= self.max_sessions:
+            self.reap_idle_sessions()
+            if self.get_local_sessions_count() >= self.max_sessions:
+                logger.warning("Сессия %s отклонена: достигнут лимит %d сессий", session_id[:8], self.max_sessions)
+                return None
+
         # Создаем индивидуальную сессию пользователя
         self.user_sessions[session_id] = {
             'websocket': websocket,
@@ -41,41 +230,75 @@ class ConnectionManager:
             'generation_task': None,
             'pause_start_time': None,
             'last_activity': time.time(),
-            'generation_initiator': False  # Флаг того, кто инициировал генерацию
+            'generation_initiator': False,  # Флаг того, кто инициировал генерацию
+            'encoding': ENCODING_JSON  # Кодировка больших сообщений, согласованная с клиентом
         }
         
         self.active_connections.append(websocket)
         self.last_activity = time.time()
+        self._schedule_reap(session_id, self.user_sessions[session_id]['last_activity'])
+        status_board.open(session_id)
+        await self.backend.register_session(session_id, self.worker_id)
         
         return session_id
 
+    async def connect_stream_session(self, session_id: str):
+        """
+        Подключает сессию без WebSocket (клиент за прокси получает статус и сообщения через SSE
+        или long-poll, см. session_status.py). Сессия живет, пока клиент продлевает ее запросами.
+        Возвращает None, если достигнут лимит сессий.
+        """
+        if self.get_local_sessions_count() >= self.max_sessions:
+            self.reap_idle_sessions()
+            if self.get_local_sessions_count() >= self.max_sessions:
+                logger.warning("Сессия %s отклонена: достигнут лимит %d сессий", session_id[:8], self.max_sessions)
+                return None
+
+        self.user_sessions[session_id] = {
+            'websocket': None,
+            'generation_active': False,
+            'generation_paused': False,
+            'generation_task': None,
+            'pause_start_time': None,
+            'last_activity': time.time(),
+            'generation_initiator': False,
+            'encoding': ENCODING_JSON
+        }
+        self._schedule_reap(session_id, self.user_sessions[session_id]['last_activity'])
+        status_board.open(session_id)
+        await self.backend.register_session(session_id, self.worker_id)
+        return session_id
+
     def disconnect(self, websocket: WebSocket):
         # Находим и удаляем сессию пользователя
-        session_to_remove = None
-        session_data_to_remove = None
-        
-        for session_id, session_data in self.user_sessions.items():
-            if session_data['websocket'] == websocket:
-                session_to_remove = session_id
-                session_data_to_remove = session_data
-                break
-        
-        if session_to_remove and session_data_to_remove:
-            # Если у этого пользователя была активная генерация, останавливаем её
-            if session_data_to_remove['generation_active']:
-                print(f"Генерация отменена для сессии {session_to_remove[:8]} - пользователь отключился")
-                session_data_to_remove['generation_active'] = False
-                session_data_to_remove['generation_paused'] = False
-                if session_data_to_remove['generation_task'] and not session_data_to_remove['generation_task'].done():
-                    session_data_to_remove['generation_task'].cancel()
-            
-            del self.user_sessions[session_to_remove]
+        session_id, _ = self.get_session_by_websocket(websocket)
+        if session_id:
+            self.remove_session(session_id)
         
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
             
         self.last_activity = time.time()
 
+    def remove_session(self, session_id: str):
+        """Удаляет сессию, останавливая ее генерацию"""
+        session_data = self.user_sessions.pop(session_id, None)
+        if session_data is None:
+            return
+        # Если у этого пользователя была активная генерация, останавливаем её
+        if session_data['generation_active']:
+            logger.info("Генерация отменена для сессии %s - пользователь отключился", session_id[:8])
+            session_data['generation_active'] = False
+            session_data['generation_paused'] = False
+            if session_data['generation_task'] and not session_data['generation_task'].done():
+                session_data['generation_task'].cancel()
+        if session_data['websocket'] in self.active_connections:
+            self.active_connections.remove(session_data['websocket'])
+        status_board.remove(session_id)
+        if not session_data.get('remote_worker'):
+            # Запись общего реестра принадлежит воркеру с WebSocket, посредник ее не удаляет
+            self._schedule(self._release_session(session_id))
+
     async def send_personal_message(self, message: str, websocket: WebSocket):
         try:
             await websocket.send_text(message)
@@ -87,12 +310,23 @@ class ConnectionManager:
         """Отправляет сообщение конкретной сессии"""
         if session_id in self.user_sessions:
             session_data = self.user_sessions[session_id]
+            if session_data.get('remote_worker'):
+                # WebSocket этой сессии открыт на другом воркере
+                await self.backend.publish(session_data['remote_worker'], {
+                    'type': 'message', 'session_id': session_id, 'message': message
+                })
+                return
+            if session_data['websocket'] is None:
+                # Сессия без WebSocket: сообщение ждет клиента SSE или long-poll
+                status_board.push_message(session_id, message)
+                session_data['last_activity'] = time.time()
+                return
             try:
                 await session_data['websocket'].send_text(message)
                 session_data['last_activity'] = time.time()
                 self.last_activity = time.time()
             except Exception as e:
-                print(f"Ошибка отправки сообщения сессии {session_id}: {e}")
+                logger.warning("Ошибка отправки сообщения сессии %s: %s", session_id, e)
                 self.disconnect(session_data['websocket'])
 
     async def broadcast(self, message: str):
@@ -111,12 +345,25 @@ class ConnectionManager:
         for conn in disconnected:
             self.disconnect(conn)
 
+    def set_session_encoding(self, session_id: str, encoding: str):
+        """Сохраняет кодировку больших сообщений для сессии"""
+        if session_id in self.user_sessions:
+            self.user_sessions[session_id]['encoding'] = encoding
+
+    def get_session_encoding(self, session_id: str) -> str:
+        """Возвращает кодировку больших сообщений для сессии"""
+        if session_id not in self.user_sessions:
+            return ENCODING_JSON
+        return self.user_sessions[session_id]['encoding']
+
     def has_active_connections(self) -> bool:
         """Проверяет, есть ли активные соединения"""
         return len(self.active_connections) > 0
 
     def get_session_by_websocket(self, websocket: WebSocket):
         """Получает сессию по WebSocket"""
+        if websocket is None:
+            return None, None
         for session_id, session_data in self.user_sessions.items():
             if session_data['websocket'] == websocket:
                 return session_id, session_data
@@ -154,6 +401,16 @@ class ConnectionManager:
             "generation_initiator": session_data['generation_initiator']
         }
 
+    async def fetch_session_generation_status(self, session_id: str) -> dict:
+        """
+        Возвращает статус генерации сессии. Общий реестр важнее локальных флагов:
+        генерация могла быть запущена запросом, попавшим на другой воркер.
+        """
+        shared = await self.backend.get_session(session_id)
+        if shared:
+            return {field: shared[field] for field in STATUS_FIELDS}
+        return self.get_session_generation_status(session_id)
+
     def should_stop_generation_for_session(self, session_id: str) -> bool:
         """Проверяет, нужно ли остановить генерацию для конкретной сессии"""
         if session_id not in self.user_sessions:
@@ -189,10 +446,11 @@ class ConnectionManager:
             if session_data['generation_task'] and not session_data['generation_task'].done():
                 session_data['generation_task'].cancel()
             if session_data['generation_active']:
-                print(f"Генерация отменена для сессии {session_id[:8]} - остановка по запросу")
+                logger.info("Генерация отменена для сессии %s - остановка по запросу", session_id[:8])
             session_data['generation_active'] = False
             session_data['generation_paused'] = False
             session_data['generation_initiator'] = False
+            self._sync_status(session_id)
 
     def start_generation_for_session(self, session_id: str):
         """Запускает генерацию для конкретной сессии"""
@@ -201,3 +459,4 @@ class ConnectionManager:
             self.user_sessions[session_id]['generation_paused'] = False
             self.user_sessions[session_id]['generation_initiator'] = True
             self.user_sessions[session_id]['pause_start_time'] = None
+            self._sync_status(session_id)
@@ -1,6 +1,8 @@
 import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 import stateManager from './stateManager';
+import { SUPPORTED_ENCODINGS } from './messageCodec';
+import { startMessageProcessing } from './messageProcessing';
 
 function App() {
   // Используем централизованное состояние
@@ -9,15 +11,35 @@ function App() {
   const [status, setStatus] = useState(stateManager.getValue('status') || '');
   const [statusType, setStatusType] = useState(stateManager.getValue('statusType') || '');
   const [wsConnected, setWsConnected] = useState(stateManager.getValue('wsConnected') || false);
-  const [reconnectAttempts, setReconnectAttempts] = useState(stateManager.getValue('reconnectAttempts') || 0);
   const [sessionId, setSessionId] = useState(stateManager.getValue('sessionId') || null);
   
   const wsRef = useRef(null);
   const reconnectTimeoutRef = useRef(null);
   const pingIntervalRef = useRef(null);
+  const messageProcessorRef = useRef(null);
+  const statusStreamRef = useRef(null);
   const maxReconnectAttempts = 3;
   const reconnectDelay = 5000; // 5 секунд между попытками
 
+  // Получаем session_id из URL или создаем новый
+  const getSessionId = () => {
+    const urlParams = new URLSearchParams(window.location.search);
+    let currentSessionId = urlParams.get('session_id');
+    
+    if (!currentSessionId) {
+      // Если нет session_id в URL, генерируем новый UUID и обновляем URL
+      currentSessionId = 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
+        const r = Math.random() * 16 | 0;
+        const v = c == 'x' ? r : (r & 0x3 | 0x8);
+        return v.toString(16);
+      });
+      const newUrl = new URL(window.location);
+      newUrl.searchParams.set('session_id', currentSessionId);
+      window.history.replaceState({}, '', newUrl);
+    }
+    return currentSessionId;
+  };
+
   // WebSocket connection functions
   const connectWebSocket = () => {
     // Предотвращаем создание множественных соединений
@@ -31,6 +53,16 @@ function App() {
       wsRef.current.close();
     }
     
+    // Разбор и декодирование сообщений выполняются в Web Worker; компании, уже показанные
+    // во вкладке (если она стала лидером после закрытия другой), передаются ему один раз
+    if (!messageProcessorRef.current) {
+      const shownCompanies = stateManager.getValue('companies') || [];
+      messageProcessorRef.current = startMessageProcessing(
+        handleWebSocketMessage,
+        shownCompanies.length > 0 ? { companies: shownCompanies, resultId: stateManager.getValue('resultId') } : null
+      );
+    }
+    
     try {
       // Определяем WebSocket URL динамически
       const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
@@ -46,28 +78,16 @@ function App() {
         stateManager.setWsConnected(true);
         stateManager.setReconnectAttempts(0);
         
-        // Получаем session_id из URL или создаем новый
-        const urlParams = new URLSearchParams(window.location.search);
-        let currentSessionId = urlParams.get('session_id');
-        
-        if (!currentSessionId) {
-          // Если нет session_id в URL, генерируем новый UUID и обновляем URL
-          currentSessionId = 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
-            const r = Math.random() * 16 | 0;
-            const v = c == 'x' ? r : (r & 0x3 | 0x8);
-            return v.toString(16);
-          });
-          const newUrl = new URL(window.location);
-          newUrl.searchParams.set('session_id', currentSessionId);
-          window.history.replaceState({}, '', newUrl);
-        }
-        
+        const currentSessionId = getSessionId();
         stateManager.setSessionId(currentSessionId);
         console.log('Session ID:', currentSessionId);
         
         // Отправляем session_id серверу
         ws.send(`session_id:${currentSessionId}`);
         
+        // Предлагаем компактную кодировку для больших сообщений (JSON - запасной вариант)
+        ws.send(`encoding:${SUPPORTED_ENCODINGS}`);
+        
         // Проверяем статус генерации при подключении
         checkGenerationStatus(currentSessionId);
         
@@ -83,20 +103,22 @@ function App() {
       };
 
       ws.onmessage = (event) => {
-        try {
-          const data = event.data;
-          
-          // Обработка pong ответа
-          if (data === 'pong') {
-            return;
-          }
-          
-          // Обработка JSON сообщений
-          const parsedData = JSON.parse(data);
-          handleWebSocketMessage(parsedData);
-        } catch (error) {
-          console.error('Error parsing WebSocket message:', error);
+        const data = event.data;
+        
+        // Обработка pong ответа
+        if (data === 'pong') {
+          return;
         }
+        
+        // Подтверждение выбранной сервером кодировки
+        if (data.startsWith('encoding:')) {
+          console.log('WebSocket encoding:', data.split(':')[1]);
+          return;
+        }
+        
+        // JSON сообщения разбираются в воркере; компании приходят в stateManager частями
+        // через BroadcastChannel, сюда возвращается сообщение без них
+        messageProcessorRef.current.process(data);
       };
 
       ws.onclose = () => {
@@ -109,11 +131,16 @@ function App() {
           pingIntervalRef.current = null;
         }
         
-        if (reconnectAttempts < maxReconnectAttempts) {
+        // Счетчик берется из stateManager: значение из замыкания не меняется между попытками
+        const attempts = stateManager.getValue('reconnectAttempts') || 0;
+        if (attempts < maxReconnectAttempts) {
           reconnectTimeoutRef.current = setTimeout(() => {
-            stateManager.setReconnectAttempts(reconnectAttempts + 1);
+            stateManager.setReconnectAttempts(attempts + 1);
             connectWebSocket();
           }, reconnectDelay);
+        } else {
+          // WebSocket не проходит (например, его режет прокси) - статус и сообщения через SSE
+          startStatusStream();
         }
       };
 
@@ -122,24 +149,159 @@ function App() {
       };
     } catch (error) {
       console.error('Error creating WebSocket:', error);
+      startStatusStream();
+    }
+  };
+
+  // Статус сессии из SSE/long-poll: генерация идет, ее фаза и ход батчей
+  const applySessionStatus = (status) => {
+    if (!status.generation_active) {
+      return;
+    }
+    stateManager.setLoading(true);
+    if (status.progress) {
+      const { label, done, total } = status.progress;
+      stateManager.setStatus(total ? `${label}: ${done} из ${total}` : `${label}: ${done}`, 'loading');
+    } else if (status.generation_paused) {
+      stateManager.setStatus('Генерация приостановлена. Ожидание возобновления...', 'loading');
+    } else {
+      stateManager.setStatus('Генерация данных в процессе...', 'loading');
+    }
+  };
+
+  // Запасной канал без WebSocket: EventSource (/stream), а без него - long-poll (/poll).
+  // Сессия открывается POST /generation-status/{session_id}; сервер держит ее, пока канал открыт,
+  // и складывает ее сообщения в журнал, откуда они приходят сюда в том же виде, что и по WebSocket
+  const startStatusStream = () => {
+    if (statusStreamRef.current) {
+      return;
+    }
+    const currentSessionId = getSessionId();
+    stateManager.setSessionId(currentSessionId);
+    const baseUrl = `${window.location.protocol}//${window.location.host}/generation-status/${currentSessionId}`;
+    const processMessage = (data) => messageProcessorRef.current && messageProcessorRef.current.process(data);
+    const openSession = async () => {
+      const response = await fetch(baseUrl, { method: 'POST' });
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+      }
+    };
+
+    let stopped = false;
+    let source = null;
+    const channel = {
+      stop: () => {
+        stopped = true;
+        if (source) {
+          source.close();
+        }
+      }
+    };
+    statusStreamRef.current = channel;
+
+    // Сессия закрыта сервером или не открылась - через reconnectDelay открываем канал заново
+    const restart = () => {
+      stateManager.setWsConnected(false);
+      if (stopped) {
+        return;
+      }
+      channel.stop();
+      statusStreamRef.current = null;
+      reconnectTimeoutRef.current = setTimeout(startStatusStream, reconnectDelay);
+    };
+
+    if (typeof EventSource !== 'undefined') {
+      openSession().then(() => {
+        if (stopped) {
+          return;
+        }
+        // EventSource сам переподключается и передает Last-Event-ID, пропущенные события сервер повторит.
+        // На ответ 404 (сессия закрыта по неактивности) он не переподключается - тогда открываем сессию снова
+        source = new EventSource(`${baseUrl}/stream`);
+        source.addEventListener('status', (event) => applySessionStatus(JSON.parse(event.data)));
+        source.onmessage = (event) => processMessage(event.data);
+        source.onopen = () => stateManager.setWsConnected(true);
+        source.onerror = () => {
+          if (source.readyState === EventSource.CLOSED) {
+            restart();
+          } else {
+            stateManager.setWsConnected(false);
+          }
+        };
+        source.addEventListener('closed', restart);
+      }).catch(restart);
+      return;
     }
+
+    const poll = async () => {
+      let version = null;
+      let opened = false;
+      while (!stopped) {
+        try {
+          if (!opened) {
+            await openSession();
+            opened = true;
+          }
+          const query = version === null ? '' : `?version=${version}`;
+          const response = await fetch(`${baseUrl}/poll${query}`);
+          if (response.status === 200) {
+            const data = await response.json();
+            stateManager.setWsConnected(true);
+            version = data.version;
+            data.events.forEach((event) => {
+              if (event.type === 'status') {
+                applySessionStatus(event.data);
+              } else {
+                processMessage(event.data);
+              }
+            });
+            if (data.closed) {
+              // Сессия закрыта - следующий запрос откроет ее снова
+              version = null;
+              opened = false;
+            }
+          } else if (response.status === 404) {
+            version = null;
+            opened = false;
+          } else if (response.status !== 304) {
+            throw new Error(`HTTP ${response.status}`);
+          }
+        } catch (error) {
+          stateManager.setWsConnected(false);
+          await new Promise((resolve) => setTimeout(resolve, reconnectDelay));
+        }
+      }
+    };
+    poll();
   };
 
+  // Сообщения от обработчика в воркере: вместо массива companies в них только count
   const handleWebSocketMessage = (data) => {
     switch (data.type) {
       case 'complete':
         stateManager.setStatus(data.message, 'success');
         stateManager.setLoading(false);
         
-        // Устанавливаем сгенерированные компании из WebSocket сообщения
-        if (data.companies) {
-          stateManager.setCompanies(data.companies);
+        if (data.streamed) {
+          // Потоковый режим: компании уже пришли частями result_chunk
+          stateManager.setStatus(`${data.message} (компаний: ${data.total})`, 'success');
         }
         break;
+      case 'result_chunk':
+        // Часть результата потоковой генерации; в списке остаются первые STREAM_DISPLAY_LIMIT компаний
+        stateManager.setStatus(`Получено компаний: ${data.offset + data.count}`, 'loading');
+        break;
+      case 'parse_error':
+        console.error('Error parsing WebSocket message:', data.message);
+        break;
       case 'error':
         stateManager.setStatus(data.message, 'error');
         stateManager.setLoading(false);
         break;
+      case 'progress':
+        // Ход массового импорта
+        stateManager.setStatus(data.message, 'loading');
+        break;
       default:
         console.log('Unknown message type:', data.type);
     }
@@ -154,7 +316,6 @@ function App() {
       setStatusType(data.statusType);
     });
     const unsubscribeWsConnected = stateManager.subscribe('wsConnected', setWsConnected);
-    const unsubscribeReconnectAttempts = stateManager.subscribe('reconnectAttempts', setReconnectAttempts);
     const unsubscribeSessionId = stateManager.subscribe('sessionId', setSessionId);
 
     return () => {
@@ -162,16 +323,18 @@ function App() {
       unsubscribeLoading();
       unsubscribeStatus();
       unsubscribeWsConnected();
-      unsubscribeReconnectAttempts();
       unsubscribeSessionId();
     };
   }, []);
 
-  // Auto-connect WebSocket on component mount
+  // Auto-connect WebSocket on component mount.
+  // Соединение открывает только вкладка-лидер, остальные вкладки получают
+  // события через BroadcastChannel и подключаются, если лидер закрылся.
   useEffect(() => {
-    connectWebSocket();
+    const resignLeadership = stateManager.requestLeadership(connectWebSocket);
     
     return () => {
+      resignLeadership();
       if (wsRef.current) {
         wsRef.current.close();
       }
@@ -181,6 +344,14 @@ function App() {
       if (pingIntervalRef.current) {
         clearInterval(pingIntervalRef.current);
       }
+      if (statusStreamRef.current) {
+        statusStreamRef.current.stop();
+        statusStreamRef.current = null;
+      }
+      if (messageProcessorRef.current) {
+        messageProcessorRef.current.stop();
+        messageProcessorRef.current = null;
+      }
     };
   }, []); // eslint-disable-line react-hooks/exhaustive-deps
 
@@ -0,0 +1,126 @@
+// Декодирование больших WebSocket сообщений.
+// Сервер может отправлять компании в колоночном формате (см. backend/message_encoding.py),
+// если клиент предложил его при подключении. Модуль используется и в messageWorker.js,
+// поэтому не обращается к DOM и stateManager.
+
+export const SUPPORTED_ENCODINGS = 'columnar,json';
+
+// Восстанавливает массив компаний с контактами из колоночного формата
+export function decodeCompaniesColumnar(encoded) {
+  const { fields, columns, contacts_count: contactsCount, contact_fields: contactFields, contact_columns: contactColumns } = encoded;
+  const companies = new Array(contactsCount.length);
+  let contactIndex = 0;
+
+  for (let i = 0; i < contactsCount.length; i++) {
+    const company = {};
+    for (let f = 0; f < fields.length; f++) {
+      company[fields[f]] = columns[f][i];
+    }
+
+    const contacts = new Array(contactsCount[i]);
+    for (let c = 0; c < contactsCount[i]; c++, contactIndex++) {
+      const contact = {};
+      for (let f = 0; f < contactFields.length; f++) {
+        contact[contactFields[f]] = contactColumns[f][contactIndex];
+      }
+      contacts[c] = contact;
+    }
+    company.contacts = contacts;
+    companies[i] = company;
+  }
+
+  return companies;
+}
+
+// Возвращает компании из сообщения независимо от кодировки
+export function decodeCompanies(data) {
+  if (data.encoding === 'columnar') {
+    return decodeCompaniesColumnar(data.companies);
+  }
+  return data.companies;
+}
+
+// Имя канала, через который вкладки обмениваются состоянием (см. stateManager.js)
+export const CHANNEL_NAME = 'bitrix24-contacts';
+// Сколько компаний в одной части, которую получает React
+export const COMPANY_SLICE_SIZE = 200;
+// Сколько компаний потокового результата показывать в списке
+export const STREAM_DISPLAY_LIMIT = 1000;
+
+function newResultId() {
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 8)}`;
+}
+
+// Сообщение без массива компаний - короткая сводка для основного потока
+function summarize(data, count) {
+  const summary = { ...data, count };
+  delete summary.companies;
+  return summary;
+}
+
+// Обработчик сырых WebSocket сообщений (выполняется в messageWorker.js).
+// Разбирает JSON, декодирует компании и рассылает их частями COMPANIES_SLICE по channel всем вкладкам,
+// включая текущую; в post уходит сообщение без компаний. Последний результат хранится здесь же
+// и повторяется по STATE_REQUEST для новых вкладок.
+export function createMessageProcessor(channel, post) {
+  let resultId = null;
+  let companies = [];
+
+  const broadcastSlices = (items, offset) => {
+    if (items.length === 0 && offset === 0) {
+      channel.postMessage({ type: 'COMPANIES_SLICE', data: { resultId, offset, companies: [] } });
+    }
+    for (let i = 0; i < items.length; i += COMPANY_SLICE_SIZE) {
+      channel.postMessage({
+        type: 'COMPANIES_SLICE',
+        data: { resultId, offset: offset + i, companies: items.slice(i, i + COMPANY_SLICE_SIZE) }
+      });
+    }
+  };
+
+  const handle = (raw) => {
+    let data;
+    try {
+      data = JSON.parse(raw);
+    } catch (error) {
+      post({ type: 'parse_error', message: String(error) });
+      return;
+    }
+
+    if (data.type === 'complete' && data.companies) {
+      resultId = newResultId();
+      companies = decodeCompanies(data);
+      broadcastSlices(companies, 0);
+      post(summarize(data, companies.length));
+    } else if (data.type === 'result_chunk') {
+      // Потоковый режим: показываются только первые STREAM_DISPLAY_LIMIT компаний
+      const chunk = decodeCompanies(data);
+      if (data.offset === 0) {
+        resultId = newResultId();
+        companies = [];
+      }
+      const shown = chunk.slice(0, Math.max(0, STREAM_DISPLAY_LIMIT - companies.length));
+      if (shown.length > 0 || data.offset === 0) {
+        broadcastSlices(shown, companies.length);
+        companies = companies.concat(shown);
+      }
+      post(summarize(data, chunk.length));
+    } else {
+      post(data);
+    }
+  };
+
+  // Результат, полученный предыдущим лидером (при смене вкладки-лидера)
+  const seed = (seedCompanies, seedResultId) => {
+    companies = seedCompanies;
+    resultId = seedResultId || (seedCompanies.length > 0 ? newResultId() : null);
+  };
+
+  channel.addEventListener('message', (event) => {
+    if (event.data.type === 'STATE_REQUEST' && resultId) {
+      broadcastSlices(companies, 0);
+    }
+  });
+
+  return { handle, seed };
+}
@@ -0,0 +1,80 @@
+import { COMPANY_SLICE_SIZE, STREAM_DISPLAY_LIMIT, createMessageProcessor, decodeCompanies } from './messageCodec';
+
+// Канал BroadcastChannel в памяти: запоминает отправленные сообщения
+function createChannel() {
+  const listeners = [];
+  return {
+    sent: [],
+    postMessage(message) {
+      this.sent.push(message);
+    },
+    addEventListener(type, listener) {
+      listeners.push(listener);
+    },
+    receive(data) {
+      listeners.forEach((listener) => listener({ data }));
+    }
+  };
+}
+
+function makeCompanies(count, offset = 0) {
+  return Array.from({ length: count }, (_, i) => ({ id: offset + i + 1, title: `Компания ${offset + i + 1}`, contacts: [] }));
+}
+
+test('decodes columnar companies with contacts', () => {
+  const data = {
+    encoding: 'columnar',
+    companies: {
+      fields: ['id', 'title'],
+      columns: [[1, 2], ['A', 'B']],
+      contacts_count: [2, 0],
+      contact_fields: ['id', 'name'],
+      contact_columns: [[10, 11], ['Иван', 'Анна']]
+    }
+  };
+  expect(decodeCompanies(data)).toEqual([
+    { id: 1, title: 'A', contacts: [{ id: 10, name: 'Иван' }, { id: 11, name: 'Анна' }] },
+    { id: 2, title: 'B', contacts: [] }
+  ]);
+  expect(decodeCompanies({ companies: makeCompanies(1) })).toEqual(makeCompanies(1));
+});
+
+test('complete message is split into slices and summarized', () => {
+  const channel = createChannel();
+  const posted = [];
+  const processor = createMessageProcessor(channel, (message) => posted.push(message));
+
+  processor.handle(JSON.stringify({ type: 'complete', message: 'Готово', companies: makeCompanies(COMPANY_SLICE_SIZE + 1) }));
+
+  expect(channel.sent.map((message) => message.data.offset)).toEqual([0, COMPANY_SLICE_SIZE]);
+  expect(channel.sent[1].data.companies).toHaveLength(1);
+  expect(posted).toEqual([{ type: 'complete', message: 'Готово', count: COMPANY_SLICE_SIZE + 1 }]);
+
+  // Новая вкладка запрашивает состояние - результат повторяется с тем же resultId
+  channel.receive({ type: 'STATE_REQUEST' });
+  expect(channel.sent).toHaveLength(4);
+  expect(channel.sent[2].data.resultId).toBe(channel.sent[0].data.resultId);
+});
+
+test('streamed chunks are shown up to the display limit', () => {
+  const channel = createChannel();
+  const posted = [];
+  const processor = createMessageProcessor(channel, (message) => posted.push(message));
+
+  processor.handle(JSON.stringify({ type: 'result_chunk', offset: 0, companies: makeCompanies(STREAM_DISPLAY_LIMIT - 10) }));
+  processor.handle(JSON.stringify({ type: 'result_chunk', offset: STREAM_DISPLAY_LIMIT - 10, companies: makeCompanies(50) }));
+  processor.handle(JSON.stringify({ type: 'result_chunk', offset: STREAM_DISPLAY_LIMIT + 40, companies: makeCompanies(50) }));
+
+  const shown = channel.sent.reduce((total, message) => total + message.data.companies.length, 0);
+  expect(shown).toBe(STREAM_DISPLAY_LIMIT);
+  expect(posted.map((message) => message.count)).toEqual([STREAM_DISPLAY_LIMIT - 10, 50, 50]);
+});
+
+test('invalid JSON is reported instead of thrown', () => {
+  const posted = [];
+  const processor = createMessageProcessor(createChannel(), (message) => posted.push(message));
+  processor.handle('not json');
+  expect(posted[0].type).toBe('parse_error');
+  processor.handle('pong');
+  expect(posted).toHaveLength(2);
+});
@@ -0,0 +1,31 @@
+// Запуск обработки WebSocket сообщений в Web Worker.
+// Если воркер недоступен, тот же обработчик работает в основном потоке.
+import { CHANNEL_NAME, createMessageProcessor } from './messageCodec';
+
+// onMessage получает сообщения без массивов компаний, компании приходят частями через BroadcastChannel.
+// seed - компании, уже показанные во вкладке (при смене лидера).
+// Возвращает { process(raw), stop() }
+export function startMessageProcessing(onMessage, seed) {
+  try {
+    const worker = new Worker(new URL('./messageWorker.js', import.meta.url));
+    worker.onmessage = (event) => onMessage(event.data);
+    if (seed) {
+      worker.postMessage({ seed });
+    }
+    return {
+      process: (raw) => worker.postMessage({ raw }),
+      stop: () => worker.terminate()
+    };
+  } catch (error) {
+    console.warn('Web Worker недоступен, сообщения обрабатываются в основном потоке:', error);
+    const channel = new BroadcastChannel(CHANNEL_NAME);
+    const processor = createMessageProcessor(channel, onMessage);
+    if (seed) {
+      processor.seed(seed.companies, seed.resultId);
+    }
+    return {
+      process: processor.handle,
+      stop: () => channel.close()
+    };
+  }
+}
@@ -0,0 +1,16 @@
+/* eslint-disable no-restricted-globals */
+// Web Worker вкладки-лидера: разбор, декодирование и рассылка больших WebSocket сообщений
+// выполняются здесь, чтобы основной поток не замирал на JSON.parse и structured clone.
+import { CHANNEL_NAME, createMessageProcessor } from './messageCodec';
+
+const channel = new BroadcastChannel(CHANNEL_NAME);
+const processor = createMessageProcessor(channel, (message) => self.postMessage(message));
+
+self.onmessage = (event) => {
+  const { raw, seed } = event.data;
+  if (seed) {
+    processor.seed(seed.companies, seed.resultId);
+  } else {
+    processor.handle(raw);
+  }
+};
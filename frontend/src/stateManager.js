@@ -1,8 +1,17 @@
 // Централизованное управление состоянием через BroadcastChannel
+import { CHANNEL_NAME } from './messageCodec';
+
+const LEADER_LOCK_NAME = 'bitrix24-contacts-ws-leader';
+
 class StateManager {
   constructor() {
-    this.channel = new BroadcastChannel('bitrix24-contacts');
+    this.channel = new BroadcastChannel(CHANNEL_NAME);
     this.listeners = new Map();
+    // Лидер - единственная вкладка, которая держит WebSocket
+    this.isLeader = false;
+    this.releaseLeadership = null;
+    // Части результата объединяются, а слушатели companies вызываются не чаще раза за кадр
+    this.companiesFrame = null;
     this.state = {
       sessionId: null,
       wsConnected: false,
@@ -10,10 +19,15 @@ class StateManager {
       status: '',
       statusType: '',
       companies: [],
+      // Результат, к которому относятся companies (части COMPANIES_SLICE из messageWorker.js)
+      resultId: null,
       reconnectAttempts: 0
     };
     
     this.setupChannel();
+
+    // Запрашиваем актуальное состояние у уже открытых вкладок
+    this.channel.postMessage({ type: 'STATE_REQUEST', data: {} });
   }
 
   setupChannel() {
@@ -43,12 +57,29 @@ class StateManager {
           break;
         case 'COMPANIES_UPDATE':
           this.state.companies = data.companies;
+          this.state.resultId = null;
           this.notifyListeners('companies', data.companies);
           break;
+        case 'COMPANIES_SLICE':
+          this.applyCompaniesSlice(data);
+          break;
         case 'RECONNECT_ATTEMPTS':
           this.state.reconnectAttempts = data.attempts;
           this.notifyListeners('reconnectAttempts', data.attempts);
           break;
+        case 'STATE_REQUEST':
+          // Новая вкладка просит состояние - отвечает только лидер.
+          // Компании повторяет частями обработчик сообщений лидера, без клонирования в основном потоке
+          if (this.isLeader) {
+            const { companies, resultId, ...state } = this.getState();
+            this.channel.postMessage({
+              type: 'STATE_UPDATE',
+              data: state
+            });
+          }
+          break;
+        default:
+          break;
       }
     });
   }
@@ -87,8 +118,15 @@ class StateManager {
   updateState(newState) {
     Object.assign(this.state, newState);
     Object.keys(newState).forEach(key => {
+      if (key === 'status' || key === 'statusType') {
+        return;
+      }
       this.notifyListeners(key, newState[key]);
     });
+    // Слушатели статуса ожидают пару status/statusType
+    if ('status' in newState || 'statusType' in newState) {
+      this.notifyListeners('status', { status: this.state.status, statusType: this.state.statusType });
+    }
   }
 
   // Методы для отправки событий
@@ -131,8 +169,39 @@ class StateManager {
     });
   }
 
+  // Часть результата: начало нового результата заменяет список, следующие части дописываются по порядку,
+  // повторы уже полученных частей пропускаются
+  applyCompaniesSlice({ resultId, offset, companies }) {
+    if (resultId !== this.state.resultId) {
+      if (offset !== 0) {
+        return;
+      }
+      this.state.resultId = resultId;
+      this.state.companies = [];
+    }
+    if (offset !== this.state.companies.length) {
+      return;
+    }
+    this.state.companies = this.state.companies.concat(companies);
+    this.scheduleCompaniesNotify();
+  }
+
+  scheduleCompaniesNotify() {
+    if (this.companiesFrame) {
+      return;
+    }
+    const nextFrame = typeof requestAnimationFrame === 'function'
+      ? requestAnimationFrame
+      : (callback) => setTimeout(callback, 16);
+    this.companiesFrame = nextFrame(() => {
+      this.companiesFrame = null;
+      this.notifyListeners('companies', this.state.companies);
+    });
+  }
+
   setCompanies(companies) {
     this.state.companies = companies;
+    this.state.resultId = null;
     this.notifyListeners('companies', companies);
     this.channel.postMessage({
       type: 'COMPANIES_UPDATE',
@@ -149,6 +218,50 @@ class StateManager {
     });
   }
 
+  // Выбор лидера среди вкладок: WebSocket открывает только вкладка-лидер,
+  // остальные получают события через BroadcastChannel.
+  // onBecomeLeader вызывается, когда вкладка становится лидером
+  // (сразу или после закрытия предыдущего лидера).
+  // Возвращает функцию отказа от лидерства.
+  requestLeadership(onBecomeLeader) {
+    if (!navigator.locks) {
+      // Web Locks API недоступен - каждая вкладка работает сама по себе
+      this.isLeader = true;
+      onBecomeLeader();
+      return () => {
+        this.isLeader = false;
+      };
+    }
+
+    const controller = new AbortController();
+    navigator.locks.request(LEADER_LOCK_NAME, { signal: controller.signal }, () => {
+      this.isLeader = true;
+      console.log('StateManager: вкладка стала лидером');
+      onBecomeLeader();
+      // Держим блокировку, пока вкладка открыта или лидерство не отпущено
+      return new Promise(resolve => {
+        this.releaseLeadership = resolve;
+      });
+    }).catch(error => {
+      if (error.name !== 'AbortError') {
+        console.error('StateManager: ошибка выбора лидера', error);
+      }
+    });
+
+    return () => {
+      controller.abort();
+      this.resignLeadership();
+    };
+  }
+
+  resignLeadership() {
+    if (this.releaseLeadership) {
+      this.releaseLeadership();
+      this.releaseLeadership = null;
+    }
+    this.isLeader = false;
+  }
+
   // Получение текущего состояния
   getState() {
     return { ...this.state };
@@ -161,6 +274,7 @@ class StateManager {
 
   // Закрытие канала
   close() {
+    this.resignLeadership();
     this.channel.close();
     this.listeners.clear();
   }